@@ -0,0 +1,140 @@
+import json
+import os
+import platform
+import tempfile
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+import typer
+
+from needle.vectors import IVFIndex, exact_search
+
+cli = typer.Typer()
+
+
+@dataclass
+class Report:
+    """Machine-readable result of an ANN benchmark run."""
+
+    parameters: Dict[str, object]
+    environment: Dict[str, object]
+    build_s: float = 0
+    exact: Dict[str, float] = field(default_factory=dict)
+    ivf: Dict[str, Dict[str, float]] = field(default_factory=dict)
+    memory: Dict[str, float] = field(default_factory=dict)
+
+
+def make_vectors(rng: np.random.Generator, count: int, dimension: int, clusters: int, noise: float) -> np.ndarray:
+    """Normalized vectors grouped around random topics (embeddings of a corpus)."""
+    centers = rng.standard_normal((clusters, dimension), dtype=np.float32)
+    vectors = centers[rng.integers(clusters, size=count)] + noise * rng.standard_normal((count, dimension), dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def get_latencies(latencies: List[float]) -> Dict[str, float]:
+    """Query latency percentiles (milliseconds)."""
+    return {f"latency_p{p}_ms": round(float(np.percentile(latencies, p)) * 1000, 3) for p in (50, 95, 99)}
+
+
+@cli.command()
+def main(
+    vectors: int = typer.Option(100_000, help="Number of indexed vectors."),
+    dimension: int = typer.Option(256, help="Dimension of the vectors."),
+    clusters: int = typer.Option(1000, help="Number of topics of the synthetic corpus."),
+    noise: float = typer.Option(1.0, help="Spread of the vectors around their topic."),
+    queries: int = typer.Option(200, help="Number of queries."),
+    top_k: int = typer.Option(10, help="Number of neighbours per query (recall@k)."),
+    lists: Optional[int] = typer.Option(None, help="Number of IVF lists (about 4 x sqrt(N) if not set)."),
+    iterations: int = typer.Option(10, help="Number of k-means iterations."),
+    probes: List[int] = typer.Option([1, 4, 8, 16, 32], "--probes", help="Number of lists scored per query."),
+    dtype: str = typer.Option("float32", help="Type of the stored vectors ('float32' or 'float16')."),
+    seed: int = typer.Option(0, help="Seed of the synthetic vectors."),
+    output: Path = typer.Option(Path("ann.json"), help="Path of the JSON report."),
+):
+    """
+    Benchmark the recall and latency of the IVF index against the exact search.
+
+    Examples:
+        python -m benchmarks.ann --vectors 1000000 --probes 4 --probes 16 --output ann.json
+
+    """
+    rng = np.random.default_rng(seed)
+    report = Report(
+        parameters={
+            "vectors": vectors,
+            "dimension": dimension,
+            "clusters": clusters,
+            "noise": noise,
+            "queries": queries,
+            "top_k": top_k,
+            "lists": lists,
+            "iterations": iterations,
+            "dtype": dtype,
+        },
+        environment={"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+    )
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory)
+
+        # Stored as by the ingestion: memory-mapped matrix of normalized vectors
+        matrix = np.lib.format.open_memmap(path / "embeddings.npy", mode="w+", dtype=dtype, shape=(vectors, dimension))
+
+        for start in range(0, vectors, 100_000):
+            matrix[start : start + 100_000] = make_vectors(rng, min(100_000, vectors - start), dimension, clusters, noise)
+
+        matrix.flush()
+
+        # Queries close to indexed vectors (questions about the corpus)
+        targets = np.asarray(matrix[rng.integers(vectors, size=queries)], dtype=np.float32)
+        questions = targets + 0.5 * noise * rng.standard_normal(targets.shape, dtype=np.float32) / np.sqrt(dimension)
+        questions /= np.linalg.norm(questions, axis=1, keepdims=True)
+
+        start = time.perf_counter()
+        index = IVFIndex.build(matrix, path, lists=lists, iterations=iterations)
+        report.build_s = round(time.perf_counter() - start, 3)
+        typer.echo(f"IVF index of {vectors} vectors ({len(index.centroids)} lists) built in {report.build_s} seconds")
+
+        truth, latencies = [], []
+
+        for question in questions:
+            start = time.perf_counter()
+            rows, _ = exact_search(matrix, question, top_k=top_k)
+            latencies.append(time.perf_counter() - start)
+            truth.append(set(rows.tolist()))
+
+        report.exact = get_latencies(latencies)
+        typer.echo(f"exact: {json.dumps(report.exact)}")
+
+        for probe in probes:
+            recalls, latencies = [], []
+
+            for question, expected in zip(questions, truth):
+                start = time.perf_counter()
+                rows, _ = index.search(matrix, question, top_k=top_k, probes=probe)
+                latencies.append(time.perf_counter() - start)
+                recalls.append(len(expected & set(rows.tolist())) / len(expected))
+
+            report.ivf[str(probe)] = {f"recall_at_{top_k}": round(float(np.mean(recalls)), 4), **get_latencies(latencies)}
+            typer.echo(f"ivf probes={probe}: {json.dumps(report.ivf[str(probe)])}")
+
+        # Size on disk (memory-mapped, the pages of the probed lists are loaded)
+        sizes = {name: (path / name).stat().st_size for name in ("embeddings.npy", "ivf_centroids.npy", "ivf_offsets.npy", "ivf_rows.npy")}
+        report.memory = {
+            "vectors_mib_per_million": round(sizes["embeddings.npy"] / vectors * 1e6 / 2**20, 1),
+            "ivf_mib_per_million": round((sizes["ivf_offsets.npy"] + sizes["ivf_rows.npy"]) / vectors * 1e6 / 2**20, 1),
+            "centroids_mib": round(sizes["ivf_centroids.npy"] / 2**20, 2),
+        }
+
+        del matrix, index
+
+    output.write_text(json.dumps(asdict(report), indent=2))
+    typer.echo(f"Memory: {report.memory}")
+    typer.echo(f"Report saved at: '{output}'")
+
+
+if __name__ == "__main__":
+    cli()
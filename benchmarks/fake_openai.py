@@ -0,0 +1,120 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+import time
+from typing import AsyncIterator
+
+import typer
+from fastapi import FastAPI, Request
+from starlette.responses import JSONResponse, StreamingResponse
+
+cli = typer.Typer()
+
+
+def create_app(
+    latency: float = float(os.environ.get("FAKE_OPENAI_LATENCY", 0.2)),
+    tokens_per_second: float = float(os.environ.get("FAKE_OPENAI_TOKENS_PER_SECOND", 50)),
+    completion_tokens: int = int(os.environ.get("FAKE_OPENAI_COMPLETION_TOKENS", 64)),
+    embedding_dimension: int = int(os.environ.get("FAKE_OPENAI_EMBEDDING_DIMENSION", 256)),
+    error_rate: float = float(os.environ.get("FAKE_OPENAI_ERROR_RATE", 0)),
+) -> FastAPI:
+    """
+    Create a local stand-in of the OpenAI API (chat completions and embeddings).
+
+    Args:
+        latency (float): Time before the first token (seconds)
+        tokens_per_second (float): Generation speed after the first token
+        completion_tokens (int): Number of tokens of each completion
+        embedding_dimension (int): Dimension of the embeddings
+        error_rate (float): Fraction of the chat completions rejected with a rate limit (429)
+
+    Returns:
+        FastAPI: Fake OpenAI application (use with `uvicorn --factory`)
+
+    """
+    app = FastAPI()
+
+    def chunk(model: str, content: str = None, finish_reason: str = None) -> str:
+        delta = {} if content is None else {"content": content}
+        data = {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        return f"data: {json.dumps(data)}\n\n"
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        model = body.get("model", "fake")
+        prompt_tokens = sum(len(message["content"].split()) for message in body["messages"])
+        tokens = [f"token{index} " for index in range(completion_tokens)]
+
+        if random.random() < error_rate:  # noqa: S311
+            error = {"message": "Rate limit reached", "type": "rate_limit_exceeded", "code": "rate_limit_exceeded"}
+            return JSONResponse({"error": error}, status_code=429, headers={"Retry-After": "1"})
+
+        if body.get("stream"):
+
+            async def events() -> AsyncIterator[str]:
+                await asyncio.sleep(latency)
+
+                for token in tokens:
+                    yield chunk(model, content=token)
+                    await asyncio.sleep(1 / tokens_per_second)
+
+                yield chunk(model, finish_reason="stop")
+                yield "data: [DONE]\n\n"
+
+            return StreamingResponse(events(), media_type="text/event-stream")
+
+        await asyncio.sleep(latency + completion_tokens / tokens_per_second)
+
+        return {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens},
+        }
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+
+        data = []
+
+        for index, text in enumerate(inputs):
+            # Deterministic pseudo embedding (same text, same vector)
+            digest = hashlib.shake_256(str(text).encode()).digest(embedding_dimension)
+            data.append({"object": "embedding", "index": index, "embedding": [byte / 127.5 - 1 for byte in digest]})
+
+        return {"object": "list", "data": data, "model": body.get("model", "fake"), "usage": {"prompt_tokens": 0, "total_tokens": 0}}
+
+    return app
+
+
+@cli.command()
+def main(
+    host: str = typer.Option("127.0.0.1", help="Address on which the server should listen."),
+    port: int = typer.Option(8100, help="Port on which the server should listen."),
+    latency: float = typer.Option(0.2, help="Time before the first token (seconds)."),
+    tokens_per_second: float = typer.Option(50, help="Generation speed after the first token."),
+    completion_tokens: int = typer.Option(64, help="Number of tokens of each completion."),
+    error_rate: float = typer.Option(0, help="Fraction of the chat completions rejected with a rate limit (429)."),
+):
+    """Start the fake OpenAI server."""
+    import uvicorn
+
+    app = create_app(latency=latency, tokens_per_second=tokens_per_second, completion_tokens=completion_tokens, error_rate=error_rate)
+    uvicorn.run(app, host=host, port=port, log_level="warning")
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,318 @@
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess  # noqa: S404
+import sys
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+import httpx
+import numpy as np
+import typer
+
+from needle import PROJECT_PATH
+
+cli = typer.Typer()
+
+TARGETS = ("api", "api-stream", "gradio")
+
+
+@dataclass
+class Sample:
+    """Measure of a single chat turn."""
+
+    target: str
+    latency: float
+    ttft: float
+    ok: bool = True
+
+
+@dataclass
+class Report:
+    """Machine-readable result of a benchmark run."""
+
+    parameters: Dict[str, object]
+    environment: Dict[str, object]
+    targets: Dict[str, Dict[str, float]] = field(default_factory=dict)
+    memory: Dict[str, float] = field(default_factory=dict)
+    startup_s: float = 0
+
+
+def get_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_http(url: str, timeout: float = 120):
+    """Wait until the URL answers (server started)."""
+    deadline = time.monotonic() + timeout
+
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=1).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+
+        time.sleep(0.25)
+
+    raise TimeoutError(f"Server not ready after {timeout} seconds: '{url}'")
+
+
+@contextmanager
+def start_process(command: List[str], env: Dict[str, str], ready_url: str) -> Iterator[subprocess.Popen]:
+    """Start a server process and stop it at the end of the benchmark."""
+    process = subprocess.Popen(command, env=env, cwd=PROJECT_PATH, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)  # noqa: S603
+
+    try:
+        wait_http(ready_url)
+        yield process
+    finally:
+        process.terminate()
+
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def get_children(pid: int) -> List[int]:
+    """Get the descendant processes (uvicorn workers) of a process (Linux only)."""
+    children = []
+
+    for path in Path("/proc").glob("[0-9]*/stat"):
+        try:
+            # The process name may contain spaces, the parent pid is after the closing parenthesis
+            parent = int(path.read_text().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+
+        if parent == pid:
+            child = int(path.parent.name)
+            children += [child, *get_children(child)]
+
+    return children
+
+
+def get_rss(pid: int) -> Optional[float]:
+    """Resident memory of a process (MiB, Linux only)."""
+    try:
+        for line in Path(f"/proc/{pid}/status").read_text().splitlines():
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+
+    return None
+
+
+async def turn_api(client: httpx.AsyncClient, question: str, history: List[dict]) -> Sample:
+    start = time.perf_counter()
+    response = await client.post("/v1/chat", json={"question": question, "history": history})
+    latency = time.perf_counter() - start
+
+    return Sample("api", latency=latency, ttft=latency, ok=response.status_code == 200)
+
+
+async def turn_api_stream(client: httpx.AsyncClient, question: str, history: List[dict]) -> Sample:
+    start = time.perf_counter()
+    ttft, ok = None, False
+
+    async with client.stream("POST", "/v1/chat/stream", json={"question": question, "history": history}) as response:
+        async for line in response.aiter_lines():
+            if ttft is None and line.startswith("data:"):
+                ttft = time.perf_counter() - start
+
+            if line == "event: done":
+                ok = True
+
+    latency = time.perf_counter() - start
+    return Sample("api-stream", latency=latency, ttft=ttft or latency, ok=ok and response.status_code == 200)
+
+
+async def turn_gradio(client: httpx.AsyncClient, question: str, history: List[dict]) -> Sample:
+    start = time.perf_counter()
+    ttft, ok = None, False
+
+    # Message, history and prompt template (default template)
+    response = await client.post("/app/gradio_api/call/chat", json={"data": [question, history, None]})
+    event_id = response.json()["event_id"]
+
+    async with client.stream("GET", f"/app/gradio_api/call/chat/{event_id}") as response:
+        async for line in response.aiter_lines():
+            if ttft is None and line == "event: generating":
+                ttft = time.perf_counter() - start
+
+            if line == "event: complete":
+                ok = True
+
+            if line == "event: error":
+                break
+
+    latency = time.perf_counter() - start
+    return Sample("gradio", latency=latency, ttft=ttft or latency, ok=ok)
+
+
+TURNS = {"api": turn_api, "api-stream": turn_api_stream, "gradio": turn_gradio}
+
+
+async def run_sessions(base_url: str, target: str, sessions: int, turns: int) -> List[Sample]:
+    """Run concurrent chat sessions of several turns (the history grows at each turn)."""
+    limits = httpx.Limits(max_connections=sessions * 2, max_keepalive_connections=sessions * 2)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=300, limits=limits) as client:
+
+        async def session(index: int) -> List[Sample]:
+            history, samples = [], []
+
+            for turn in range(turns):
+                question = f"Session {index} question {turn}: what is the needle in the haystack?"
+
+                try:
+                    sample = await TURNS[target](client, question, history)
+                except httpx.HTTPError:
+                    sample = Sample(target, latency=float("nan"), ttft=float("nan"), ok=False)
+
+                samples.append(sample)
+                history += [{"role": "user", "content": question}, {"role": "assistant", "content": "answer"}]
+
+            return samples
+
+        results = await asyncio.gather(*(session(index) for index in range(sessions)))
+
+    return [sample for samples in results for sample in samples]
+
+
+def summarize(samples: List[Sample], duration: float) -> Dict[str, float]:
+    """Compute the latency percentiles and throughput of a target."""
+    ok = [sample for sample in samples if sample.ok]
+    latency = np.array([sample.latency for sample in ok]) if ok else np.array([np.nan])
+    ttft = np.array([sample.ttft for sample in ok]) if ok else np.array([np.nan])
+
+    return {
+        "requests": len(samples),
+        "errors": len(samples) - len(ok),
+        "duration_s": round(duration, 3),
+        "requests_per_s": round(len(ok) / duration, 3),
+        **{f"latency_p{p}_ms": round(float(np.percentile(latency, p)) * 1000, 2) for p in (50, 95, 99)},
+        **{f"ttft_p{p}_ms": round(float(np.percentile(ttft, p)) * 1000, 2) for p in (50, 95, 99)},
+    }
+
+
+def compare(report: Dict, baseline: Dict) -> List[str]:
+    """Relative difference of each metric with a previous run."""
+    lines = []
+
+    for target, metrics in report["targets"].items():
+        for name, value in metrics.items():
+            previous = baseline.get("targets", {}).get(target, {}).get(name)
+
+            if previous:
+                lines.append(f"{target:<12} {name:<18} {previous:>12} -> {value:>12} ({(value - previous) / previous:+.1%})")
+
+    return lines
+
+
+@cli.command()
+def main(
+    targets: List[str] = typer.Option(list(TARGETS), "--target", help="Entry points to benchmark (api, api-stream, gradio)."),
+    sessions: int = typer.Option(32, help="Number of concurrent chat sessions."),
+    turns: int = typer.Option(4, help="Number of chat turns per session."),
+    workers: int = typer.Option(1, help="Number of uvicorn workers of the application."),
+    preload: bool = typer.Option(False, help="Build the application once and fork the workers."),
+    latency: float = typer.Option(0.2, help="Time before the first token of the fake OpenAI server (seconds)."),
+    tokens_per_second: float = typer.Option(50, help="Generation speed of the fake OpenAI server."),
+    completion_tokens: int = typer.Option(32, help="Number of tokens of each fake completion."),
+    output: Path = typer.Option(Path("benchmark.json"), help="Path of the JSON report."),
+    baseline: Optional[Path] = typer.Option(None, help="Previous JSON report to compare with."),
+):
+    """
+    Benchmark the application against a local fake OpenAI server.
+
+    Examples:
+        python -m benchmarks.load --sessions 64 --workers 2 --output after.json --baseline before.json
+
+    """
+    unknown = set(targets) - set(TARGETS)
+
+    if unknown:
+        raise typer.BadParameter(f"Unknown targets: {sorted(unknown)}")
+
+    fake_port, app_port = get_free_port(), get_free_port()
+    env = {
+        **os.environ,
+        "FAKE_OPENAI_LATENCY": str(latency),
+        "FAKE_OPENAI_TOKENS_PER_SECOND": str(tokens_per_second),
+        "FAKE_OPENAI_COMPLETION_TOKENS": str(completion_tokens),
+        "OPENAI_API_KEY": "sk-fake",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{fake_port}/v1",
+    }
+
+    fake_command = [
+        sys.executable,
+        "-m",
+        "uvicorn",
+        "benchmarks.fake_openai:create_app",
+        "--factory",
+        "--port",
+        str(fake_port),
+        "--log-level",
+        "warning",
+    ]
+    app_command = [sys.executable, "-m", "needle", "run", "--host", "127.0.0.1", "--port", str(app_port), "--workers", str(workers)]
+    app_command += ["--preload"] if preload else []
+    base_url = f"http://127.0.0.1:{app_port}"
+
+    report = Report(
+        parameters={
+            "targets": targets,
+            "sessions": sessions,
+            "turns": turns,
+            "workers": workers,
+            "preload": preload,
+            "latency": latency,
+            "tokens_per_second": tokens_per_second,
+            "completion_tokens": completion_tokens,
+        },
+        environment={"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+    )
+
+    with start_process(fake_command, env, f"http://127.0.0.1:{fake_port}/docs"):
+        start = time.perf_counter()
+
+        with start_process(app_command, env, f"{base_url}/hello") as server:
+            report.startup_s = round(time.perf_counter() - start, 3)
+            typer.echo(f"Application ready in {report.startup_s} seconds")
+
+            # Warm up the connections and lazy initializations of the workers
+            asyncio.run(run_sessions(base_url, targets[0], sessions=workers * 2, turns=1))
+
+            for target in targets:
+                start = time.perf_counter()
+                samples = asyncio.run(run_sessions(base_url, target, sessions=sessions, turns=turns))
+                report.targets[target] = summarize(samples, time.perf_counter() - start)
+                typer.echo(f"{target}: {json.dumps(report.targets[target])}")
+
+            # Single worker: the server process serves the requests, else its children do
+            for pid in [server.pid, *get_children(server.pid)]:
+                if (rss := get_rss(pid)) is not None:
+                    report.memory[str(pid)] = round(rss, 1)
+
+    result = asdict(report)
+    output.write_text(json.dumps(result, indent=2))
+    typer.echo(f"Memory per process (MiB): {report.memory}")
+    typer.echo(f"Report saved at: '{output}'")
+
+    if baseline is not None:
+        for line in compare(result, json.loads(baseline.read_text())):
+            typer.echo(line)
+
+
+if __name__ == "__main__":
+    cli()
@@ -11,8 +11,13 @@ APP_PATH = SRC_PATH / "needle"
 ENV_PATH = PROJECT_PATH / ".env"
 STATIC_PATH = APP_PATH / "static"
 LOGGING_PATH = PROJECT_PATH / ".log"
-CONFIG_PATH = PROJECT_PATH / "config.toml"
 TEMPLATE_PATH = APP_PATH / "templates"
+INDEX_PATH = PROJECT_PATH / ".index"
+CACHE_PATH = PROJECT_PATH / ".cache" / "responses.sqlite3"
+FEEDBACK_PATH = PROJECT_PATH / ".data" / "feedback.sqlite3"
+SESSION_PATH = PROJECT_PATH / ".cache" / "sessions.sqlite3"
+RATE_LIMIT_PATH = PROJECT_PATH / ".cache" / "ratelimit.sqlite3"
+EMBEDDING_CACHE_PATH = PROJECT_PATH / ".cache" / "embeddings.sqlite3"
 
 # Global settings for the application
 settings = Settings(_env_file=ENV_PATH)
@@ -1,11 +1,28 @@
+import json
 import logging
+import lzma
+import os
+import queue
+import re
+import shutil
+import threading
+import time
+import weakref
+from datetime import datetime, timedelta
 from enum import StrEnum
-from functools import lru_cache
+from pathlib import Path
+from typing import List, Optional
 
 from loguru import logger
 
 from needle import LOGGING_PATH
 
+try:
+    import fcntl
+except ImportError:
+    # Windows, no forked workers: a single process writes and rotates the file
+    fcntl = None
+
 DEFAULT_FORMAT = (
     "<blue>{time:YYYY-MM-DD HH:mm:ss}</blue> | "
     "<level>{level}</level> | <red>"
@@ -73,36 +90,292 @@ def set_level_logging(custom_logger: logging.Logger, logging_level_loguru: Level
     custom_logger.setLevel(logging_level)
 
 
-@lru_cache(maxsize=1)
+def parse_rotation(rotation: str) -> Optional[tuple]:
+    """Parse a daily rotation time ('HH:MM'), None to never rotate."""
+    if not rotation:
+        return None
+
+    match = re.fullmatch(r"(\d{1,2}):(\d{2})", rotation.strip())
+
+    if match is None:
+        raise ValueError(f"Rotation must be a daily time 'HH:MM': '{rotation}'")
+
+    return int(match.group(1)), int(match.group(2))
+
+
+def parse_retention(retention: str) -> Optional[timedelta]:
+    """Parse a retention duration ('N days'), None to keep every file."""
+    if not retention:
+        return None
+
+    match = re.fullmatch(r"(\d+)\s*days?", retention.strip())
+
+    if match is None:
+        raise ValueError(f"Retention must be a number of days 'N days': '{retention}'")
+
+    return timedelta(days=int(match.group(1)))
+
+
+class BackgroundFileSink:
+    """
+    Loguru sink writing the log messages to a file from a background thread.
+
+    Notes:
+        - The serving threads only put the message in a bounded queue, when the queue
+          is full the message is dropped (counted, and reported in the file) instead of waiting.
+        - The writer thread appends the messages by batches with a single `write` on a file
+          opened with O_APPEND, so several worker processes can share the same file.
+        - The rotation is coordinated between the processes with a lock file, the first process
+          renames the file and the others reopen it. The rotated file is compressed (xz) by
+          another background thread.
+        - A forked worker doesn't inherit the writer thread, the live sinks start a new one
+          in the child (see `restart_sinks`).
+
+    Args:
+        path (Path): Path of the log file
+        rotation (str): Daily rotation time ('HH:MM', empty to never rotate)
+        retention (str): Retention of the rotated files ('N days', empty to keep everything)
+        max_queue_size (int): Maximum number of messages waiting to be written
+        batch_size (int): Maximum number of messages written at once
+        flush_interval (float): Maximum time a message waits before being written (seconds)
+        serialize (bool): Messages written as JSON lines (the dropped messages are reported as JSON too)
+
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        rotation: str = "06:00",
+        retention: str = "30 days",
+        max_queue_size: int = 10_000,
+        batch_size: int = 512,
+        flush_interval: float = 0.5,
+        serialize: bool = False,
+    ):
+        self.path = Path(path)
+        self.rotation = parse_rotation(rotation)
+        self.retention = parse_retention(retention)
+        self.max_queue_size = max_queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.serialize = serialize
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.start()
+
+        _sinks.add(self)
+
+    def start(self):
+        """Start the writer thread (with an empty queue and a new file descriptor)."""
+        self.queue: queue.Queue = queue.Queue(maxsize=self.max_queue_size)
+        self.dropped = 0
+        self.fd: Optional[int] = None
+        self.next_rotation = self.get_next_rotation(datetime.now())
+
+        self.thread = threading.Thread(target=self.loop, name="log-writer", daemon=True)
+        self.thread.start()
+
+    def write(self, message: str):
+        """Queue a formatted message (called by loguru on the logging thread)."""
+        try:
+            self.queue.put_nowait(str(message))
+        except queue.Full:
+            # Imported on use, the CLI sets the metrics directory before the first import of the metrics
+            from needle.metrics import LOG_DROPPED
+
+            self.dropped += 1
+            LOG_DROPPED.inc()
+
+    def stop(self):
+        """Write the remaining messages and stop the writer thread (called by loguru on removal)."""
+        _sinks.discard(self)
+
+        self.queue.put(None)
+        self.thread.join(timeout=5)
+
+    def loop(self):
+        """Write the queued messages by batches until the sink is stopped."""
+        running = True
+
+        while running:
+            messages: List[str] = [self.queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+
+            # Wait a little to group the messages in a single write
+            while len(messages) < self.batch_size:
+                timeout = deadline - time.monotonic()
+
+                try:
+                    messages.append(self.queue.get(timeout=timeout) if timeout > 0 else self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            if None in messages:
+                messages = [message for message in messages if message is not None]
+                running = False
+
+            if self.dropped:
+                dropped, self.dropped = self.dropped, 0
+                messages.append(self.get_dropped_message(dropped))
+
+            try:
+                self.write_batch(messages)
+            except OSError as exception:
+                # Never raise in the writer thread, the logs would silently stop
+                print(f"Failed to write {len(messages)} log messages: {exception}")  # noqa: T201
+
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def get_dropped_message(self, dropped: int) -> str:
+        """Message reporting the dropped messages (same format as the other lines of the file)."""
+        now = datetime.now().astimezone()
+        text = f"{now:%Y-%m-%d %H:%M:%S} | WARNING | {dropped} log messages dropped (queue full)"
+
+        if not self.serialize:
+            return f"{text}\n"
+
+        # Same fields as the records serialized by loguru
+        record = {
+            "level": {"name": "WARNING", "no": logging.WARNING},
+            "message": f"{dropped} log messages dropped (queue full)",
+            "name": __name__,
+            "process": {"id": os.getpid()},
+            "time": {"repr": str(now), "timestamp": now.timestamp()},
+            "extra": {"dropped": dropped},
+        }
+        return json.dumps({"text": text, "record": record}) + "\n"
+
+    def write_batch(self, messages: List[str]):
+        """Append the messages to the log file (rotate it first if needed)."""
+        if self.rotation is not None and datetime.now() >= self.next_rotation:
+            self.rotate()
+
+        # Another process rotated the file, open the new one
+        if self.fd is not None and not self.is_current():
+            os.close(self.fd)
+            self.fd = None
+
+        if self.fd is None:
+            self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+        if messages:
+            os.write(self.fd, "".join(messages).encode())
+
+    def is_current(self) -> bool:
+        """Check if the open file descriptor is still the one of the log file."""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+
+        fstat = os.fstat(self.fd)
+        return (stat.st_dev, stat.st_ino) == (fstat.st_dev, fstat.st_ino)
+
+    def get_next_rotation(self, now: datetime) -> datetime:
+        """Get the next rotation moment after the given time."""
+        if self.rotation is None:
+            return datetime.max
+
+        hour, minute = self.rotation
+        moment = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        return moment if moment > now else moment + timedelta(days=1)
+
+    def rotate(self):
+        """Rename the log file (once for all the processes) and compress it in background."""
+        period = self.next_rotation - timedelta(days=1)
+        rotated = self.path.with_name(f"{self.path.stem}.{period:%Y-%m-%d_%H-%M}{self.path.suffix}")
+        self.next_rotation = self.get_next_rotation(datetime.now())
+
+        with open(self.path.with_name(f"{self.path.name}.lock"), "w") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+
+            # The first process renames the file, the others only reopen it
+            if not rotated.exists() and not rotated.with_name(f"{rotated.name}.xz").exists() and self.path.exists():
+                self.path.rename(rotated)
+                threading.Thread(target=self.compress, name="log-compress", daemon=True).start()
+
+    def compress(self, delay: float = 5):
+        """Compress the rotated files (xz) and remove the files older than the retention."""
+        # Let the other processes notice the rotation and write their last messages
+        time.sleep(delay)
+
+        try:
+            # Also compress the files left by a process stopped before compressing
+            for path in self.path.parent.glob(f"{self.path.stem}.*{self.path.suffix}"):
+                with open(path, "rb") as source, lzma.open(path.with_name(f"{path.name}.xz"), "wb") as target:
+                    shutil.copyfileobj(source, target)
+
+                path.unlink()
+
+            if self.retention is not None:
+                limit = time.time() - self.retention.total_seconds()
+
+                for file in self.path.parent.glob(f"{self.path.stem}.*{self.path.suffix}.xz"):
+                    if file.stat().st_mtime < limit:
+                        file.unlink()
+        except OSError as exception:
+            logger.error(f"Failed to compress the rotated log files of '{self.path}': {exception}")
+
+
+# Sinks not removed from loguru (a removed sink is stopped, it's never restarted)
+_sinks: "weakref.WeakSet[BackgroundFileSink]" = weakref.WeakSet()
+
+
+def restart_sinks():
+    """Start the writer thread of the live sinks in a forked worker (the threads aren't inherited)."""
+    for sink in list(_sinks):
+        sink.start()
+
+
+# A single hook for every sink (Windows has no fork)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=restart_sinks)
+
+# Handler of the file sink, replaced when the logger is setup again (worker processes)
+_handler_id: Optional[int] = None
+
+
 def setup_logger(
     name: str = "app",
     rotation: str = "06:00",
     retention: str = "30 days",
     level: Level = Level.DEBUG,
     format_: str = DEFAULT_FORMAT,
+    serialize: bool = False,
+    max_queue_size: int = 10_000,
 ):
     """
     Setup the logger for the application.
 
     Args:
         name (str): The name of the logger.
-        rotation (str): The rotation time for the logging file.
-        retention (str): The retention time for the logging file.
+        rotation (str): The daily rotation time for the logging file ('HH:MM').
+        retention (str): The retention time for the logging file ('N days').
         level (Level): The logging level for the application.
         format_ (str): The format of the logging message.
+        serialize (bool): Write the messages as JSON lines (structured logs).
+        max_queue_size (int): Maximum number of messages waiting to be written (dropped beyond).
 
     """
+    global _handler_id
+
     log_file = LOGGING_PATH / f"{name}.log"
 
-    # Add a new handler for file (will be use for stdout)
-    logger.add(
-        log_file,
-        rotation=rotation,
-        retention=retention,
-        compression="xz",
+    # Setup again (worker process or new settings), replace the previous file handler
+    if _handler_id is not None:
+        logger.remove(_handler_id)
+
+    # Add a new handler for file, written in background (will be use for stdout)
+    _handler_id = logger.add(
+        BackgroundFileSink(log_file, rotation=rotation, retention=retention, max_queue_size=max_queue_size, serialize=serialize),
         format=format_,
         level=level,
         filter=custom_filter,
+        serialize=serialize,
+        colorize=False,
     )
 
     # Change the level of the logger (else not working)
@@ -0,0 +1,213 @@
+import asyncio
+import json
+import math
+from typing import AsyncIterator, List, Literal, Optional
+
+from fastapi import APIRouter, HTTPException, Request
+from loguru import logger
+from openai import OpenAIError
+from pydantic import BaseModel, Field
+from starlette.responses import StreamingResponse
+
+from needle.engine import ChatEngine
+from needle.metrics import RATE_LIMITED
+from needle.prompts import TemplateNotFoundError
+from needle.ratelimit import TooManyRequestsError
+from needle.scheduler import BusyError
+
+
+class ChatMessage(BaseModel):
+    """Message of the conversation history."""
+
+    role: Literal["user", "assistant"]
+    content: str
+
+
+class ChatRequest(BaseModel):
+    """Question asked to the chatbot, with the previous messages of the conversation."""
+
+    question: str = Field(min_length=1)
+    history: List[ChatMessage] = Field(default_factory=list)
+    template: Optional[str] = Field(default=None, description="Prompt template of the request (default template if not set).")
+
+
+class ChatResponse(BaseModel):
+    """Response of the chatbot."""
+
+    response: str
+
+
+class BatchRequest(BaseModel):
+    """Independent questions answered concurrently."""
+
+    requests: List[ChatRequest] = Field(min_length=1, max_length=100)
+
+
+class BatchResponse(BaseModel):
+    """Responses of the chatbot, in the order of the requests."""
+
+    responses: List[ChatResponse]
+
+
+def format_event(data: dict, event: str = "message") -> str:
+    """
+    Format a server-sent event.
+
+    Args:
+        data (dict): Data of the event (JSON encoded)
+        event (str): Name of the event
+
+    Returns:
+        str: Server-sent event
+
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def complete(engine: ChatEngine, request: ChatRequest, client_id: str) -> ChatResponse:
+    """
+    Get the complete response of the chatbot.
+
+    Args:
+        engine (ChatEngine): Chatbot inference engine
+        request (ChatRequest): Question and history of the conversation
+        client_id (str): Client asking for the response
+
+    Returns:
+        ChatResponse: Response of the chatbot
+
+    """
+    history = [message.model_dump() for message in request.history]
+
+    try:
+        response = await engine.complete(request.question, history, client_id=client_id, template=request.template)
+    except TemplateNotFoundError as exception:
+        raise HTTPException(status_code=404, detail=exception.args[0])
+    except BusyError:
+        raise HTTPException(status_code=503, detail="The chatbot is busy, please retry in a few seconds", headers={"Retry-After": "5"})
+    except OpenAIError as exception:
+        raise HTTPException(status_code=502, detail=f"LLM inference failed: {exception}")
+
+    return ChatResponse(response=response)
+
+
+async def acquire_turns(engine: ChatEngine, client_id: str, turns: int, taken: int = 0):
+    """
+    Take a rate limit token per chat turn of a batch request.
+
+    Args:
+        engine (ChatEngine): Chatbot inference engine (its rate limiter, if any)
+        client_id (str): Client sending the batch
+        turns (int): Number of chat turns of the batch
+        taken (int): Tokens already taken for the request (by `RateLimitMiddleware`)
+
+    Raises:
+        HTTPException: If the batch is larger than the bucket (413) or than its tokens left (429).
+
+    """
+    limiter = engine.limiter
+
+    if limiter is None or turns <= taken:
+        return
+
+    if limiter.rate is not None and turns > limiter.burst:
+        raise HTTPException(status_code=413, detail=f"Batch of {turns} chat turns larger than the rate limit burst ({limiter.burst})")
+
+    try:
+        # SQLite transaction, keep it out of the event loop
+        await asyncio.to_thread(limiter.acquire, client_id, turns - taken)
+    except TooManyRequestsError as exception:
+        RATE_LIMITED.labels(reason=exception.reason).inc()
+        raise HTTPException(status_code=429, detail=str(exception), headers={"Retry-After": str(math.ceil(exception.retry_after))})
+
+
+async def stream_events(engine: ChatEngine, request: ChatRequest, client_id: str) -> AsyncIterator[str]:
+    """
+    Stream the response of the chatbot as server-sent events.
+
+    Args:
+        engine (ChatEngine): Chatbot inference engine
+        request (ChatRequest): Question and history of the conversation
+        client_id (str): Client asking for the response
+
+    Returns:
+        AsyncIterator[str]: 'message' events with the new text, then a 'done' (or 'error') event
+
+    """
+    history = [message.model_dump() for message in request.history]
+    response = ""
+
+    try:
+        async for partial in engine.stream(request.question, history, client_id=client_id, template=request.template):
+            if delta := partial[len(response) :]:
+                yield format_event({"delta": delta})
+
+            response = partial
+    except TemplateNotFoundError as exception:
+        yield format_event({"detail": exception.args[0]}, event="error")
+        return
+    except BusyError:
+        yield format_event({"detail": "The chatbot is busy, please retry in a few seconds"}, event="error")
+        return
+    except OpenAIError as exception:
+        logger.error(f"LLM inference failed: {exception}")
+        yield format_event({"detail": f"LLM inference failed: {exception}"}, event="error")
+        return
+    except Exception as exception:
+        # Retrieval, index or connection error: the client still gets a terminal event
+        logger.exception(f"Chat turn failed: {exception!r}")
+        yield format_event({"detail": "The chatbot failed to answer, please retry"}, event="error")
+        return
+
+    yield format_event({"response": response}, event="done")
+
+
+def get_api_router(engine: ChatEngine) -> APIRouter:
+    """
+    Create the routes of the headless chat API.
+
+    Args:
+        engine (ChatEngine): Chatbot inference engine (the one of the Gradio application)
+
+    Returns:
+        APIRouter: Routes '/v1/chat', '/v1/chat/stream' and '/v1/chat/batch'
+
+    """
+    router = APIRouter(prefix="/v1/chat", tags=["chat"])
+
+    @router.post(path="", response_model=ChatResponse)
+    async def chat(request: ChatRequest, http_request: Request):
+        """Answer a question (JSON response once the response is complete)."""
+        client_id = engine.get_client_id(http_request.headers, http_request.client.host if http_request.client else None)
+        return await complete(engine, request, client_id=client_id)
+
+    @router.post(path="/stream")
+    async def chat_stream(request: ChatRequest, http_request: Request):
+        """Answer a question (server-sent events with the new text of the response)."""
+        if request.template is not None and not engine.has_template(request.template):
+            raise HTTPException(status_code=404, detail=f"Prompt template '{request.template}' not found (available: {engine.template_names})")
+
+        client_id = engine.get_client_id(http_request.headers, http_request.client.host if http_request.client else None)
+        events = stream_events(engine, request, client_id=client_id)
+        return StreamingResponse(events, media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+    @router.post(path="/batch", response_model=BatchResponse)
+    async def chat_batch(request: BatchRequest, http_request: Request):
+        """Answer many questions concurrently (bounded by the engine scheduler, a rate limit token per question)."""
+        client_id = engine.get_client_id(http_request.headers, http_request.client.host if http_request.client else None)
+        await acquire_turns(engine, client_id, len(request.requests), taken=getattr(http_request.state, "rate_limit_tokens", 0))
+
+        tasks = [asyncio.ensure_future(complete(engine, item, client_id=client_id)) for item in request.requests]
+
+        try:
+            responses = await asyncio.gather(*tasks)
+        except BaseException:
+            # The first failure fails the batch, the other turns aren't left running (and billed)
+            for task in tasks:
+                task.cancel()
+
+            raise
+
+        return BatchResponse(responses=responses)
+
+    return router
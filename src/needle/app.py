@@ -1,69 +1,374 @@
-import gradio as gr
-from fastapi import FastAPI, HTTPException
-from prometheus_fastapi_instrumentator import Instrumentator
+import asyncio
+import signal
+from typing import TYPE_CHECKING, Dict, Iterable, Optional
 
-from needle import CONFIG_PATH
+from fastapi import FastAPI, HTTPException, Response
+from loguru import logger
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+from needle import CACHE_PATH, FEEDBACK_PATH, RATE_LIMIT_PATH, SESSION_PATH
+from needle._logging import Level, setup_logger
 from needle.exception import http_exception_handler
-from needle.interface import get_gradio_app
-from needle.middleware import LoggingMiddleware
+from needle.metrics import get_registry
+from needle.middleware import LoggingMiddleware, RateLimitMiddleware
 from needle.config import Config
+from needle.startup import log_startup_times, timed
+
+# Heavy imports (gradio, haystack) are deferred until the application is built
+if TYPE_CHECKING:
+    from needle.cache import ResponseCache
+    from needle.connections import ConnectionPool
+    from needle.engine import ChatEngine
+    from needle.feedback import FeedbackStore
+    from needle.ratelimit import RateLimiter
+
+# Settings applied when the application is built only (not by a SIGHUP reload)
+RESTART_SETTINGS = (
+    "debug",
+    "log_level",
+    "log_json",
+    "log_exclude_paths",
+    "log_sample_rates",
+    "cache",
+    "cache_ttl",
+    "cache_max_entries",
+    "cache_similarity",
+    "feedback",
+    "session_backend",
+    "session_ttl",
+    "session_max_entries",
+    "rate_limit",
+    "rate_limit_burst",
+    "rate_limit_paths",
+    "api_keys",
+    "daily_token_quota",
+    "metrics_port",
+    "http_max_connections",
+    "http_max_keepalive",
+    "http_keepalive_expiry",
+    "http_connect_timeout",
+    "http_read_timeout",
+    "http_pool_timeout",
+    "http_retries",
+    "http2",
+    "http_warmup_connections",
+)
 
 
 def get_fastapi_app(
     debug: bool = True,
+    engine: Optional["ChatEngine"] = None,
+    log_exclude_paths: Iterable[str] = ("/metrics",),
+    log_sample_rates: Optional[Dict[str, float]] = None,
+    limiter: Optional["RateLimiter"] = None,
+    rate_limit_paths: Iterable[str] = ("/v1/chat",),
+    api_keys: Iterable[str] = (),
+    expose_metrics: bool = True,
 ):
     """
     Create a FastAPI application with the necessary configurations.
 
+    Args:
+        debug (bool): Enable debug mode.
+        engine (Optional[ChatEngine]): Chatbot inference engine served by the '/v1/chat' routes.
+        log_exclude_paths (Iterable[str]): Path prefixes excluded from the access log.
+        log_sample_rates (Optional[Dict[str, float]]): Fraction of the requests logged per path prefix.
+        limiter (Optional[RateLimiter]): Request rate and token quotas of the clients (no limit if None).
+        rate_limit_paths (Iterable[str]): Path prefixes of the requests limited by the limiter.
+        api_keys (Iterable[str]): Hashes of the accepted API keys identifying the clients.
+        expose_metrics (bool): Serve the metrics on '/metrics' (False when they have their own port).
+
     Returns:
         FastAPI: FastAPI application instance.
 
     """
+    from prometheus_fastapi_instrumentator import Instrumentator
+
     app = FastAPI(debug=debug)
 
-    # Middleware
-    app.add_middleware(LoggingMiddleware)
+    # Middleware (the last added is the outermost, the rejected requests are logged)
+    if limiter is not None:
+        app.add_middleware(RateLimitMiddleware, limiter=limiter, paths=rate_limit_paths, api_keys=api_keys)
+
+    app.add_middleware(LoggingMiddleware, exclude_paths=log_exclude_paths, sample_rates=log_sample_rates)
 
     # Exceptions handlers
     app.add_exception_handler(HTTPException, http_exception_handler)
 
     # Initialize and configure the Prometheus instrument
-    Instrumentator().instrument(app).expose(app)
+    Instrumentator().instrument(app)
+
+    if expose_metrics:
+
+        @app.get(path="/metrics", include_in_schema=False)
+        def metrics():
+            # Metrics of every worker in multiprocess mode (the scrape can hit any of them)
+            return Response(content=generate_latest(get_registry()), media_type=CONTENT_TYPE_LATEST)
 
     @app.get(path="/hello")
     def hello():
         return {"hello": "world"}
 
+    # Headless chat API (same engine as the Gradio application)
+    if engine is not None:
+        from needle.api import get_api_router
+
+        app.include_router(get_api_router(engine))
+
     return app
 
 
-# Check if the script is run by uvicorn
+def get_engine(
+    settings: Config,
+    cache: Optional["ResponseCache"] = None,
+    feedback: Optional["FeedbackStore"] = None,
+    limiter: Optional["RateLimiter"] = None,
+    http_pool: Optional["ConnectionPool"] = None,
+) -> "ChatEngine":
+    """
+    Create the chatbot inference engine with the given settings.
+
+    Args:
+        settings (Config): Settings of the application.
+        cache (Optional[ResponseCache]): Response cache in front of the LLM.
+        feedback (Optional[FeedbackStore]): Store of the chat turns and votes.
+        limiter (Optional[RateLimiter]): Daily token quotas of the clients.
+        http_pool (Optional[ConnectionPool]): HTTP connections of the worker shared by the generators.
 
-# Get config create by CLI
-settings = Config.from_toml(CONFIG_PATH)
+    Returns:
+        ChatEngine: Chatbot inference engine.
 
-"""
-WARNING: Don't use '/' for path, gradio prevents prometheus
-from retrieving information as gradio modifies routes.
-Routes defined as /metrics are hidden by the Gradio application mounted on '/'.
-"""
-# Get the FastAPI application
-app = get_fastapi_app(debug=settings.debug)
+    """
+    from needle.interface import get_chat_engine
 
-# Get the Gradio application
-blocks = get_gradio_app(
-    model_name=settings.model_name,
-    prompt_template=settings.prompt_template,
-)
+    return get_chat_engine(
+        model_name=settings.model_name,
+        prompt_template=settings.prompt_template,
+        streaming=settings.streaming,
+        max_concurrency=settings.max_concurrency,
+        model_concurrency=settings.model_concurrency,
+        max_queue_size=settings.max_queue_size,
+        queue_timeout=settings.queue_timeout,
+        index_path=settings.index_path,
+        top_k=settings.top_k,
+        retrieval=settings.retrieval,
+        ann_probes=settings.ann_probes,
+        embedding_url=settings.embedding_url,
+        hybrid_candidates=settings.hybrid_candidates,
+        rrf_k=settings.rrf_k,
+        rerank_model=settings.rerank_model,
+        rerank_top_n=settings.rerank_top_n,
+        retrieval_budget=settings.retrieval_budget,
+        fallback_routes=[
+            {"max_prompt_tokens": settings.get_context_limit(route["model"]) - settings.completion_tokens, **route}
+            for route in settings.fallback_routes
+        ],
+        route_timeout=settings.route_timeout,
+        hedging=settings.hedging,
+        cache=cache,
+        feedback=feedback,
+        limiter=limiter,
+        http_pool=http_pool,
+        api_keys=settings.api_keys,
+        context_limit=settings.get_context_limit(settings.model_name),
+        completion_tokens=settings.completion_tokens,
+        history_tokens=settings.history_tokens,
+        template_reload_interval=settings.template_reload_interval,
+    )
+
+
+async def reload_settings(settings: Config, engine: "ChatEngine") -> Config:
+    """
+    Reload the settings and update the running engine (model, template, limits).
+
+    Notes:
+        The new engine is built in a thread (index, templates and clients), the streams in
+        progress on the event loop aren't stalled. It's swapped in on the event loop.
+
+    Args:
+        settings (Config): Current settings of the application.
+        engine (ChatEngine): Running chatbot inference engine.
+
+    Returns:
+        Config: New settings (the current ones if the new settings are invalid).
+
+    """
+    try:
+        new_settings = await asyncio.to_thread(Config.from_env)
+        new_engine = await asyncio.to_thread(
+            get_engine, new_settings, cache=engine.cache, feedback=engine.feedback, limiter=engine.limiter, http_pool=engine.http_pool
+        )
+        engine.update(new_engine)
+    except Exception as exception:
+        logger.error(f"Settings not reloaded, the current settings are kept: {exception}")
+        return settings
+
+    ignored = [name for name in RESTART_SETTINGS if getattr(new_settings, name) != getattr(settings, name)]
+
+    if ignored:
+        logger.warning(f"Settings {ignored} are only applied after a restart")
+
+    logger.info(f"Settings reloaded (model: '{new_settings.model_name}', template: '{new_settings.prompt_template}')")
+    return new_settings
+
+
+def create_app(settings: Optional[Config] = None) -> FastAPI:
+    """
+    Build the application served by the workers (chat engine, API and Gradio interface).
+
+    Notes:
+        Usable as an application factory: `uvicorn --factory needle.app:create_app`.
+
+    Args:
+        settings (Optional[Config]): Settings of the application (given by the CLI environment if not set).
+
+    Returns:
+        FastAPI: FastAPI application with the Gradio application mounted on '/app'.
+
+    """
+    with timed("settings"):
+        # Get config given by CLI (and the settings file if any)
+        settings = Config.from_env() if settings is None else settings.validate()
+
+        # Each worker process writes to the log file from its own background thread
+        setup_logger(level=Level(settings.log_level), serialize=settings.log_json)
+
+    with timed("import"):
+        import gradio as gr
+
+        from needle.cache import ResponseCache
+        from needle.connections import ConnectionPool
+        from needle.feedback import FeedbackStore
+        from needle.interface import get_gradio_app
+        from needle.ratelimit import RateLimiter
+        from needle.sessions import get_session_store
+
+    with timed("engine"):
+        # Get the response cache (shared by the workers)
+        cache = None
+
+        if settings.cache:
+            cache = ResponseCache(
+                path=CACHE_PATH,
+                ttl=settings.cache_ttl,
+                max_entries=settings.cache_max_entries,
+                similarity_threshold=settings.cache_similarity,
+            )
+
+        # Get the store of the transcripts and votes (written in the background)
+        feedback = FeedbackStore(path=FEEDBACK_PATH) if settings.feedback else None
+
+        # Get the request rate and token quotas of the clients (shared by the workers)
+        limiter = None
+
+        if settings.rate_limit is not None or settings.daily_token_quota is not None:
+            limiter = RateLimiter(
+                path=RATE_LIMIT_PATH,
+                rate=settings.rate_limit,
+                burst=settings.rate_limit_burst,
+                daily_quota=settings.daily_token_quota,
+            )
+
+        # Get the HTTP connections of the worker (shared by the OpenAI clients of every model)
+        http_pool = ConnectionPool(
+            max_connections=settings.http_max_connections,
+            max_keepalive_connections=settings.http_max_keepalive,
+            keepalive_expiry=settings.http_keepalive_expiry,
+            connect_timeout=settings.http_connect_timeout,
+            read_timeout=settings.http_read_timeout,
+            pool_timeout=settings.http_pool_timeout,
+            retries=settings.http_retries,
+            http2=settings.http2,
+        )
+
+        # Get the chatbot inference engine
+        engine = get_engine(settings, cache=cache, feedback=feedback, limiter=limiter, http_pool=http_pool)
+
+    """
+    WARNING: Don't use '/' for path, gradio prevents prometheus
+    from retrieving information as gradio modifies routes.
+    Routes defined as /metrics are hidden by the Gradio application mounted on '/'.
+    """
+    with timed("fastapi"):
+        # Get the FastAPI application
+        app = get_fastapi_app(
+            debug=settings.debug,
+            engine=engine,
+            log_exclude_paths=settings.log_exclude_paths,
+            log_sample_rates=settings.log_sample_rates,
+            limiter=limiter,
+            rate_limit_paths=settings.rate_limit_paths,
+            api_keys=settings.api_keys,
+            expose_metrics=settings.metrics_port is None,
+        )
+
+    reload_lock = asyncio.Lock()
+    reload_tasks = set()
+
+    async def reload():
+        nonlocal settings
+
+        # A SIGHUP received during a reload is applied after it
+        async with reload_lock:
+            settings = await reload_settings(settings, engine)
+
+    def on_reload_signal():
+        task = asyncio.get_running_loop().create_task(reload())
+        reload_tasks.add(task)
+        task.add_done_callback(reload_tasks.discard)
+
+    async def add_reload_handler():
+        # Hot reload of the settings (each worker has its own event loop)
+        if not hasattr(signal, "SIGHUP"):
+            logger.warning("Settings hot reload disabled, SIGHUP doesn't exist on this platform")
+            return
+
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, on_reload_signal)
+        except (RuntimeError, NotImplementedError, ValueError) as exception:
+            # Event loop outside of the main thread (test client, embedded server)
+            logger.warning(f"Settings hot reload disabled, SIGHUP handler not installed: {exception}")
+
+    async def warm_up():
+        # Connections opened by each worker, the first chat turn doesn't pay the TCP and TLS setup
+        await engine.warm_up(settings.http_warmup_connections)
+
+    app.add_event_handler("startup", add_reload_handler)
+    app.add_event_handler("startup", warm_up)
+    app.add_event_handler("shutdown", http_pool.aclose)
+
+    if feedback is not None:
+        # Write the queued records before the worker exits
+        app.add_event_handler("shutdown", feedback.stop)
+
+    with timed("gradio"):
+        # Get the conversations of the Gradio sessions (shared by the workers with 'sqlite')
+        sessions = get_session_store(
+            backend=settings.session_backend,
+            path=SESSION_PATH,
+            ttl=settings.session_ttl,
+            max_sessions=settings.session_max_entries,
+        )
+
+        # Get the Gradio application
+        blocks = get_gradio_app(engine, sessions=sessions)
+
+        # Mount the Gradio application
+        app = gr.mount_gradio_app(
+            app=app,
+            path="/app",
+            blocks=blocks,
+            show_error=settings.debug,
+        )
+
+    log_startup_times()
+    return app
 
-# Mount the Gradio application
-app = gr.mount_gradio_app(
-    app=app,
-    path="/app",
-    blocks=blocks,
-    show_error=settings.debug,
-)
 
-from needle import settings
+def __getattr__(name: str):
+    """Build the application on first access of 'needle.app:app' (uvicorn import string)."""
+    if name == "app":
+        globals()["app"] = create_app()
+        return globals()["app"]
 
-print(f"Settings 3 : {settings}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
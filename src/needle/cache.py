@@ -0,0 +1,230 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import List, Optional, Union
+
+from needle.metrics import CACHE_EVICTIONS, CACHE_HITS, CACHE_MISSES
+from needle.utils import tokenize
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    namespace TEXT NOT NULL,
+    tokens TEXT NOT NULL,
+    response TEXT NOT NULL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_created ON responses (created);
+CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed);
+
+CREATE TABLE IF NOT EXISTS bands (
+    band INTEGER NOT NULL,
+    key TEXT NOT NULL REFERENCES responses (key) ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS bands_band ON bands (band);
+CREATE INDEX IF NOT EXISTS bands_key ON bands (key);
+"""
+
+
+def make_key(*parts: str) -> str:
+    """Hash the parts of a cache key (template name, model name, prompt, ...)."""
+    return hashlib.sha256("\x1f".join(parts).encode()).hexdigest()
+
+
+def _hash(value: str, salt: int = 0) -> int:
+    """Stable signed 64 bits hash (SQLite integer)."""
+    digest = hashlib.blake2b(value.encode(), digest_size=8, salt=salt.to_bytes(16, "little")).digest()
+    return int.from_bytes(digest, "little", signed=True)
+
+
+def get_bands(namespace: str, tokens: List[str], num_bands: int = 8, band_size: int = 2) -> List[int]:
+    """
+    Get the locality sensitive hashing bands of a tokens set (MinHash).
+
+    Notes:
+        Two sets share at least one band with a high probability when their Jaccard
+        similarity is high, the candidates are found with an index lookup instead of
+        comparing the question with every cached question.
+
+    Args:
+        namespace (str): Bands are only shared inside a namespace (template, model, history)
+        tokens (List[str]): Unique tokens of the question
+        num_bands (int): Number of bands
+        band_size (int): Number of MinHash values per band
+
+    Returns:
+        List[int]: Hash of each band
+
+    """
+    if not tokens:
+        return []
+
+    signature = [min(_hash(token, salt) for token in tokens) for salt in range(num_bands * band_size)]
+    values = [signature[index : index + band_size] for index in range(0, len(signature), band_size)]
+
+    return [_hash(f"{namespace}:{index}:{value}") for index, value in enumerate(values)]
+
+
+class ResponseCache:
+    """
+    Response cache of the LLM pipeline, stored in SQLite (shared between the uvicorn workers).
+
+    Notes:
+        - Exact layer: key built from the template name, model name and rendered prompt.
+        - Similarity layer (optional): a question whose tokens Jaccard similarity with a cached
+          question (same namespace) is above the threshold gets the cached response.
+        - Entries older than the TTL are expired, least recently used entries are evicted
+          once the cache exceeds its maximum size.
+
+    Args:
+        path (Union[str, os.PathLike]): Path of the SQLite database
+        ttl (float): Time to live of a response (seconds)
+        max_entries (int): Maximum number of cached responses
+        similarity_threshold (Optional[float]): Minimum Jaccard similarity of the similarity layer (disabled if None)
+
+    """
+
+    def __init__(
+        self,
+        path: Union[str, os.PathLike],
+        ttl: float = 3600,
+        max_entries: int = 10_000,
+        similarity_threshold: Optional[float] = None,
+    ):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+
+        self._local = threading.local()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection.executescript(SCHEMA)
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """SQLite connection of the current thread (a forked worker opens its own)."""
+        connection = getattr(self._local, "connection", None)
+
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("PRAGMA foreign_keys=ON")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+
+        return connection
+
+    def get(self, key: str, namespace: str, question: str) -> Optional[str]:
+        """
+        Get the cached response of a prompt.
+
+        Args:
+            key (str): Exact key of the prompt (see `make_key`)
+            namespace (str): Namespace of the similarity layer (see `make_key`)
+            question (str): User message (used by the similarity layer)
+
+        Returns:
+            Optional[str]: Cached response, None if missing
+
+        """
+        now = time.time()
+        row = self.connection.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+
+        if row is not None and row[1] < now - self.ttl:
+            self._delete([key], reason="ttl")
+            row = None
+
+        if row is not None:
+            self.connection.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            CACHE_HITS.labels(layer="exact").inc()
+            return row[0]
+
+        if self.similarity_threshold is not None:
+            response = self._get_similar(namespace, question, now)
+
+            if response is not None:
+                CACHE_HITS.labels(layer="similarity").inc()
+                return response
+
+        CACHE_MISSES.inc()
+        return None
+
+    def _get_similar(self, namespace: str, question: str, now: float) -> Optional[str]:
+        """Get the response of the most similar cached question (above the similarity threshold)."""
+        tokens = set(tokenize(question))
+        bands = get_bands(namespace, sorted(tokens))
+
+        if not bands:
+            return None
+
+        rows = self.connection.execute(
+            f"""
+            SELECT DISTINCT r.key, r.tokens, r.response FROM bands b JOIN responses r ON r.key = b.key
+            WHERE b.band IN ({",".join("?" * len(bands))}) AND r.namespace = ? AND r.created >= ?
+            """,  # noqa: S608
+            (*bands, namespace, now - self.ttl),
+        ).fetchall()
+
+        best_key, best_response, best_similarity = None, None, self.similarity_threshold
+
+        for key, candidate_tokens, response in rows:
+            candidate_tokens = set(json.loads(candidate_tokens))
+            similarity = len(tokens & candidate_tokens) / len(tokens | candidate_tokens)
+
+            if similarity >= best_similarity:
+                best_key, best_response, best_similarity = key, response, similarity
+
+        if best_key is not None:
+            self.connection.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, best_key))
+
+        return best_response
+
+    def set(self, key: str, namespace: str, question: str, response: str):
+        """
+        Cache the response of a prompt (evict the expired and least recently used responses).
+
+        Args:
+            key (str): Exact key of the prompt (see `make_key`)
+            namespace (str): Namespace of the similarity layer (see `make_key`)
+            question (str): User message (used by the similarity layer)
+            response (str): Response of the LLM
+
+        """
+        now = time.time()
+        tokens = sorted(set(tokenize(question)))
+
+        with self.connection as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute(
+                "INSERT OR REPLACE INTO responses (key, namespace, tokens, response, created, accessed) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, namespace, json.dumps(tokens), response, now, now),
+            )
+            connection.executemany(
+                "INSERT INTO bands (band, key) VALUES (?, ?)",
+                [(band, key) for band in get_bands(namespace, tokens)],
+            )
+
+            expired = connection.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,)).rowcount
+            (count,) = connection.execute("SELECT COUNT(*) FROM responses").fetchone()
+
+            evicted = 0
+            if count > self.max_entries:
+                evicted = connection.execute(
+                    "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY accessed LIMIT ?)",
+                    (count - self.max_entries,),
+                ).rowcount
+
+        CACHE_EVICTIONS.labels(reason="ttl").inc(expired)
+        CACHE_EVICTIONS.labels(reason="lru").inc(evicted)
+
+    def _delete(self, keys: List[str], reason: str):
+        """Delete the responses of the given keys."""
+        deleted = self.connection.executemany("DELETE FROM responses WHERE key = ?", [(key,) for key in keys]).rowcount
+        CACHE_EVICTIONS.labels(reason=reason).inc(deleted)
@@ -1,13 +1,20 @@
+import json
 import os
+import shutil
+import sys
+import tempfile
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional, Union
 
 import typer
 from loguru import logger
 from typer import Typer
 
-from needle import CONFIG_PATH
+from needle import EMBEDDING_CACHE_PATH, FEEDBACK_PATH, INDEX_PATH
 from needle._logging import setup_logger, Level
 from needle.settings import Environment, get_info_environment, Settings
-from needle.config import Config
+from needle.config import CONFIG_ENV, CONFIG_FILE_ENV, MULTIPROC_ENV, Config
 
 cli = Typer()
 # Create global settings
@@ -19,8 +26,18 @@ def start(
     environment: Environment = typer.Option(Environment.DEVELOPMENT, envvar="ENVIRONMENT", help="Environment to use."),
     app: str = typer.Option("needle.app:app", envvar="APP", help="Application to launch."),
     workers: int = typer.Option(1, help="Number of worker processes to use."),
+    preload: bool = typer.Option(False, envvar="PRELOAD", help="Build the application once and fork the workers from it."),
     debug: bool = typer.Option(False, help="Enable debug mode."),
     log_level: Level = typer.Option(Level.INFO, help="Logging level for the application."),
+    model_name: str = typer.Option("gpt-4o-mini", envvar="MODEL_NAME", help="OpenAI model used by the chatbot."),
+    prompt_template: str = typer.Option("system", envvar="PROMPT_TEMPLATE", help="Prompt template used by the chatbot."),
+    config: Optional[Path] = typer.Option(None, envvar=CONFIG_FILE_ENV, help="Settings file (TOML), reloaded on SIGHUP."),
+    log_json: bool = typer.Option(False, envvar="LOG_JSON", help="Write the log file as JSON lines."),
+    index_path: Optional[Path] = typer.Option(None, envvar="INDEX_PATH", help="Documents index used by the retrieval (no retrieval if not set)."),
+    top_k: int = typer.Option(5, help="Number of documents given to the prompt."),
+    cache: bool = typer.Option(False, envvar="CACHE", help="Enable the response cache."),
+    cache_similarity: Optional[float] = typer.Option(None, help="Minimum similarity of the similarity cache layer (disabled if not set)."),
+    metrics_port: Optional[int] = typer.Option(None, envvar="METRICS_PORT", help="Serve the metrics on this port instead of '/metrics'."),
 ):
     """
     Start the server with the given environment.
@@ -29,8 +46,18 @@ def start(
         environment (Environment): Environment to use.
         app (str): Application source to launch.
         workers (int): Number of worker processes to use.
+        preload (bool): Build the application once and fork the workers from it.
         debug (bool): Enable debug mode.
         log_level (Level): Logging level for the application.
+        model_name (str): OpenAI model used by the chatbot.
+        prompt_template (str): Prompt template used by the chatbot.
+        config (Optional[Path]): Settings file (TOML), reloaded on SIGHUP.
+        log_json (bool): Write the log file as JSON lines.
+        index_path (Optional[Path]): Documents index used by the retrieval.
+        top_k (int): Number of documents given to the prompt.
+        cache (bool): Enable the response cache.
+        cache_similarity (Optional[float]): Minimum similarity of the similarity cache layer.
+        metrics_port (Optional[int]): Serve the metrics on this port instead of '/metrics'.
 
     """
     # Get the settings for the application
@@ -38,7 +65,6 @@ def start(
 
     # Setup the logger for the application
     setup_logger(level=log_level)
-    print(f"Settings : {needle.settings}")
     logger.info(f"Starting the server with environment: '{environment}'")
 
     # Load the settings for the given environment
@@ -46,16 +72,26 @@ def start(
 
     # Update the settings with the new environment
     needle.settings = new_settings(**needle.settings.model_dump(by_alias=True))
+    logger.debug(f"Settings of the environment: {needle.settings}")
 
-    print(f"Settings 2 : {needle.settings}")
-
+    # Every parameter is given, the typer defaults are only resolved from the command line
     run(
         app=app,
         host=needle.settings.host,
         port=needle.settings.port,
         workers=workers,
+        preload=preload,
         debug=debug,
         log_level=log_level,
+        log_json=log_json,
+        model_name=model_name,
+        prompt_template=prompt_template,
+        config=config,
+        index_path=index_path,
+        top_k=top_k,
+        cache=cache,
+        cache_similarity=cache_similarity,
+        metrics_port=metrics_port,
     )
 
 
@@ -65,8 +101,18 @@ def run(
     host: str = typer.Option("localhost", envvar="HOST", help="Address on which the server should listen."),
     port: int = typer.Option(8000, envvar="PORT", help="Port on which the server should listen."),
     workers: int = typer.Option(1, help="Number of worker processes to use."),
+    preload: bool = typer.Option(False, envvar="PRELOAD", help="Build the application once and fork the workers from it."),
     debug: bool = typer.Option(False, envvar="DEBUG", help="Enable debug mode."),
     log_level: Level = typer.Option(Level.INFO, envvar="LOG_LEVEL", help="Logging level for the application."),
+    log_json: bool = typer.Option(False, envvar="LOG_JSON", help="Write the log file as JSON lines."),
+    model_name: str = typer.Option("gpt-4o-mini", envvar="MODEL_NAME", help="OpenAI model used by the chatbot."),
+    prompt_template: str = typer.Option("system", envvar="PROMPT_TEMPLATE", help="Prompt template used by the chatbot."),
+    config: Optional[Path] = typer.Option(None, envvar=CONFIG_FILE_ENV, help="Settings file (TOML), reloaded on SIGHUP."),
+    index_path: Optional[Path] = typer.Option(None, envvar="INDEX_PATH", help="Documents index used by the retrieval (no retrieval if not set)."),
+    top_k: int = typer.Option(5, help="Number of documents given to the prompt."),
+    cache: bool = typer.Option(False, envvar="CACHE", help="Enable the response cache."),
+    cache_similarity: Optional[float] = typer.Option(None, help="Minimum similarity of the similarity cache layer (disabled if not set)."),
+    metrics_port: Optional[int] = typer.Option(None, envvar="METRICS_PORT", help="Serve the metrics on this port instead of '/metrics'."),
 ):
     """
     Start the server with the given parameters.
@@ -76,16 +122,45 @@ def run(
         host (str): Host IP address of the server.
         port (int): Port number of host server.
         workers (int): Number of worker processes to use.
+        preload (bool): Build the application once and fork the workers from it.
         debug (bool): Enable debug mode.
         log_level (Level): Logging level for the application.
+        log_json (bool): Write the log file as JSON lines.
+        model_name (str): OpenAI model used by the chatbot.
+        prompt_template (str): Prompt template used by the chatbot.
+        config (Optional[Path]): Settings file (TOML), reloaded on SIGHUP.
+        index_path (Optional[Path]): Documents index used by the retrieval.
+        top_k (int): Number of documents given to the prompt.
+        cache (bool): Enable the response cache.
+        cache_similarity (Optional[float]): Minimum similarity of the similarity cache layer.
+        metrics_port (Optional[int]): Serve the metrics on this port instead of '/metrics'.
 
     """
     # Setup the logger for the application
-    setup_logger(level=log_level)
+    setup_logger(level=log_level, serialize=log_json)
 
-    # Save the settings for uvicorn child processes
-    settings = Config(debug=debug)
-    settings.to_toml(CONFIG_PATH)
+    # Give the settings to uvicorn child processes (inherited environment, no shared file)
+    index_path = None if index_path is None else str(index_path.absolute())
+    settings = Config(
+        debug=debug,
+        log_level=log_level.value,
+        log_json=log_json,
+        model_name=model_name,
+        prompt_template=prompt_template,
+        index_path=index_path,
+        top_k=top_k,
+        cache=cache,
+        cache_similarity=cache_similarity,
+        metrics_port=metrics_port,
+    )
+    os.environ[CONFIG_ENV] = settings.validate().to_json()
+
+    if config is not None:
+        os.environ[CONFIG_FILE_ENV] = str(config.absolute())
+
+    # Fail before starting the workers if the settings file is invalid
+    settings = Config.from_env()
+    logger.info(f"Settings of the workers: {settings}")
 
     # Run the FastAPI application with the given environment
     launch_app(
@@ -93,23 +168,347 @@ def run(
         host=host,
         port=port,
         workers=workers,
+        preload=preload,
+        metrics_port=settings.metrics_port,
+    )
+
+
+@cli.command()
+def ingest(
+    directory: Path = typer.Argument(..., help="Directory of the documents to index."),
+    index_path: Path = typer.Option(INDEX_PATH, envvar="INDEX_PATH", help="Directory where the index is saved."),
+    extensions: List[str] = typer.Option([".txt", ".md"], "--extension", help="File extensions to index."),
+    chunk_size: int = typer.Option(200, help="Number of words per chunk."),
+    chunk_overlap: int = typer.Option(20, help="Number of words shared by two consecutive chunks."),
+    embedding_model: Optional[str] = typer.Option(None, envvar="EMBEDDING_MODEL", help="Embedding model of the chunks (no embeddings if not set)."),
+    embedding_backend: str = typer.Option("openai", envvar="EMBEDDING_BACKEND", help="Embedding backend ('openai' API or 'local' model)."),
+    embedding_url: Optional[str] = typer.Option(None, envvar="EMBEDDING_URL", help="URL of the OpenAI compatible embedding API."),
+    batch_size: int = typer.Option(64, help="Number of chunks embedded per request."),
+    dtype: str = typer.Option("float32", help="Type of the stored embeddings ('float32' or 'float16')."),
+    embedding_cache: bool = typer.Option(True, help="Reuse the embeddings of the unchanged chunks."),
+    config: Optional[Path] = typer.Option(None, "--config", help="Settings file (TOML) with the ANN index settings ('ann_*')."),
+    log_level: Level = typer.Option(Level.INFO, envvar="LOG_LEVEL", help="Logging level for the application."),
+):
+    """
+    Chunk and index every document of a directory for the retrieval (and embed the chunks).
+
+    Args:
+        directory (Path): Directory of the documents to index.
+        index_path (Path): Directory where the index is saved.
+        extensions (List[str]): File extensions to index.
+        chunk_size (int): Number of words per chunk.
+        chunk_overlap (int): Number of words shared by two consecutive chunks.
+        embedding_model (Optional[str]): Embedding model of the chunks (no embeddings if not set).
+        embedding_backend (str): Embedding backend ('openai' API or 'local' model).
+        embedding_url (Optional[str]): URL of the OpenAI compatible embedding API.
+        batch_size (int): Number of chunks embedded per request.
+        dtype (str): Type of the stored embeddings ('float32' or 'float16').
+        embedding_cache (bool): Reuse the embeddings of the unchanged chunks.
+        config (Optional[Path]): Settings file (TOML) with the ANN index settings ('ann_*').
+        log_level (Level): Logging level for the application.
+
+    """
+    # Setup the logger for the application
+    setup_logger(level=log_level)
+
+    logger.info(f"Loading the documents from: '{directory}'")
+    indexer = get_indexer(
+        directory,
+        index_path,
+        extensions=extensions,
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        embedding_model=embedding_model,
+        embedding_backend=embedding_backend,
+        embedding_url=embedding_url,
+        batch_size=batch_size,
+        dtype=dtype,
+        embedding_cache=embedding_cache,
+        config=config,
+    )
+
+    # Published as a new generation, the running workers switch to it
+    indexer.update(rebuild=True)
+
+
+@cli.command()
+def index(
+    directory: Path = typer.Argument(..., help="Directory of the documents to index."),
+    index_path: Path = typer.Option(INDEX_PATH, envvar="INDEX_PATH", help="Directory where the index is saved."),
+    watch: bool = typer.Option(False, "--watch", help="Keep indexing the changes of the directory."),
+    interval: float = typer.Option(2.0, help="Time between two scans of the directory in watch mode (seconds)."),
+    keep: int = typer.Option(2, help="Number of previous index generations kept."),
+    extensions: List[str] = typer.Option([".txt", ".md"], "--extension", help="File extensions to index."),
+    chunk_size: int = typer.Option(200, help="Number of words per chunk."),
+    chunk_overlap: int = typer.Option(20, help="Number of words shared by two consecutive chunks."),
+    embedding_model: Optional[str] = typer.Option(None, envvar="EMBEDDING_MODEL", help="Embedding model of the chunks (no embeddings if not set)."),
+    embedding_backend: str = typer.Option("openai", envvar="EMBEDDING_BACKEND", help="Embedding backend ('openai' API or 'local' model)."),
+    embedding_url: Optional[str] = typer.Option(None, envvar="EMBEDDING_URL", help="URL of the OpenAI compatible embedding API."),
+    batch_size: int = typer.Option(64, help="Number of chunks embedded per request."),
+    dtype: str = typer.Option("float32", help="Type of the stored embeddings ('float32' or 'float16')."),
+    config: Optional[Path] = typer.Option(None, "--config", help="Settings file (TOML) with the ANN index settings ('ann_*')."),
+    log_level: Level = typer.Option(Level.INFO, envvar="LOG_LEVEL", help="Logging level for the application."),
+):
+    """
+    Index the added, changed and deleted documents of a directory (incremental, new index generation).
+
+    Args:
+        directory (Path): Directory of the documents to index.
+        index_path (Path): Directory where the index is saved.
+        watch (bool): Keep indexing the changes of the directory.
+        interval (float): Time between two scans of the directory in watch mode (seconds).
+        keep (int): Number of previous index generations kept.
+        extensions (List[str]): File extensions to index.
+        chunk_size (int): Number of words per chunk.
+        chunk_overlap (int): Number of words shared by two consecutive chunks.
+        embedding_model (Optional[str]): Embedding model of the chunks (no embeddings if not set).
+        embedding_backend (str): Embedding backend ('openai' API or 'local' model).
+        embedding_url (Optional[str]): URL of the OpenAI compatible embedding API.
+        batch_size (int): Number of chunks embedded per request.
+        dtype (str): Type of the stored embeddings ('float32' or 'float16').
+        config (Optional[Path]): Settings file (TOML) with the ANN index settings ('ann_*').
+        log_level (Level): Logging level for the application.
+
+    """
+    # Setup the logger for the application
+    setup_logger(level=log_level)
+
+    indexer = get_indexer(
+        directory,
+        index_path,
+        extensions=extensions,
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        embedding_model=embedding_model,
+        embedding_backend=embedding_backend,
+        embedding_url=embedding_url,
+        batch_size=batch_size,
+        dtype=dtype,
+        config=config,
+        keep=keep,
+    )
+
+    if not watch:
+        if indexer.update() is None:
+            logger.info(f"Index up to date at: '{index_path}'")
+
+        return
+
+    try:
+        indexer.watch(interval=interval)
+    except KeyboardInterrupt:
+        logger.info("Indexer stopped")
+
+
+def get_indexer(
+    directory: Path,
+    index_path: Path,
+    embedding_model: Optional[str] = None,
+    embedding_backend: str = "openai",
+    embedding_url: Optional[str] = None,
+    embedding_cache: bool = True,
+    config: Optional[Path] = None,
+    **kwargs,
+):
+    """
+    Create the indexer of a documents directory.
+
+    Args:
+        directory (Path): Directory of the documents to index.
+        index_path (Path): Directory where the index is saved.
+        embedding_model (Optional[str]): Embedding model of the chunks (no embeddings if not set).
+        embedding_backend (str): Embedding backend ('openai' API or 'local' model).
+        embedding_url (Optional[str]): URL of the OpenAI compatible embedding API.
+        embedding_cache (bool): Reuse the embeddings of the unchanged chunks.
+        config (Optional[Path]): Settings file (TOML) with the ANN index settings ('ann_*').
+        **kwargs: Other options of the indexer (chunks, batches, generations).
+
+    Returns:
+        Indexer: Indexer of the directory.
+
+    """
+    from needle.embeddings import EmbeddingCache, get_embedder
+    from needle.indexer import Indexer
+
+    # Fail before indexing if the embedding model can't be loaded
+    embedder = None if embedding_model is None else get_embedder(embedding_model, backend=embedding_backend, api_base_url=embedding_url)
+    cache = EmbeddingCache(EMBEDDING_CACHE_PATH) if embedder is not None and embedding_cache else None
+
+    # Same settings as the workers (build settings of the IVF index)
+    settings = Config() if config is None else Config.from_toml(config)
+
+    return Indexer(
+        directory,
+        index_path,
+        embedder=embedder,
+        cache=cache,
+        backend=embedding_backend,
+        ann_index=settings.ann_index,
+        ann_lists=settings.ann_lists,
+        ann_iterations=settings.ann_iterations,
+        **kwargs,
+    )
+
+
+@cli.command()
+def export(
+    output: Optional[Path] = typer.Option(None, "--output", "-o", help="JSONL file written (standard output if not set)."),
+    table: str = typer.Option("turns", help="Records exported ('turns' or 'votes')."),
+    session: Optional[str] = typer.Option(None, help="Only the records of this session."),
+    model_name: Optional[str] = typer.Option(None, "--model", help="Only the records of this model."),
+    prompt_template: Optional[str] = typer.Option(None, "--template", help="Only the records of this prompt template."),
+    since: Optional[datetime] = typer.Option(None, help="Only the records created after this date."),
+    path: Path = typer.Option(FEEDBACK_PATH, envvar="FEEDBACK_PATH", help="Feedback database."),
+):
+    """
+    Export the recorded chat turns or votes in JSONL (one record per line).
+
+    Args:
+        output (Optional[Path]): JSONL file written (standard output if not set).
+        table (str): Records exported ('turns' or 'votes').
+        session (Optional[str]): Only the records of this session.
+        model_name (Optional[str]): Only the records of this model.
+        prompt_template (Optional[str]): Only the records of this prompt template.
+        since (Optional[datetime]): Only the records created after this date.
+        path (Path): Feedback database.
+
+    """
+    from needle.feedback import export_records
+
+    if not path.exists():
+        raise typer.BadParameter(f"Feedback database not found at: '{path}'")
+
+    records = export_records(
+        path,
+        table=table,
+        session=session,
+        model=model_name,
+        template=prompt_template,
+        since=since.timestamp() if since else None,
     )
 
+    file = sys.stdout if output is None else open(output, "w")
+    count = 0
+
+    try:
+        for record in records:
+            file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            count += 1
+    finally:
+        if output is not None:
+            file.close()
+
+    logger.info(f"{count} {table} exported from: '{path}'")
+
+
+@cli.command(name="eval")
+def evaluate(
+    dataset: Path = typer.Argument(..., help="Questions replayed (JSONL with 'question' and optionally 'id', 'history' and 'expected')."),
+    model_names: List[str] = typer.Option(["gpt-4o-mini"], "--model", help="Models evaluated (repeat the option to compare models)."),
+    prompt_templates: List[str] = typer.Option(["system"], "--template", help="Prompt templates evaluated (repeat the option to compare templates)."),
+    output: Path = typer.Option(Path("eval.jsonl"), help="Results of each question, an interrupted run is resumed from this file."),
+    report: Optional[Path] = typer.Option(None, help="JSON report of the metrics by model and template."),
+    concurrency: int = typer.Option(8, help="Maximum number of questions in flight."),
+    mode: str = typer.Option("async", help="Concurrency of the LLM calls ('async' coroutines or 'thread' pool)."),
+    limit: Optional[int] = typer.Option(None, help="Maximum number of questions of the dataset."),
+    config: Optional[Path] = typer.Option(None, envvar=CONFIG_FILE_ENV, help="Settings file (TOML) of the pipelines."),
+    base_url: Optional[str] = typer.Option(None, envvar="OPENAI_BASE_URL", help="OpenAI compatible server (a local fake server runs offline)."),
+    log_level: Level = typer.Option(Level.INFO, envvar="LOG_LEVEL", help="Logging level for the application."),
+):
+    """
+    Replay a dataset of questions through the pipelines of several models and templates.
+
+    Notes:
+        Offline run against the fake OpenAI server of the benchmarks:
+        `python -m benchmarks.fake_openai --port 8765` then
+        `needle eval questions.jsonl --base-url http://127.0.0.1:8765/v1 --template system --template concise`
+
+    Args:
+        dataset (Path): Questions replayed (JSONL).
+        model_names (List[str]): Models evaluated.
+        prompt_templates (List[str]): Prompt templates evaluated.
+        output (Path): Results of each question (checkpoint of the run).
+        report (Optional[Path]): JSON report of the metrics by model and template.
+        concurrency (int): Maximum number of questions in flight.
+        mode (str): Concurrency of the LLM calls ('async' or 'thread').
+        limit (Optional[int]): Maximum number of questions of the dataset.
+        config (Optional[Path]): Settings file (TOML) of the pipelines.
+        base_url (Optional[str]): OpenAI compatible server.
+        log_level (Level): Logging level for the application.
+
+    """
+    import asyncio
+
+    from needle.evaluation import Evaluator, load_dataset
+
+    setup_logger(level=log_level)
+
+    if base_url is not None:
+        os.environ["OPENAI_BASE_URL"] = base_url
+
+    settings = Config.from_toml(config) if config is not None else Config()
+    items = load_dataset(dataset, limit=limit)
+
+    evaluator = Evaluator(settings, output=output, concurrency=concurrency, mode=mode)
+    summary = asyncio.run(evaluator.run(items, models=model_names, templates=prompt_templates))
+
+    for name, metrics in summary.items():
+        logger.info(f"{name}: {json.dumps(metrics)}")
+
+    if report is not None:
+        report.write_text(json.dumps(summary, indent=2))
+        logger.info(f"Report saved at: '{report}'")
+
+
+def setup_multiprocess(path: Union[str, os.PathLike]):
+    """
+    Write the metrics of this process and of the workers in a shared directory.
+
+    Notes:
+        prometheus_client chooses where the values are written at its first import, the
+        directory is set before it (the workers, forked from this process or started with
+        its environment, inherit it). The files of a previous launch are removed, its
+        counters don't leak in this one.
+
+    Args:
+        path (Union[str, os.PathLike]): Directory of the metrics files (created if needed)
+
+    """
+    if "prometheus_client" in sys.modules:
+        logger.warning("prometheus_client is already imported, the metrics of this process aren't aggregated")
+
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+
+    for file in path.glob("*.db"):
+        file.unlink()
+
+    os.environ[MULTIPROC_ENV] = str(path.absolute())
+
 
 def launch_app(
     app: str = "needle.app:app",
     host: str = "localhost",
     port: int = 8000,
     workers: int = None,
+    preload: bool = False,
+    metrics_port: Optional[int] = None,
 ):
     """
     Launch the FastAPI application with the given parameters.
 
+    Notes:
+        With several workers, the metrics are written by each worker in a shared directory
+        ('PROMETHEUS_MULTIPROC_DIR', a temporary directory if not set) and aggregated by
+        every scrape. With a metrics port, this process serves them on their own port.
+
     Args:
         app (str): Application to launch.
         host (str): Host IP address of the server.
         port (int): Port number of host server.
         workers (int): Number of worker processes to use.
+        preload (bool): Build the application in this process and fork the workers (copy-on-write).
+        metrics_port (Optional[int]): Serve the metrics of the workers on this port.
 
     """
     import uvicorn
@@ -125,10 +524,39 @@ def launch_app(
 
     logger.info(f"Uvicorn start server with {workers}/{max_workers} workers")
 
-    uvicorn.run(
-        app=app,
-        host=host,
-        port=port,
-        workers=workers,
-        log_level="critical",
-    )
+    # Temporary metrics directory (removed at exit)
+    temporary_path = None
+
+    if workers > 1:
+        metrics_path = os.environ.get(MULTIPROC_ENV)
+
+        if metrics_path is None:
+            metrics_path = temporary_path = tempfile.mkdtemp(prefix="needle-metrics-")
+
+        setup_multiprocess(metrics_path)
+        logger.info(f"Metrics of the workers aggregated from: '{metrics_path}'")
+
+    # Imported once the metrics directory is set
+    from needle.metrics import serve_metrics
+
+    if metrics_port is not None:
+        serve_metrics(metrics_port, host=host)
+        logger.info(f"Metrics served on: 'http://{host}:{metrics_port}/metrics'")
+
+    try:
+        if preload and workers > 1:
+            from needle.startup import serve_prefork
+
+            serve_prefork(app=app, host=host, port=port, workers=workers)
+            return
+
+        uvicorn.run(
+            app=app,
+            host=host,
+            port=port,
+            workers=workers,
+            log_level="critical",
+        )
+    finally:
+        if temporary_path is not None:
+            shutil.rmtree(temporary_path, ignore_errors=True)
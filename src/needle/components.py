@@ -0,0 +1,140 @@
+from typing import Any, Callable, Dict, List, Optional
+
+from haystack import component
+from haystack.components.generators import OpenAIGenerator
+from haystack.components.generators.openai_utils import _convert_message_to_openai_format
+from haystack.dataclasses import ChatMessage, StreamingChunk
+from openai import AsyncOpenAI, AsyncStream, OpenAI
+
+from needle.connections import ConnectionPool
+from needle.history import TokenCounter
+from needle.metrics import LLM_TOKENS
+
+
+@component
+class AsyncOpenAIGenerator(OpenAIGenerator):
+    """
+    OpenAI generator with an additional coroutine for the non-blocking inference.
+
+    Notes:
+        The synchronous `run` method is kept (the component still works in a `Pipeline`),
+        `run_async` uses an `AsyncOpenAI` client sharing the configuration of the synchronous client.
+        The tokens of its calls are counted (usage of the response, estimated when streaming).
+        With a connection pool, both clients send their calls through the HTTP clients of the pool
+        (shared keep-alive connections, limits and timeouts of the worker).
+
+    Args:
+        http_pool (Optional[ConnectionPool]): HTTP clients shared by the generators (own clients if None)
+
+    """
+
+    def __init__(self, *args, http_pool: Optional[ConnectionPool] = None, **kwargs):
+        # The '@component' decorator copies the class, 'super()' can't be used here
+        OpenAIGenerator.__init__(self, *args, **kwargs)
+        self.http_pool = http_pool
+
+        # The timeout given to the OpenAI client overrides the one of its HTTP client
+        timeout = self.client.timeout if http_pool is None else http_pool.timeout
+        options = {
+            "api_key": self.client.api_key,
+            "organization": self.client.organization,
+            "base_url": self.client.base_url,
+            "timeout": timeout,
+            "max_retries": self.client.max_retries,
+        }
+
+        if http_pool is not None:
+            self.client = OpenAI(**options, http_client=http_pool.client)
+
+        self.async_client = AsyncOpenAI(**options, http_client=None if http_pool is None else http_pool.async_client)
+
+        # The streamed responses have no usage, their tokens are counted here
+        self.counter = TokenCounter(self.model)
+
+    @component.output_types(replies=List[str], meta=List[Dict[str, Any]])
+    async def run_async(
+        self,
+        prompt: str,
+        system_prompt: Optional[str] = None,
+        streaming_callback: Optional[Callable[[StreamingChunk], None]] = None,
+        generation_kwargs: Optional[Dict[str, Any]] = None,
+    ):
+        """
+        Invoke the text generation inference without blocking the event loop.
+
+        Args:
+            prompt (str): The string prompt to use for text generation.
+            system_prompt (Optional[str]): The system prompt, override the one given at initialisation.
+            streaming_callback (Optional[Callable[[StreamingChunk], None]]): Callback called for each received token.
+            generation_kwargs (Optional[Dict[str, Any]]): Additional keyword arguments for text generation.
+
+        Returns:
+            dict: Generated responses ('replies') and their metadata ('meta').
+
+        """
+        messages = [ChatMessage.from_user(prompt)]
+        system_prompt = system_prompt if system_prompt is not None else self.system_prompt
+
+        if system_prompt:
+            messages.insert(0, ChatMessage.from_system(system_prompt))
+
+        generation_kwargs = {**self.generation_kwargs, **(generation_kwargs or {})}
+        streaming_callback = streaming_callback or self.streaming_callback
+
+        completion = await self.async_client.chat.completions.create(
+            model=self.model,
+            messages=[_convert_message_to_openai_format(message) for message in messages],  # type: ignore
+            stream=streaming_callback is not None,
+            **generation_kwargs,
+        )
+
+        if isinstance(completion, AsyncStream):
+            if generation_kwargs.get("n", 1) > 1:
+                raise ValueError("Cannot stream multiple responses, please set n=1.")
+
+            chunks: List[StreamingChunk] = []
+            chunk = None
+
+            async for chunk in completion:
+                if chunk.choices:
+                    chunk_delta = self._build_chunk(chunk)
+                    chunks.append(chunk_delta)
+                    streaming_callback(chunk_delta)
+
+            completions = [self._connect_chunks(chunk, chunks)]
+        else:
+            completions = [self._build_message(completion, choice) for choice in completion.choices]
+
+        for response in completions:
+            self._check_finish_reason(response)
+
+        self.count_tokens(messages, completions)
+
+        return {
+            "replies": [message.content for message in completions],
+            "meta": [message.meta for message in completions],
+        }
+
+    async def connect(self, connections: int = 1):
+        """
+        Open connections to the API of the model before the first call (connection pool only).
+
+        Args:
+            connections (int): Number of connections opened
+
+        """
+        if self.http_pool is None:
+            return
+
+        url = str(self.async_client.base_url.join("models"))
+        await self.http_pool.warm_up(url, headers=self.async_client.auth_headers, connections=connections)
+
+    def count_tokens(self, messages: List[ChatMessage], completions: List[ChatMessage]):
+        """Count the prompt and completion tokens of a call (usage of the response if any)."""
+        usage = completions[0].meta.get("usage") or {}
+
+        prompt_tokens = usage.get("prompt_tokens") or sum(self.counter.count(message.content) for message in messages)
+        completion_tokens = usage.get("completion_tokens") or sum(self.counter.count(message.content or "") for message in completions)
+
+        LLM_TOKENS.labels(model=self.model, kind="prompt").inc(prompt_tokens)
+        LLM_TOKENS.labels(model=self.model, kind="completion").inc(completion_tokens)
@@ -1,10 +1,35 @@
+import json
 import os
-from dataclasses import dataclass
+import re
+from dataclasses import asdict, dataclass, field, fields
 from pathlib import Path
-from typing import Union
+from typing import Any, Dict, List, Optional, Union
 
 import toml
 
+# Environment variable with the settings given to the CLI (JSON), read by the workers
+CONFIG_ENV = "NEEDLE_CONFIG"
+
+# Environment variable with the path of a settings file (TOML), read again on SIGHUP
+CONFIG_FILE_ENV = "NEEDLE_CONFIG_FILE"
+
+# Environment variable with the metrics directory of the workers (read by prometheus_client at import)
+MULTIPROC_ENV = "PROMETHEUS_MULTIPROC_DIR"
+
+# Options of a fallback route (another model or OpenAI compatible endpoint)
+ROUTE_KEYS = ("model", "name", "api_base_url", "api_key_env", "max_prompt_tokens")
+
+# Session stores of the Gradio conversations (in-process, or shared by the workers)
+SESSION_BACKENDS = ("memory", "sqlite")
+
+# Retrieval of the documents given to the prompt (keywords, embeddings of the query, or both fused)
+RETRIEVAL_MODES = ("bm25", "vector", "hybrid")
+
+LOG_LEVELS = ("TRACE", "DEBUG", "INFO", "SUCCESS", "WARNING", "ERROR", "CRITICAL", "EXCEPTION")
+
+# Settings with a fixed set of values
+CHOICES = {"session_backend": SESSION_BACKENDS, "retrieval": RETRIEVAL_MODES, "log_level": LOG_LEVELS}
+
 
 @dataclass
 class Config:
@@ -14,27 +39,273 @@ class Config:
     Notes:
         This configuration exists because when you want to start uvicorn with workers, you have to pass
         the application to the command line. This prevents parameters from being loaded via the CLI,
-        since uvicorn doesn't pass through the `cli.py` file but goes to `app.py`. We therefore
-        create a configuration file when launching via CLI (which will indicate the parameters)
-        which will be read when the `app.py` file is executed.
+        since uvicorn doesn't pass through the `cli.py` file but goes to `app.py`. The CLI therefore
+        serializes the settings in the 'NEEDLE_CONFIG' environment variable inherited by the workers
+        (no shared file, two launches on the same host don't interfere). The values of the optional
+        settings file 'NEEDLE_CONFIG_FILE' take precedence, it is read again on SIGHUP (hot reload).
 
     """
 
     debug: bool = False
+    log_level: str = "INFO"
+    log_json: bool = False
     model_name: str = "gpt-4o-mini"
     prompt_template: str = "system"
+    template_reload_interval: float = 1.0
+    fallback_routes: List[Dict[str, Any]] = field(default_factory=list)
+    route_timeout: float = 30
+    hedging: bool = False
+    streaming: bool = True
+    max_concurrency: int = 64
+    model_concurrency: Dict[str, int] = field(default_factory=dict)
+    max_queue_size: int = 256
+    queue_timeout: float = 30
+    index_path: Optional[str] = None
+    top_k: int = 5
+    retrieval: str = "bm25"
+    embedding_url: Optional[str] = None
+    ann_index: bool = False
+    ann_lists: Optional[int] = None
+    ann_iterations: int = 10
+    ann_probes: int = 8
+    hybrid_candidates: int = 20
+    rrf_k: int = 60
+    rerank_model: Optional[str] = None
+    rerank_top_n: int = 20
+    retrieval_budget: Optional[float] = 0.25
+    cache: bool = False
+    cache_ttl: float = 3600
+    cache_max_entries: int = 10_000
+    cache_similarity: Optional[float] = None
+    feedback: bool = True
+    session_backend: str = "memory"
+    session_ttl: float = 3600
+    session_max_entries: int = 10_000
+    rate_limit: Optional[float] = None
+    rate_limit_burst: int = 10
+    rate_limit_paths: List[str] = field(
+        default_factory=lambda: ["/v1/chat", "/app/gradio_api/queue/join", "/app/gradio_api/call", "/app/gradio_api/run"]
+    )
+    daily_token_quota: Optional[int] = None
+    api_keys: List[str] = field(default_factory=list)
+    metrics_port: Optional[int] = None
+    http_max_connections: int = 100
+    http_max_keepalive: int = 20
+    http_keepalive_expiry: float = 30
+    http_connect_timeout: float = 5
+    http_read_timeout: float = 120
+    http_pool_timeout: float = 5
+    http_retries: int = 0
+    http2: bool = False
+    http_warmup_connections: int = 2
+    context_limits: Dict[str, int] = field(default_factory=lambda: {"gpt-4o-mini": 128_000, "gpt-4o": 128_000})
+    default_context_limit: int = 8192
+    completion_tokens: int = 1024
+    history_tokens: int = 4096
+    log_exclude_paths: List[str] = field(default_factory=lambda: ["/metrics"])
+    log_sample_rates: Dict[str, float] = field(default_factory=lambda: {"/app/assets": 0.01, "/app/static": 0.01, "/app/gradio_api/heartbeat": 0.01})
+
+    def get_context_limit(self, model_name: str) -> int:
+        """
+        Get the context window of a model.
+
+        Args:
+            model_name (str): OpenAI model name
+
+        Returns:
+            int: Context window of the model (tokens)
+
+        """
+        return self.context_limits.get(model_name, self.default_context_limit)
+
+    def validate(self) -> "Config":
+        """
+        Check the values of the settings.
+
+        Raises:
+            ValueError: If a value is invalid.
+
+        Returns:
+            Config: Same settings instance.
+
+        """
+        positives = (
+            "max_concurrency",
+            "queue_timeout",
+            "route_timeout",
+            "top_k",
+            "ann_lists",
+            "ann_iterations",
+            "ann_probes",
+            "hybrid_candidates",
+            "rrf_k",
+            "rerank_top_n",
+            "retrieval_budget",
+            "cache_ttl",
+            "cache_max_entries",
+            "session_ttl",
+            "session_max_entries",
+            "rate_limit",
+            "rate_limit_burst",
+            "daily_token_quota",
+            "metrics_port",
+            "http_max_connections",
+            "http_connect_timeout",
+            "http_read_timeout",
+            "http_pool_timeout",
+            "default_context_limit",
+            "completion_tokens",
+        )
+
+        non_negatives = (
+            "max_queue_size",
+            "history_tokens",
+            "template_reload_interval",
+            "http_max_keepalive",
+            "http_keepalive_expiry",
+            "http_retries",
+            "http_warmup_connections",
+        )
+
+        for name in positives + non_negatives:
+            value = getattr(self, name)
+
+            # Optional settings are disabled by None
+            if value is not None and (value < 0 or (value == 0 and name in positives)):
+                raise ValueError(f"Setting '{name}' must be {'positive' if name in positives else 'non-negative'}: {value}")
+
+        if self.cache_similarity is not None and not 0 < self.cache_similarity <= 1:
+            raise ValueError(f"Setting 'cache_similarity' must be between 0 and 1: {self.cache_similarity}")
+
+        # Hashes only, the settings are logged and inherited by the workers environment
+        if any(not re.fullmatch(r"[0-9a-f]{64}", key) for key in self.api_keys):
+            raise ValueError("Setting 'api_keys' must contain SHA-256 hashes of the keys (64 lowercase hex characters)")
+
+        if any(not 0 <= rate <= 1 for rate in self.log_sample_rates.values()):
+            raise ValueError(f"Setting 'log_sample_rates' must be between 0 and 1: {self.log_sample_rates}")
+
+        self.validate_routes()
+
+        invalid = next((name for name, choices in CHOICES.items() if getattr(self, name) not in choices), None)
+
+        if invalid is not None:
+            raise ValueError(f"Setting '{invalid}' must be one of {CHOICES[invalid]}: '{getattr(self, invalid)}'")
+
+        return self
+
+    def validate_routes(self):
+        """
+        Check the fallback routes and the concurrency limits of the models.
+
+        Raises:
+            ValueError: If a route or a limit is invalid.
+
+        """
+        for route in self.fallback_routes:
+            if "model" not in route or set(route) - set(ROUTE_KEYS):
+                raise ValueError(f"Setting 'fallback_routes' needs a 'model' and only accepts {ROUTE_KEYS}: {route}")
+
+        if any(limit <= 0 for limit in self.model_concurrency.values()):
+            raise ValueError(f"Setting 'model_concurrency' must be positive: {self.model_concurrency}")
+
+        # The turns are scheduled on the default model, the calls failed over or hedged to a route count against it
+        fallback_models = {route["model"] for route in self.fallback_routes} - {self.model_name}
+
+        if fallback_models & set(self.model_concurrency):
+            raise ValueError(
+                f"Setting 'model_concurrency' only limits the default model ('model_name'), not the fallback routes: "
+                f"{sorted(fallback_models & set(self.model_concurrency))}"
+            )
 
     @classmethod
-    def from_toml(cls, path: Union[str, os.PathLike]):
+    def from_dict(cls, data: Dict[str, Any]) -> "Config":
         """
-        Load the settings from a TOML file.
+        Create validated settings from a dictionary.
 
         Args:
-            path (str): Path to the TOML file.
+            data (Dict[str, Any]): Values of the settings (missing values get the default).
+
+        Raises:
+            ValueError: If a setting is unknown or invalid.
 
         Returns:
             Config: Settings instance.
 
+        """
+        unknown = set(data) - {field_.name for field_ in fields(cls)}
+
+        if unknown:
+            raise ValueError(f"Unknown settings: {sorted(unknown)}")
+
+        return cls(**data).validate()
+
+    def update(self, data: Dict[str, Any]) -> "Config":
+        """
+        Get a copy of the settings with new values.
+
+        Args:
+            data (Dict[str, Any]): New values of the settings.
+
+        Returns:
+            Config: New validated settings instance.
+
+        """
+        return self.from_dict({**asdict(self), **data})
+
+    @classmethod
+    def from_json(cls, data: str) -> "Config":
+        """
+        Load the settings from a JSON string.
+
+        Args:
+            data (str): Settings serialized by `to_json`.
+
+        Returns:
+            Config: Settings instance.
+
+        """
+        return cls.from_dict(json.loads(data))
+
+    def to_json(self) -> str:
+        """
+        Serialize the settings in a JSON string.
+
+        Returns:
+            str: Settings serialized.
+
+        """
+        return json.dumps(asdict(self))
+
+    @classmethod
+    def from_env(cls) -> "Config":
+        """
+        Load the settings given by the CLI (environment variable) and the settings file (if any).
+
+        Returns:
+            Config: Settings instance (default settings if the CLI didn't give any).
+
+        """
+        data = os.environ.get(CONFIG_ENV)
+        settings = cls.from_json(data) if data else cls()
+
+        path = os.environ.get(CONFIG_FILE_ENV)
+
+        if path:
+            settings = settings.update(cls.read_toml(path))
+
+        return settings
+
+    @staticmethod
+    def read_toml(path: Union[str, os.PathLike]) -> Dict[str, Any]:
+        """
+        Read the values of a TOML settings file.
+
+        Args:
+            path (str): Path to the TOML file.
+
+        Returns:
+            Dict[str, Any]: Values of the file (only the settings present in the file).
+
         """
         path = Path(path)
 
@@ -42,7 +313,21 @@ class Config:
             raise FileNotFoundError(f"Settings file not found at: '{path}'")
 
         with open(path, "r") as f:
-            return cls(**toml.load(f))
+            return toml.load(f)
+
+    @classmethod
+    def from_toml(cls, path: Union[str, os.PathLike]):
+        """
+        Load the settings from a TOML file.
+
+        Args:
+            path (str): Path to the TOML file.
+
+        Returns:
+            Config: Settings instance.
+
+        """
+        return cls.from_dict(cls.read_toml(path))
 
     def to_toml(self, path: Union[str, os.PathLike]):
         """
@@ -0,0 +1,160 @@
+import asyncio
+import time
+from typing import AsyncIterator, Optional
+
+import httpx
+from loguru import logger
+
+from needle.metrics import HTTP_CONNECT_SECONDS, HTTP_POOL_IN_FLIGHT, HTTP_POOL_LIMIT
+
+
+class InstrumentedStream(httpx.AsyncByteStream):
+    """Body of a response, releases its slot of the pool metrics when closed."""
+
+    def __init__(self, stream: httpx.AsyncByteStream):
+        self.stream = stream
+        self.closed = False
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        """Chunks of the body."""
+        async for chunk in self.stream:
+            yield chunk
+
+    async def aclose(self):
+        """Close the body (the request is no longer in flight)."""
+        if not self.closed:
+            self.closed = True
+            HTTP_POOL_IN_FLIGHT.dec()
+
+        await self.stream.aclose()
+
+
+class InstrumentedTransport(httpx.AsyncBaseTransport):
+    """
+    Transport counting the requests in flight and timing the new connections (TCP and TLS).
+
+    Notes:
+        The connection events come from the 'trace' extension of httpcore, a request reusing
+        a keep-alive connection has no connection time. A streamed response stays in flight
+        until its body is closed.
+
+    Args:
+        transport (httpx.AsyncBaseTransport): Transport sending the requests
+
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self.transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        """Send a request, the connection events of httpcore are traced."""
+        host = request.url.host
+        tls = request.url.scheme == "https"
+        started = None
+
+        async def trace(event: str, info: dict):
+            nonlocal started
+
+            if event == "connection.connect_tcp.started":
+                started = time.perf_counter()
+            elif started is not None and event == ("connection.start_tls.complete" if tls else "connection.connect_tcp.complete"):
+                HTTP_CONNECT_SECONDS.labels(host=host).observe(time.perf_counter() - started)
+                started = None
+
+        request.extensions["trace"] = trace
+        HTTP_POOL_IN_FLIGHT.inc()
+
+        try:
+            response = await self.transport.handle_async_request(request)
+        except BaseException:
+            HTTP_POOL_IN_FLIGHT.dec()
+            raise
+
+        response.stream = InstrumentedStream(response.stream)
+        return response
+
+    async def aclose(self):
+        """Close the connections of the transport."""
+        await self.transport.aclose()
+
+
+class ConnectionPool:
+    """
+    HTTP clients of the worker process, shared by the OpenAI clients of every route.
+
+    Notes:
+        - The clients keep their connections alive between the LLM calls (no TCP and TLS setup
+          per call), the number of connections and their idle time are bounded.
+        - The clients are created when the application is built, before any connection: a worker
+          forked from a preloaded application opens its own connections.
+        - `warm_up` opens connections before the first chat turn (see `AsyncOpenAIGenerator.connect`).
+        - HTTP/2 needs the optional 'h2' package (`pip install httpx[http2]`).
+
+    Args:
+        max_connections (int): Maximum number of connections of the process (all hosts)
+        max_keepalive_connections (int): Maximum number of idle connections kept alive
+        keepalive_expiry (float): Idle time before a connection is closed (seconds)
+        connect_timeout (float): Maximum time to open a connection (seconds)
+        read_timeout (float): Maximum time between two chunks of a response (seconds)
+        pool_timeout (float): Maximum time waiting for a free connection (seconds)
+        retries (int): Retries of the failed connection attempts
+        http2 (bool): Negotiate HTTP/2 (several calls multiplexed on a connection)
+
+    """
+
+    def __init__(
+        self,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 30,
+        connect_timeout: float = 5,
+        read_timeout: float = 60,
+        pool_timeout: float = 5,
+        retries: int = 0,
+        http2: bool = False,
+    ):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = httpx.Timeout(connect=connect_timeout, read=read_timeout, write=read_timeout, pool=pool_timeout)
+
+        transport = httpx.AsyncHTTPTransport(limits=self.limits, retries=retries, http2=http2)
+        self.async_client = httpx.AsyncClient(transport=InstrumentedTransport(transport), timeout=self.timeout)
+
+        # Blocking client of the synchronous `run` (evaluation in threads, pipeline runs)
+        self.client = httpx.Client(
+            transport=httpx.HTTPTransport(limits=self.limits, retries=retries, http2=http2),
+            timeout=self.timeout,
+        )
+
+    async def warm_up(self, url: str, headers: Optional[dict] = None, connections: int = 1):
+        """
+        Open connections to a host before the first call (TCP and TLS setup paid at startup).
+
+        Args:
+            url (str): URL requested on the host (any response keeps the connection alive)
+            headers (Optional[dict]): Headers of the requests
+            connections (int): Number of concurrent requests (connections opened)
+
+        """
+        # Set by the worker process (a value set before the fork isn't exported by the worker)
+        HTTP_POOL_LIMIT.set(self.limits.max_connections)
+
+        if connections <= 0:
+            return
+
+        start = time.perf_counter()
+        responses = await asyncio.gather(*(self.async_client.get(url, headers=headers) for _ in range(connections)), return_exceptions=True)
+        errors = [response for response in responses if isinstance(response, Exception)]
+
+        if errors:
+            logger.warning(f"Connections to '{url}' not opened ({len(errors)}/{connections}): {errors[0]!r}")
+        else:
+            logger.debug(f"{connections} connections to '{url}' opened in {time.perf_counter() - start:.3f} seconds")
+
+    async def aclose(self):
+        """Close the connections of the clients."""
+        await self.async_client.aclose()
+        self.client.close()
@@ -0,0 +1,342 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from functools import cached_property
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+import httpx
+import numpy as np
+from haystack import Document
+from loguru import logger
+
+from needle.cache import make_key
+from needle.vectors import IVFIndex, exact_search
+
+# Embedding models: OpenAI compatible API (OpenAI, local or fake server) or local sentence-transformers model
+EMBEDDING_BACKENDS = ("openai", "local")
+
+# Types of the stored embedding matrix (float16 halves the size, the scores lose ~3 digits)
+EMBEDDING_DTYPES = ("float32", "float16")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    key TEXT PRIMARY KEY,
+    vector BLOB NOT NULL,
+    created REAL NOT NULL
+);
+"""
+
+# Maximum number of keys of a single SQLite query (variables limit)
+QUERY_SIZE = 500
+
+
+class OpenAIEmbedder:
+    """
+    Embed texts with an OpenAI compatible embedding API (one request per batch).
+
+    Args:
+        model (str): Embedding model name
+        api_base_url (Optional[str]): URL of the API ('OPENAI_BASE_URL' or OpenAI if None)
+        api_key_env (str): Environment variable with the API key
+        max_retries (int): Retries of a failed request
+        http_client (Optional[httpx.Client]): HTTP client of the requests (shared connections of the worker)
+
+    """
+
+    def __init__(
+        self,
+        model: str = "text-embedding-3-small",
+        api_base_url: Optional[str] = None,
+        api_key_env: str = "OPENAI_API_KEY",
+        max_retries: int = 5,
+        http_client: Optional[httpx.Client] = None,
+    ):
+        from openai import OpenAI
+
+        self.model = model
+        self.client = OpenAI(api_key=os.environ.get(api_key_env), base_url=api_base_url, max_retries=max_retries, http_client=http_client)
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """Embed a batch of texts (float32 matrix, one row per text)."""
+        response = self.client.embeddings.create(model=self.model, input=texts)
+        data = sorted(response.data, key=lambda item: item.index)
+        return np.asarray([item.embedding for item in data], dtype=np.float32)
+
+
+class LocalEmbedder:
+    """
+    Embed texts with a local sentence-transformers model (optional dependency).
+
+    Args:
+        model (str): Name or path of the sentence-transformers model
+
+    """
+
+    def __init__(self, model: str = "sentence-transformers/all-MiniLM-L6-v2"):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            raise ImportError("The 'local' embedding backend needs sentence-transformers: `pip install sentence-transformers`") from None
+
+        self.model = model
+        self.encoder = SentenceTransformer(model)
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """Embed a batch of texts (float32 matrix, one row per text)."""
+        return self.encoder.encode(texts, batch_size=len(texts), convert_to_numpy=True).astype(np.float32)
+
+
+def get_embedder(
+    model: str, backend: str = "openai", api_base_url: Optional[str] = None, http_client: Optional[httpx.Client] = None
+) -> Union[OpenAIEmbedder, LocalEmbedder]:
+    """
+    Create the embedder of a backend.
+
+    Args:
+        model (str): Embedding model name
+        backend (str): 'openai' (OpenAI compatible API) or 'local' (sentence-transformers)
+        api_base_url (Optional[str]): URL of the API ('openai' backend)
+        http_client (Optional[httpx.Client]): HTTP client of the requests ('openai' backend)
+
+    Returns:
+        Union[OpenAIEmbedder, LocalEmbedder]: Embedder of the model
+
+    """
+    if backend == "openai":
+        return OpenAIEmbedder(model=model, api_base_url=api_base_url, http_client=http_client)
+
+    if backend == "local":
+        return LocalEmbedder(model=model)
+
+    raise ValueError(f"Embedding backend must be one of {EMBEDDING_BACKENDS}: '{backend}'")
+
+
+class EmbeddingCache:
+    """
+    Embeddings of the texts already embedded, keyed by the hash of the model and the text.
+
+    Notes:
+        The vectors are stored as float32 bytes in SQLite, an unchanged chunk of a corpus
+        ingested again is read from the cache instead of being embedded.
+
+    Args:
+        path (Union[str, os.PathLike]): Path of the SQLite database
+
+    """
+
+    def __init__(self, path: Union[str, os.PathLike]):
+        self.path = Path(path)
+
+        self._local = threading.local()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection.executescript(SCHEMA)
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """SQLite connection of the current thread (a forked worker opens its own)."""
+        connection = getattr(self._local, "connection", None)
+
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+
+        return connection
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, np.ndarray]:
+        """
+        Get the cached embeddings of the keys.
+
+        Args:
+            keys (Iterable[str]): Keys of the texts (see `make_key`)
+
+        Returns:
+            Dict[str, np.ndarray]: Embeddings by key (missing keys are not cached)
+
+        """
+        keys = list(keys)
+        vectors = {}
+
+        for start in range(0, len(keys), QUERY_SIZE):
+            batch = keys[start : start + QUERY_SIZE]
+            rows = self.connection.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({', '.join('?' * len(batch))})",  # noqa: S608
+                batch,
+            )
+            vectors.update((key, np.frombuffer(vector, dtype=np.float32)) for key, vector in rows)
+
+        return vectors
+
+    def set_many(self, vectors: Dict[str, np.ndarray]):
+        """Cache the embeddings of the keys (a single transaction)."""
+        now = time.time()
+
+        with self.connection as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, created) VALUES (?, ?, ?)",
+                [(key, np.asarray(vector, dtype=np.float32).tobytes(), now) for key, vector in vectors.items()],
+            )
+
+
+class EmbeddingIndex:
+    """
+    Embeddings of the documents of an index, stored as a memory-mapped NumPy matrix.
+
+    Notes:
+        Row i is the embedding of the document i of the index (same order as `BM25Index`).
+        The rows are normalized (L2), a cosine similarity is a dot product. A query scores
+        every row (exact search), or the closest lists of the IVF index if it was built.
+
+    Layout:
+        embeddings.npy: Embedding of each document (float32 or float16, size N x D)
+        embeddings.json: Model, backend, dimension and type of the embeddings
+        ivf_*.npy: Lists of the approximate nearest neighbours index (optional, see `IVFIndex`)
+
+    Args:
+        path (Union[str, os.PathLike]): Directory of the index
+
+    """
+
+    def __init__(self, path: Union[str, os.PathLike]):
+        self.path = Path(path)
+
+        if not (self.path / "embeddings.json").exists():
+            raise FileNotFoundError(f"Embeddings not found at: '{self.path}'")
+
+    @cached_property
+    def info(self) -> dict:
+        """Model, backend, dimension and type of the embeddings."""
+        return json.loads((self.path / "embeddings.json").read_text())
+
+    @cached_property
+    def matrix(self) -> np.ndarray:
+        """Embedding of each document."""
+        return np.load(self.path / "embeddings.npy", mmap_mode="r")
+
+    @cached_property
+    def ivf(self) -> Optional[IVFIndex]:
+        """Approximate nearest neighbours index (None if not built)."""
+        return IVFIndex(self.path) if (self.path / "ivf_centroids.npy").exists() else None
+
+    def __len__(self) -> int:
+        """Number of embedded documents."""
+        return len(self.matrix)
+
+    def search(self, query: np.ndarray, top_k: int = 5, probes: int = 8) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Get the documents closest to a query embedding.
+
+        Args:
+            query (np.ndarray): Embedding of the query (normalized here)
+            top_k (int): Maximum number of documents to return
+            probes (int): Number of IVF lists scored (ignored by the exact search)
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Indexes and cosine similarities of the documents (decreasing)
+
+        """
+        query = np.asarray(query, dtype=np.float32)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+
+        if self.ivf is None:
+            return exact_search(self.matrix, query, top_k=top_k)
+
+        return self.ivf.search(self.matrix, query, top_k=top_k, probes=probes)
+
+    @classmethod
+    def build(
+        cls,
+        documents: List[Document],
+        path: Union[str, os.PathLike],
+        embedder: Union[OpenAIEmbedder, LocalEmbedder],
+        cache: Optional[EmbeddingCache] = None,
+        batch_size: int = 64,
+        dtype: str = "float32",
+        backend: str = "openai",
+        ann_lists: Optional[int] = None,
+        ann_iterations: int = 10,
+        ann_index: bool = False,
+    ) -> "EmbeddingIndex":
+        """
+        Embed the documents by batches and save the matrix in the index directory.
+
+        Notes:
+            The matrix is written in place in a memory-mapped file (the embeddings are never all
+            in memory), then renamed once complete. The chunks with the same text are embedded once,
+            the chunks found in the cache aren't embedded, each embedded batch is cached at once
+            (an interrupted ingestion keeps its progress).
+
+        Args:
+            documents (List[Document]): Documents of the index (same order)
+            path (Union[str, os.PathLike]): Directory of the index
+            embedder (Union[OpenAIEmbedder, LocalEmbedder]): Embedding model
+            cache (Optional[EmbeddingCache]): Embeddings already computed (no cache if None)
+            batch_size (int): Number of texts embedded per request
+            dtype (str): Type of the stored matrix ('float32' or 'float16')
+            backend (str): Backend of the embedder (recorded to embed the queries the same way)
+            ann_lists (Optional[int]): Number of lists of the IVF index (about 4 x sqrt(N) if None)
+            ann_iterations (int): Number of k-means iterations of the IVF index
+            ann_index (bool): Build the IVF index (approximate search, exact search else)
+
+        Returns:
+            EmbeddingIndex: The saved embeddings
+
+        """
+        if dtype not in EMBEDDING_DTYPES:
+            raise ValueError(f"Embedding type must be one of {EMBEDDING_DTYPES}: '{dtype}'")
+
+        if batch_size <= 0:
+            raise ValueError(f"Embedding batch size must be positive: {batch_size}")
+
+        path = Path(path)
+        keys = [make_key(embedder.model, document.content or "") for document in documents]
+        texts = {key: document.content or "" for key, document in zip(keys, documents)}
+
+        vectors = cache.get_many(texts) if cache is not None else {}
+        missing = [key for key in texts if key not in vectors]
+        logger.info(f"Embedding {len(missing)} chunks with '{embedder.model}' ({len(texts) - len(missing)} unique chunks cached)")
+
+        for start in range(0, len(missing), batch_size):
+            batch = missing[start : start + batch_size]
+            embedded = dict(zip(batch, embedder.embed([texts[key] for key in batch])))
+
+            if cache is not None:
+                cache.set_many(embedded)
+
+            vectors.update(embedded)
+            logger.debug(f"Embedded {min(start + batch_size, len(missing))}/{len(missing)} chunks")
+
+        dimension = len(next(iter(vectors.values()))) if vectors else 0
+        temporary_path = path / "embeddings.tmp.npy"
+        matrix = np.lib.format.open_memmap(temporary_path, mode="w+", dtype=dtype, shape=(len(documents), dimension))
+
+        # Normalized and written by blocks of rows
+        for start in range(0, len(keys), batch_size):
+            block = np.stack([vectors[key] for key in keys[start : start + batch_size]])
+            norms = np.linalg.norm(block, axis=1, keepdims=True)
+            matrix[start : start + len(block)] = block / np.maximum(norms, 1e-12)
+
+        matrix.flush()
+
+        if ann_index and len(documents):
+            IVFIndex.build(matrix, path, lists=ann_lists, iterations=ann_iterations)
+        else:
+            for file in path.glob("ivf_*.npy"):
+                file.unlink()
+
+        del matrix
+
+        # Replace the previous embeddings once the new ones are complete
+        os.replace(temporary_path, path / "embeddings.npy")
+        info = {"model": embedder.model, "backend": backend, "dimension": dimension, "dtype": dtype, "count": len(documents)}
+        (path / "embeddings.json").write_text(json.dumps(info))
+
+        logger.info(f"Embedded {len(documents)} chunks ({dimension} dimensions, {dtype}) at: '{path}'")
+        return cls(path)
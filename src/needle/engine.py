@@ -0,0 +1,378 @@
+import asyncio
+import json
+import time
+from typing import Any, AsyncIterator, Collection, Dict, List, Mapping, Optional, Tuple
+
+from haystack import Pipeline
+from haystack.components.builders import PromptBuilder
+
+from needle.cache import ResponseCache, make_key
+from needle.connections import ConnectionPool
+from needle.feedback import FeedbackStore
+from needle.history import TokenCounter, trim_history
+from needle.metrics import CHAT_TTFT, PIPELINE_COMPONENT_SECONDS
+from needle.prompts import TemplateRegistry
+from needle.ratelimit import RateLimiter, get_client_id
+from needle.scheduler import Scheduler
+
+
+class ChatEngine:
+    """
+    Asynchronous inference engine running the chat pipeline components.
+
+    Notes:
+        Haystack pipelines are synchronous, a `Pipeline.run` would hold a worker thread during
+        the whole OpenAI round trip. The engine renders the prompt with the 'retriever' (if any)
+        and 'prompt_builder' components and awaits the 'llm' component (`AsyncOpenAIGenerator.run_async`),
+        so the event loop serves other chats while waiting on the network. With a template registry,
+        the prompt is rendered by the compiled template chosen for the request (default template else).
+
+    Args:
+        chat_pipeline (Pipeline): Chatbot pipeline created by `get_llm_pipeline`
+        streaming (bool): Yield the partial response as soon as tokens are received
+        scheduler (Optional[Scheduler]): Scheduler of the LLM calls (concurrency, single-flight, backpressure)
+        template_name (str): Name of the default prompt template (part of the cache keys)
+        templates (Optional[TemplateRegistry]): Prompt templates selectable per request (pipeline 'prompt_builder' if None)
+        cache (Optional[ResponseCache]): Response cache in front of the 'llm' component
+        feedback (Optional[FeedbackStore]): Store of the chat turns (transcripts not recorded if None)
+        limiter (Optional[RateLimiter]): Daily token quotas of the clients (LLM tokens of each turn charged to its client)
+        http_pool (Optional[ConnectionPool]): HTTP connections shared by the generators (kept by a hot reload)
+        api_keys (Collection[str]): Hashes of the accepted API keys identifying the clients (kept by a hot reload)
+        context_limit (int): Context window of the model (tokens)
+        completion_tokens (int): Tokens of the context window reserved for the response
+        history_tokens (int): Maximum number of tokens of the conversation history
+
+    """
+
+    def __init__(
+        self,
+        chat_pipeline: Pipeline,
+        streaming: bool = True,
+        scheduler: Optional[Scheduler] = None,
+        template_name: str = "system",
+        templates: Optional[TemplateRegistry] = None,
+        cache: Optional[ResponseCache] = None,
+        feedback: Optional[FeedbackStore] = None,
+        limiter: Optional[RateLimiter] = None,
+        http_pool: Optional[ConnectionPool] = None,
+        api_keys: Collection[str] = (),
+        context_limit: int = 128_000,
+        completion_tokens: int = 1024,
+        history_tokens: int = 4096,
+    ):
+        self.chat_pipeline = chat_pipeline
+        self.streaming = streaming
+        self.scheduler = scheduler or Scheduler()
+        self.template_name = template_name
+        self.templates = templates
+        self.cache = cache
+        self.feedback = feedback
+        self.limiter = limiter
+        self.http_pool = http_pool
+        self.api_keys = frozenset(api_keys)
+        self.context_limit = context_limit
+        self.completion_tokens = completion_tokens
+        self.history_tokens = history_tokens
+
+        self.counter = TokenCounter(chat_pipeline.get_component("llm").model)
+
+    def update(self, engine: "ChatEngine"):
+        """
+        Take the pipeline and the settings of another engine (hot reload).
+
+        Notes:
+            The chat turns in progress finish with the previous pipeline, the scheduler
+            is kept (with the new limits) so its waiting turns aren't lost.
+
+        Args:
+            engine (ChatEngine): Engine created with the new settings
+
+        """
+        self.chat_pipeline = engine.chat_pipeline
+        self.streaming = engine.streaming
+        self.template_name = engine.template_name
+        self.templates = engine.templates
+        self.context_limit = engine.context_limit
+        self.completion_tokens = engine.completion_tokens
+        self.history_tokens = engine.history_tokens
+        self.counter = engine.counter
+
+        self.scheduler.update(engine.scheduler)
+
+    def get_client_id(self, headers: Mapping[str, str], host: Optional[str] = None) -> str:
+        """Identify the client of a request (accepted API key, or address), see `get_client_id`."""
+        return get_client_id(headers, host, api_keys=self.api_keys)
+
+    @property
+    def model_name(self) -> str:
+        """Name of the model of the 'llm' component (default route of a router)."""
+        return self.chat_pipeline.get_component("llm").model
+
+    @property
+    def template_names(self) -> List[str]:
+        """Names of the prompt templates selectable per request."""
+        return self.templates.names if self.templates is not None else [self.template_name]
+
+    def has_template(self, name: str) -> bool:
+        """Check if a prompt template can be selected (reloaded templates included)."""
+        return name in self.templates if self.templates is not None else name == self.template_name
+
+    def get_prompt_builder(self, template: Optional[str] = None) -> Tuple[str, PromptBuilder]:
+        """
+        Get the compiled prompt template of a request.
+
+        Args:
+            template (Optional[str]): Name of the template (default template if None)
+
+        Raises:
+            TemplateNotFoundError: If the template doesn't exist.
+
+        Returns:
+            Tuple[str, PromptBuilder]: Cache key of the template (name and version) and its prompt builder
+
+        """
+        if self.templates is None:
+            return self.template_name, self.chat_pipeline.get_component("prompt_builder")
+
+        prompt_template = self.templates.get(template or self.template_name)
+        return prompt_template.key, prompt_template.builder
+
+    def run_component(self, name: str, instance: Optional[Any] = None, **inputs: Any) -> Dict[str, Any]:
+        """
+        Run a synchronous component of the pipeline (its duration is measured).
+
+        Args:
+            name (str): Name of the component in the pipeline
+            instance (Optional[Any]): Component run in place of the one of the pipeline (same stage)
+            **inputs (Any): Inputs of the component
+
+        Returns:
+            Dict[str, Any]: Outputs of the component
+
+        """
+        instance = self.chat_pipeline.get_component(name) if instance is None else instance
+
+        with PIPELINE_COMPONENT_SECONDS.labels(component=name).time():
+            return instance.run(**inputs)
+
+    def render(
+        self,
+        question: str,
+        history: Optional[List[Dict[str, str]]] = None,
+        prompt_builder: Optional[PromptBuilder] = None,
+    ) -> Tuple[str, List[Dict[str, str]]]:
+        """
+        Render the prompt sent to the LLM (with the retrieved documents and the history if any).
+
+        Args:
+            question (str): User message
+            history (Optional[List[Dict[str, str]]]): Previous messages of the conversation
+            prompt_builder (Optional[PromptBuilder]): Compiled template of the request (default template if None)
+
+        Returns:
+            Tuple[str, List[Dict[str, str]]]: Prompt sent to the LLM and the history kept in the prompt
+
+        """
+        if prompt_builder is None:
+            _, prompt_builder = self.get_prompt_builder()
+
+        documents = None
+
+        if self.chat_pipeline.graph.has_node("retriever"):
+            documents = self.run_component("retriever", query=question)["documents"]
+
+        prompt = self.run_component("prompt_builder", prompt_builder, question=question, documents=documents)["prompt"]
+
+        # Only the text messages are sent to the LLM (Gradio messages may contain files)
+        history = [{"role": message["role"], "content": message["content"]} for message in history or [] if isinstance(message["content"], str)]
+
+        if not history:
+            return prompt, history
+
+        # Fit the history in the context window left by the prompt and the response
+        budget = self.context_limit - self.completion_tokens - self.counter.count(prompt)
+        history = trim_history(history, budget=min(budget, self.history_tokens), counter=self.counter)
+
+        prompt = self.run_component("prompt_builder", prompt_builder, question=question, documents=documents, history=history)["prompt"]
+        return prompt, history
+
+    async def stream(
+        self,
+        question: str,
+        history: Optional[List[Dict[str, str]]] = None,
+        client_id: str = "anonymous",
+        template: Optional[str] = None,
+        session_id: Optional[str] = None,
+    ) -> AsyncIterator[str]:
+        """
+        Get the assistant response message.
+
+        Args:
+            question (str): User message
+            history (Optional[List[Dict[str, str]]]): Previous messages of the conversation
+            client_id (str): Client asking for the response (fair scheduling between the clients)
+            template (Optional[str]): Prompt template of the request (default template if None)
+            session_id (Optional[str]): Session of the conversation (recorded with the transcript)
+
+        Raises:
+            TemplateNotFoundError: If the template doesn't exist.
+
+        Returns:
+            AsyncIterator[str]: Chatbot response message (partial while streaming, complete at the end)
+
+        """
+        start = ttft_start = time.perf_counter()
+        template_key, prompt_builder = self.get_prompt_builder(template)
+
+        # The retrieval is CPU bound, keep it out of the event loop
+        prompt, history = await asyncio.to_thread(self.render, question, history, prompt_builder)
+
+        model_name = self.model_name
+
+        if self.cache is not None:
+            key = make_key(template_key, model_name, prompt)
+            namespace = make_key(template_key, model_name, json.dumps(history))
+
+            response = await asyncio.to_thread(self.cache.get, key, namespace, question)
+
+            if response is not None:
+                self.record_turn(session_id, template, question, history, response, cached=True, start=start)
+                yield response
+                return
+
+        response = None
+
+        # Identical prompts in flight share the same LLM call
+        generations = self.scheduler.run(
+            key=make_key(model_name, prompt),
+            model_name=model_name,
+            client_id=client_id,
+            generate=lambda: self.generate(prompt),
+        )
+
+        async for response in generations:
+            if ttft_start is not None:
+                CHAT_TTFT.labels(model=model_name).observe(time.perf_counter() - ttft_start)
+                ttft_start = None
+
+            yield response
+
+        if response is not None:
+            self.record_turn(session_id, template, question, history, response, cached=False, start=start)
+            self.charge(client_id, prompt, response)
+
+        if self.cache is not None and response is not None:
+            await asyncio.to_thread(self.cache.set, key, namespace, question, response)
+
+    def record_turn(
+        self,
+        session_id: Optional[str],
+        template: Optional[str],
+        question: str,
+        history: List[Dict[str, str]],
+        response: str,
+        cached: bool,
+        start: float,
+    ):
+        """Record the transcript of a finished chat turn (queued, written in the background)."""
+        if self.feedback is None:
+            return
+
+        self.feedback.add_turn(
+            session=session_id,
+            model=self.model_name,
+            template=template or self.template_name,
+            question=question,
+            history=history,
+            response=response,
+            cached=cached,
+            duration=time.perf_counter() - start,
+        )
+
+    def charge(self, client_id: str, prompt: str, response: str):
+        """Charge the LLM tokens of a chat turn to the daily quota of its client (written in the background)."""
+        if self.limiter is None or self.limiter.daily_quota is None:
+            return
+
+        tokens = self.counter.count(prompt) + self.counter.count(response)
+        asyncio.get_running_loop().run_in_executor(None, self.limiter.charge, client_id, tokens)
+
+    async def complete(
+        self,
+        question: str,
+        history: Optional[List[Dict[str, str]]] = None,
+        client_id: str = "anonymous",
+        template: Optional[str] = None,
+        session_id: Optional[str] = None,
+    ) -> str:
+        """
+        Get the complete assistant response message.
+
+        Args:
+            question (str): User message
+            history (Optional[List[Dict[str, str]]]): Previous messages of the conversation
+            client_id (str): Client asking for the response (fair scheduling between the clients)
+            template (Optional[str]): Prompt template of the request (default template if None)
+            session_id (Optional[str]): Session of the conversation (recorded with the transcript)
+
+        Returns:
+            str: Chatbot response message
+
+        """
+        response = ""
+
+        async for response in self.stream(question, history, client_id=client_id, template=template, session_id=session_id):
+            pass
+
+        return response
+
+    async def warm_up(self, connections: int = 1):
+        """
+        Open the connections of the 'llm' component before the first chat turn (startup of the worker).
+
+        Args:
+            connections (int): Number of connections opened to the API of each model
+
+        """
+        await self.chat_pipeline.get_component("llm").connect(connections)
+
+    async def generate(self, prompt: str) -> AsyncIterator[str]:
+        """
+        Run the 'llm' component on the prompt (called by the scheduler).
+
+        Args:
+            prompt (str): Prompt sent to the LLM
+
+        Returns:
+            AsyncIterator[str]: LLM response (partial while streaming, complete at the end)
+
+        """
+        llm = self.chat_pipeline.get_component("llm")
+        timer = PIPELINE_COMPONENT_SECONDS.labels(component="llm")
+        start = time.perf_counter()
+
+        if not self.streaming:
+            result = await llm.run_async(prompt=prompt)
+            timer.observe(time.perf_counter() - start)
+            yield result["replies"][0]
+            return
+
+        # Tokens are produced by the llm task and consumed here, 'None' marks the end of the stream
+        chunks = asyncio.Queue()
+        task = asyncio.create_task(llm.run_async(prompt=prompt, streaming_callback=chunks.put_nowait))
+        task.add_done_callback(lambda _: chunks.put_nowait(None))
+
+        try:
+            response = ""
+
+            while (chunk := await chunks.get()) is not None:
+                response += chunk.content
+                yield response
+
+            # Raise the llm exception (if any) and send the final reply
+            result = await task
+            timer.observe(time.perf_counter() - start)
+            yield result["replies"][0]
+        finally:
+            # The client left before the end of the stream
+            task.cancel()
@@ -0,0 +1,363 @@
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from functools import partial
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+
+from needle.config import Config
+from needle.engine import ChatEngine
+from needle.utils import tokenize
+
+MODES = ("async", "thread")
+
+
+@dataclass
+class EvalItem:
+    """
+    Question of the evaluation dataset.
+
+    Args:
+        id (str): Identifier of the question (line number if the dataset doesn't give one)
+        question (str): User message
+        history (List[Dict[str, str]]): Previous messages of the conversation
+        expected (List[str]): Accepted answers (no score if empty)
+
+    """
+
+    id: str
+    question: str
+    history: List[Dict[str, str]] = field(default_factory=list)
+    expected: List[str] = field(default_factory=list)
+
+
+@dataclass
+class EvalResult:
+    """Answer of a model and template to a question of the dataset (a line of the checkpoint file)."""
+
+    model: str
+    template: str
+    id: str
+    ok: bool
+    latency: float
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    response: str = ""
+    error: Optional[str] = None
+    scores: Dict[str, float] = field(default_factory=dict)
+
+    @property
+    def key(self) -> Tuple[str, str, str]:
+        """Model, template and question of the result."""
+        return self.model, self.template, self.id
+
+
+def load_dataset(path: Path, limit: Optional[int] = None) -> List[EvalItem]:
+    """
+    Load the questions of a JSONL dataset.
+
+    Notes:
+        Each line has a 'question', and optionally an 'id', a 'history' and the accepted
+        answers ('expected' or 'answer', a string or a list). The chat turns exported by
+        `needle export` can be replayed as they are.
+
+    Args:
+        path (Path): Path of the JSONL dataset
+        limit (Optional[int]): Maximum number of questions
+
+    Returns:
+        List[EvalItem]: Questions of the dataset
+
+    """
+    items = []
+
+    with open(path, "r") as file:
+        for index, line in enumerate(file):
+            if not line.strip():
+                continue
+
+            record = json.loads(line)
+
+            if "question" not in record:
+                raise ValueError(f"Line {index + 1} of '{path}' has no 'question'")
+
+            expected = record.get("expected", record.get("answer")) or []
+            expected = [expected] if isinstance(expected, str) else list(expected)
+            history = [{"role": message["role"], "content": message["content"]} for message in record.get("history") or []]
+
+            items.append(EvalItem(id=str(record.get("id", index)), question=record["question"], history=history, expected=expected))
+
+            if limit is not None and len(items) >= limit:
+                break
+
+    return items
+
+
+def get_scores(response: str, expected: List[str]) -> Dict[str, float]:
+    """
+    Score a response against the accepted answers (best answer for each score).
+
+    Notes:
+        - exact_match: same words (case and punctuation ignored)
+        - contains: the words of an answer are in the response (in order)
+        - f1: harmonic mean of the precision and recall of the response words
+
+    Args:
+        response (str): Response of the chatbot
+        expected (List[str]): Accepted answers
+
+    Returns:
+        Dict[str, float]: Scores between 0 and 1 (empty without accepted answer)
+
+    """
+    if not expected:
+        return {}
+
+    tokens = tokenize(response)
+    text = " ".join(tokens)
+    scores = {"exact_match": 0.0, "contains": 0.0, "f1": 0.0}
+
+    for answer in expected:
+        answer_tokens = tokenize(answer)
+        answer_text = " ".join(answer_tokens)
+
+        common = sum(min(tokens.count(token), answer_tokens.count(token)) for token in set(answer_tokens))
+        precision = common / len(tokens) if tokens else 0.0
+        recall = common / len(answer_tokens) if answer_tokens else 0.0
+        f1 = 2 * precision * recall / (precision + recall) if common else 0.0
+
+        scores["exact_match"] = max(scores["exact_match"], float(text == answer_text))
+        scores["contains"] = max(scores["contains"], float(bool(answer_text) and f" {answer_text} " in f" {text} "))
+        scores["f1"] = max(scores["f1"], f1)
+
+    return scores
+
+
+def load_checkpoint(path: Path) -> Dict[Tuple[str, str, str], EvalResult]:
+    """
+    Load the results of a previous run (the last result of each question wins).
+
+    Args:
+        path (Path): Path of the JSONL results file
+
+    Returns:
+        Dict[Tuple[str, str, str], EvalResult]: Results by model, template and question
+
+    """
+    results = {}
+
+    if not path.exists():
+        return results
+
+    with open(path, "r") as file:
+        for line in file:
+            # The last line may be truncated by an interruption
+            try:
+                result = EvalResult(**json.loads(line))
+            except (json.JSONDecodeError, TypeError):
+                continue
+
+            results[result.key] = result
+
+    return results
+
+
+def summarize(results: Iterable[EvalResult]) -> Dict[str, Dict[str, float]]:
+    """
+    Compute the latency, token usage and scores of each model and template.
+
+    Args:
+        results (Iterable[EvalResult]): Results of the run
+
+    Returns:
+        Dict[str, Dict[str, float]]: Metrics by 'model/template'
+
+    """
+    groups: Dict[str, List[EvalResult]] = {}
+
+    for result in results:
+        groups.setdefault(f"{result.model}/{result.template}", []).append(result)
+
+    summary = {}
+
+    for name, group in sorted(groups.items()):
+        ok = [result for result in group if result.ok]
+        latency = np.array([result.latency for result in ok]) if ok else np.array([np.nan])
+        metrics = {
+            "questions": len(group),
+            "errors": len(group) - len(ok),
+            **{f"latency_p{p}_ms": round(float(np.percentile(latency, p)) * 1000, 2) for p in (50, 95)},
+            "prompt_tokens": sum(result.prompt_tokens for result in ok),
+            "completion_tokens": sum(result.completion_tokens for result in ok),
+        }
+
+        for score in ("exact_match", "contains", "f1"):
+            values = [result.scores[score] for result in ok if score in result.scores]
+
+            if values:
+                metrics[score] = round(sum(values) / len(values), 4)
+
+        summary[name] = metrics
+
+    return summary
+
+
+class Evaluator:
+    """
+    Replay a dataset of questions through the chat pipeline of several models and templates.
+
+    Notes:
+        - Each question is rendered by the pipeline ('retriever' and 'prompt_builder') and answered
+          by its 'llm' component, without the response cache, the feedback store or the fallback routes.
+        - The questions are sent concurrently: coroutines of `run_async` ('async' mode) or
+          threads running the blocking `run` ('thread' mode).
+        - Each result is appended to the results file as soon as it is known, an interrupted run
+          started again with the same file only replays the missing or failed questions.
+
+    Args:
+        settings (Config): Settings of the pipelines (index, context limits, ...)
+        output (Path): JSONL results file (checkpoint of the run)
+        concurrency (int): Maximum number of questions in flight
+        mode (str): Concurrency of the LLM calls ('async' or 'thread')
+
+    """
+
+    def __init__(self, settings: Config, output: Path, concurrency: int = 8, mode: str = "async"):
+        if mode not in MODES:
+            raise ValueError(f"Evaluation mode must be one of {MODES}: '{mode}'")
+
+        if concurrency <= 0:
+            raise ValueError(f"Evaluation concurrency must be positive: {concurrency}")
+
+        self.settings = settings
+        self.output = Path(output)
+        self.concurrency = concurrency
+        self.mode = mode
+
+        self.results = load_checkpoint(self.output)
+
+    def get_engine(self, model_name: str, template: str) -> ChatEngine:
+        """Create the chat engine of a model and template (blocking calls, no cache)."""
+        from needle.app import get_engine
+
+        settings = self.settings.update(
+            {
+                "model_name": model_name,
+                "prompt_template": template,
+                "streaming": False,
+                "fallback_routes": [],
+                "hedging": False,
+                "cache": False,
+                "feedback": False,
+            }
+        )
+
+        return get_engine(settings)
+
+    async def answer(self, engine: ChatEngine, item: EvalItem, executor: Optional[ThreadPoolExecutor]) -> Tuple[str, Dict[str, Any]]:
+        """Render the prompt of a question and call the 'llm' component (prompt and result of the component)."""
+        llm = engine.chat_pipeline.get_component("llm")
+        loop = asyncio.get_running_loop()
+
+        prompt, _ = await loop.run_in_executor(executor, engine.render, item.question, item.history)
+
+        if executor is None:
+            return prompt, await llm.run_async(prompt=prompt)
+
+        return prompt, await loop.run_in_executor(executor, partial(llm.run, prompt=prompt))
+
+    async def run_item(self, engine: ChatEngine, template: str, item: EvalItem, executor: Optional[ThreadPoolExecutor]) -> EvalResult:
+        """Answer a question and score the response."""
+        start = time.perf_counter()
+
+        try:
+            prompt, result = await self.answer(engine, item, executor)
+        except Exception as exception:
+            return EvalResult(engine.model_name, template, item.id, ok=False, latency=time.perf_counter() - start, error=repr(exception))
+
+        latency = time.perf_counter() - start
+        response = result["replies"][0]
+        usage = result["meta"][0].get("usage") or {}
+
+        # Estimated with the tokenizer of the model if the server doesn't give the usage
+        prompt_tokens = usage.get("prompt_tokens") or engine.counter.count(prompt)
+        completion_tokens = usage.get("completion_tokens") or engine.counter.count(response)
+
+        return EvalResult(
+            model=engine.model_name,
+            template=template,
+            id=item.id,
+            ok=True,
+            latency=latency,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            response=response,
+            scores=get_scores(response, item.expected),
+        )
+
+    async def run(self, items: List[EvalItem], models: List[str], templates: List[str]) -> Dict[str, Dict[str, float]]:
+        """
+        Replay the questions for each model and template (resumed from the results file).
+
+        Args:
+            items (List[EvalItem]): Questions of the dataset
+            models (List[str]): Models evaluated
+            templates (List[str]): Prompt templates evaluated
+
+        Returns:
+            Dict[str, Dict[str, float]]: Metrics by 'model/template'
+
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+        executor = ThreadPoolExecutor(max_workers=self.concurrency) if self.mode == "thread" else None
+        self.output.parent.mkdir(parents=True, exist_ok=True)
+
+        truncated = False
+
+        if self.output.exists() and self.output.stat().st_size:
+            with open(self.output, "rb") as file:
+                file.seek(-1, os.SEEK_END)
+                truncated = file.read(1) != b"\n"
+
+        with open(self.output, "a") as file:
+            # Terminate the line truncated by an interruption (ignored when loading)
+            if truncated:
+                file.write("\n")
+
+            async def run_item(engine: ChatEngine, template: str, item: EvalItem):
+                async with semaphore:
+                    result = await self.run_item(engine, template, item, executor)
+
+                # Written at once, an interruption loses the questions in flight only
+                self.results[result.key] = result
+                file.write(json.dumps(asdict(result), ensure_ascii=False) + "\n")
+                file.flush()
+
+            try:
+                for model_name in models:
+                    for template in templates:
+                        pending = [item for item in items if not self.is_done(model_name, template, item)]
+                        logger.info(f"Evaluation of '{model_name}/{template}': {len(pending)}/{len(items)} questions to answer")
+
+                        if not pending:
+                            continue
+
+                        engine = self.get_engine(model_name, template)
+                        await asyncio.gather(*(run_item(engine, template, item) for item in pending))
+            finally:
+                if executor is not None:
+                    executor.shutdown(wait=False, cancel_futures=True)
+
+        keys = {(model_name, template, item.id) for model_name in models for template in templates for item in items}
+        return summarize(result for key, result in self.results.items() if key in keys)
+
+    def is_done(self, model_name: str, template: str, item: EvalItem) -> bool:
+        """Check if a question was answered by a previous run."""
+        result = self.results.get((model_name, template, item.id))
+        return result is not None and result.ok
@@ -0,0 +1,302 @@
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+from loguru import logger
+
+from needle.metrics import FEEDBACK_DROPPED
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS turns (
+    id TEXT PRIMARY KEY,
+    created REAL NOT NULL,
+    session TEXT,
+    model TEXT NOT NULL,
+    template TEXT NOT NULL,
+    question TEXT NOT NULL,
+    history TEXT NOT NULL,
+    response TEXT NOT NULL,
+    cached INTEGER NOT NULL,
+    duration REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS turns_session ON turns (session, created);
+CREATE INDEX IF NOT EXISTS turns_model ON turns (model, created);
+CREATE INDEX IF NOT EXISTS turns_template ON turns (template, created);
+
+CREATE TABLE IF NOT EXISTS votes (
+    id TEXT PRIMARY KEY,
+    created REAL NOT NULL,
+    session TEXT,
+    model TEXT NOT NULL,
+    template TEXT NOT NULL,
+    question TEXT NOT NULL,
+    response TEXT NOT NULL,
+    liked INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS votes_session ON votes (session, created);
+CREATE INDEX IF NOT EXISTS votes_model ON votes (model, created);
+CREATE INDEX IF NOT EXISTS votes_template ON votes (template, created);
+"""
+
+# Columns of the tables, in the order of the records
+COLUMNS = {
+    "turns": ("id", "created", "session", "model", "template", "question", "history", "response", "cached", "duration"),
+    "votes": ("id", "created", "session", "model", "template", "question", "response", "liked"),
+}
+
+
+class FeedbackStore:
+    """
+    Append-only store of the chat turns and the votes of the users, in SQLite.
+
+    Notes:
+        - The handlers only put the record in a bounded queue, a background thread inserts
+          the records by batches (one transaction per batch). When the queue is full the
+          record is dropped (counted) instead of waiting, a chat turn never waits on the disk.
+        - The database is in WAL mode, the worker processes append to the same file.
+        - The records are indexed by session, model and template (see `export_records`).
+
+    Args:
+        path (Union[str, os.PathLike]): Path of the SQLite database
+        max_queue_size (int): Maximum number of records waiting to be written
+        batch_size (int): Maximum number of records written at once
+        flush_interval (float): Maximum time a record waits before being written (seconds)
+
+    """
+
+    def __init__(
+        self,
+        path: Union[str, os.PathLike],
+        max_queue_size: int = 10_000,
+        batch_size: int = 256,
+        flush_interval: float = 1.0,
+    ):
+        self.path = Path(path)
+        self.max_queue_size = max_queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        with self.connect() as connection:
+            connection.executescript(SCHEMA)
+
+        self.start()
+
+        # Forked workers don't inherit the writer thread, start a new one
+        os.register_at_fork(after_in_child=self.start)
+
+    def connect(self) -> sqlite3.Connection:
+        """Open a connection to the database."""
+        connection = sqlite3.connect(self.path, timeout=10)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def start(self):
+        """Start the writer thread (with an empty queue)."""
+        self.queue: queue.Queue = queue.Queue(maxsize=self.max_queue_size)
+        self.dropped = 0
+
+        self.thread = threading.Thread(target=self.loop, name="feedback-writer", daemon=True)
+        self.thread.start()
+
+    def put(self, table: str, record: Dict[str, Any]):
+        """Queue a record of a table (never blocks)."""
+        row = tuple(record[column] for column in COLUMNS[table])
+
+        try:
+            self.queue.put_nowait((table, row))
+        except queue.Full:
+            self.dropped += 1
+            FEEDBACK_DROPPED.labels(table=table).inc()
+
+    def add_turn(
+        self,
+        session: Optional[str],
+        model: str,
+        template: str,
+        question: str,
+        history: List[Dict[str, str]],
+        response: str,
+        cached: bool = False,
+        duration: float = 0.0,
+    ) -> str:
+        """
+        Record a chat turn.
+
+        Args:
+            session (Optional[str]): Session of the conversation (None if unknown)
+            model (str): Model of the chat engine
+            template (str): Prompt template of the turn
+            question (str): User message
+            history (List[Dict[str, str]]): Previous messages kept in the prompt
+            response (str): Response of the chatbot
+            cached (bool): Response served by the response cache
+            duration (float): Duration of the turn (seconds)
+
+        Returns:
+            str: Identifier of the turn
+
+        """
+        record = {
+            "id": uuid.uuid4().hex,
+            "created": time.time(),
+            "session": session,
+            "model": model,
+            "template": template,
+            "question": question,
+            "history": json.dumps(history),
+            "response": response,
+            "cached": int(cached),
+            "duration": duration,
+        }
+
+        self.put("turns", record)
+        return record["id"]
+
+    def add_vote(self, session: Optional[str], model: str, template: str, question: str, response: str, liked: bool) -> str:
+        """
+        Record the vote of a user on a response.
+
+        Args:
+            session (Optional[str]): Session of the conversation (None if unknown)
+            model (str): Model of the chat engine
+            template (str): Prompt template of the session
+            question (str): User message
+            response (str): Response of the chatbot
+            liked (bool): The user liked the response
+
+        Returns:
+            str: Identifier of the vote
+
+        """
+        record = {
+            "id": uuid.uuid4().hex,
+            "created": time.time(),
+            "session": session,
+            "model": model,
+            "template": template,
+            "question": question,
+            "response": response,
+            "liked": int(liked),
+        }
+
+        self.put("votes", record)
+        return record["id"]
+
+    def stop(self):
+        """Write the remaining records and stop the writer thread."""
+        self.queue.put(None)
+        self.thread.join(timeout=10)
+
+    def loop(self):
+        """Insert the queued records by batches until the store is stopped."""
+        connection = self.connect()
+        running = True
+
+        while running:
+            records: List[Optional[Tuple[str, tuple]]] = [self.queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+
+            # Wait a little to group the records in a single transaction
+            while len(records) < self.batch_size and records[-1] is not None:
+                timeout = deadline - time.monotonic()
+
+                try:
+                    records.append(self.queue.get(timeout=timeout) if timeout > 0 else self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            if records[-1] is None:
+                records.pop()
+                running = False
+
+            try:
+                self.write(connection, records)
+            except sqlite3.Error as exception:
+                logger.error(f"{len(records)} feedback records not written: {exception}")
+
+        connection.close()
+
+    def write(self, connection: sqlite3.Connection, records: List[Tuple[str, tuple]]):
+        """Insert a batch of records in a single transaction."""
+        if not records:
+            return
+
+        rows: Dict[str, List[tuple]] = {}
+
+        for table, row in records:
+            rows.setdefault(table, []).append(row)
+
+        with connection:
+            for table, values in rows.items():
+                columns = COLUMNS[table]
+                connection.executemany(
+                    f"INSERT OR IGNORE INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",  # noqa: S608
+                    values,
+                )
+
+        if self.dropped:
+            logger.warning(f"{self.dropped} feedback records dropped (writer queue full)")
+            self.dropped = 0
+
+
+def export_records(
+    path: Union[str, os.PathLike],
+    table: str = "turns",
+    session: Optional[str] = None,
+    model: Optional[str] = None,
+    template: Optional[str] = None,
+    since: Optional[float] = None,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Read the records of a feedback table, oldest first (written records only).
+
+    Args:
+        path (Union[str, os.PathLike]): Path of the SQLite database
+        table (str): Table to read ('turns' or 'votes')
+        session (Optional[str]): Only the records of this session
+        model (Optional[str]): Only the records of this model
+        template (Optional[str]): Only the records of this prompt template
+        since (Optional[float]): Only the records created after this timestamp
+
+    Returns:
+        Iterator[Dict[str, Any]]: Records of the table
+
+    """
+    if table not in COLUMNS:
+        raise ValueError(f"Unknown feedback table '{table}', expected one of {list(COLUMNS)}")
+
+    filters = {"session = ?": session, "model = ?": model, "template = ?": template, "created >= ?": since}
+    filters = {condition: value for condition, value in filters.items() if value is not None}
+    where = f"WHERE {' AND '.join(filters)}" if filters else ""
+
+    columns = COLUMNS[table]
+    connection = sqlite3.connect(f"file:{Path(path).absolute()}?mode=ro", uri=True, timeout=10)
+
+    try:
+        cursor = connection.execute(
+            f"SELECT {', '.join(columns)} FROM {table} {where} ORDER BY created",  # noqa: S608
+            tuple(filters.values()),
+        )
+
+        for row in cursor:
+            record = dict(zip(columns, row))
+
+            if "history" in record:
+                record["history"] = json.loads(record["history"])
+
+            for column in ("cached", "liked"):
+                if column in record:
+                    record[column] = bool(record[column])
+
+            yield record
+    finally:
+        connection.close()
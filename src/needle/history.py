@@ -0,0 +1,100 @@
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional
+
+from loguru import logger
+
+# Tokens added by the chat format around each message ('role: content' line)
+MESSAGE_OVERHEAD = 4
+
+
+@lru_cache(maxsize=16)
+def get_encoder(model_name: str) -> Optional[Callable[[str], List[int]]]:
+    """
+    Get the tokenizer of the model (tiktoken is an optional dependency).
+
+    Args:
+        model_name (str): OpenAI model name
+
+    Returns:
+        Optional[Callable[[str], List[int]]]: Encode function, None if tiktoken isn't installed
+
+    """
+    try:
+        import tiktoken
+    except ImportError:
+        logger.warning("tiktoken isn't installed, the number of tokens is estimated from the text length")
+        return None
+
+    try:
+        encoding = tiktoken.encoding_for_model(model_name)
+    except KeyError:
+        encoding = tiktoken.get_encoding("o200k_base")
+
+    return encoding.encode
+
+
+class TokenCounter:
+    """
+    Count the tokens of the texts sent to a model.
+
+    Notes:
+        The count of each text is memoized, the history of a conversation is sent again
+        at each turn but only the new messages are tokenized.
+
+    Args:
+        model_name (str): OpenAI model name
+        maxsize (int): Maximum number of memoized texts
+
+    """
+
+    def __init__(self, model_name: str, maxsize: int = 65_536):
+        self.model_name = model_name
+        self.encode = get_encoder(model_name)
+        self.count = lru_cache(maxsize=maxsize)(self._count)
+
+    def _count(self, text: str) -> int:
+        """Count the tokens of a text (about 4 characters per token without tokenizer)."""
+        if self.encode is None:
+            return len(text) // 4 + 1
+
+        return len(self.encode(text))
+
+
+def trim_history(
+    history: List[Dict[str, str]],
+    budget: int,
+    counter: TokenCounter,
+) -> List[Dict[str, str]]:
+    """
+    Keep the most recent messages of the history fitting in the tokens budget.
+
+    Notes:
+        The oldest messages are dropped first, a conversation turn (user message and
+        assistant response) is never split so the history always starts with a user message.
+
+    Args:
+        history (List[Dict[str, str]]): Messages of the conversation ('role' and 'content')
+        budget (int): Maximum number of tokens of the kept messages
+        counter (TokenCounter): Token counter of the model
+
+    Returns:
+        List[Dict[str, str]]: Most recent messages of the history
+
+    """
+    total = 0
+    start = len(history)
+
+    for index in range(len(history) - 1, -1, -1):
+        total += counter.count(history[index]["content"]) + MESSAGE_OVERHEAD
+
+        if total > budget:
+            break
+
+        # Only cut the history before a user message (start of a turn)
+        if history[index]["role"] == "user":
+            start = index
+
+    if start:
+        logger.debug(f"History trimmed to the {len(history) - start}/{len(history)} most recent messages")
+
+    return history[start:]
@@ -0,0 +1,261 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+
+from haystack import Document
+from loguru import logger
+
+from needle.embeddings import EmbeddingCache, EmbeddingIndex, LocalEmbedder, OpenAIEmbedder
+from needle.retrieval import CURRENT_FILE, GENERATIONS_DIR, BM25Index, chunk_files, get_generation_path, list_files
+
+
+class Indexer:
+    """
+    Incremental indexer of a documents directory, publishing the index by generations.
+
+    Notes:
+        - A file is changed when its mtime or size changed and its content hash differs, the
+          files touched without change are not chunked again.
+        - Only the added and changed files are chunked (and their chunks embedded, the unchanged
+          chunks are read from the embedding cache), the chunks of the other files are copied from
+          the current generation. The BM25 weights depend on the whole corpus, they are computed again.
+        - A generation is a complete index directory ('generations/<number>'), written aside and then
+          published by replacing the 'CURRENT' file at once. The workers switch on their next query
+          (see `load_index`), the previous generations are removed after `keep` newer ones.
+        - The manifest of a generation (files, hashes and chunks ranges) lets a new indexer
+          continue from the current generation. Other chunking, embedding or IVF options rebuild it
+          (the unchanged chunks are read from the embedding cache).
+
+    Args:
+        directory (Union[str, os.PathLike]): Directory of the documents
+        index_path (Union[str, os.PathLike]): Directory of the index
+        extensions (List[str]): File extensions to index
+        chunk_size (int): Number of words per chunk
+        chunk_overlap (int): Number of words shared by two consecutive chunks
+        embedder (Union[OpenAIEmbedder, LocalEmbedder, None]): Embedding model of the chunks (no embeddings if None)
+        cache (Optional[EmbeddingCache]): Embeddings of the chunks already embedded (every chunk embedded again if None)
+        batch_size (int): Number of chunks embedded per request
+        dtype (str): Type of the stored embeddings ('float32' or 'float16')
+        backend (str): Backend of the embedder
+        ann_index (bool): Build the IVF index of the embeddings (approximate search)
+        ann_lists (Optional[int]): Number of lists of the IVF index (about 4 x sqrt(N) if None)
+        ann_iterations (int): Number of k-means iterations of the IVF index
+        keep (int): Number of previous generations kept (queries in flight of the workers)
+
+    """
+
+    def __init__(
+        self,
+        directory: Union[str, os.PathLike],
+        index_path: Union[str, os.PathLike],
+        extensions: List[str] = (".txt", ".md"),
+        chunk_size: int = 200,
+        chunk_overlap: int = 20,
+        embedder: Union[OpenAIEmbedder, LocalEmbedder, None] = None,
+        cache: Optional[EmbeddingCache] = None,
+        batch_size: int = 64,
+        dtype: str = "float32",
+        backend: str = "openai",
+        ann_index: bool = False,
+        ann_lists: Optional[int] = None,
+        ann_iterations: int = 10,
+        keep: int = 2,
+    ):
+        self.directory = Path(directory)
+        self.index_path = Path(index_path)
+        self.extensions = sorted(extension.lower() for extension in extensions)
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.embedder = embedder
+        self.cache = cache
+        self.batch_size = batch_size
+        self.dtype = dtype
+        self.backend = backend
+        self.ann_index = ann_index
+        self.ann_lists = ann_lists
+        self.ann_iterations = ann_iterations
+        self.keep = keep
+
+        self.files = self.load_manifest()
+
+    @property
+    def options(self) -> Dict[str, Any]:
+        """Options of the chunks, embeddings and IVF index (a change rebuilds the index)."""
+        return {
+            "extensions": self.extensions,
+            "chunk_size": self.chunk_size,
+            "chunk_overlap": self.chunk_overlap,
+            "embedding_model": None if self.embedder is None else self.embedder.model,
+            "backend": self.backend,
+            "dtype": self.dtype,
+            "ann_index": self.ann_index,
+            "ann_lists": self.ann_lists,
+            "ann_iterations": self.ann_iterations,
+        }
+
+    def load_manifest(self) -> Dict[str, Dict[str, Any]]:
+        """Files of the current generation (empty without generation or with other options)."""
+        path = get_generation_path(self.index_path) / "manifest.json"
+
+        if not path.exists():
+            return {}
+
+        manifest = json.loads(path.read_text())
+
+        if manifest["options"] != self.options:
+            logger.info("Index options changed, the index is rebuilt")
+            return {}
+
+        return manifest["files"]
+
+    def scan(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Get the state of the files of the directory.
+
+        Returns:
+            Dict[str, Dict[str, Any]]: Files by path relative to the directory ('mtime_ns', 'size', 'sha256',
+                and the chunks range of the current generation 'start' and 'stop' for the unchanged files)
+
+        """
+        files = {}
+
+        for path in list_files(self.directory, self.extensions):
+            name = str(path.relative_to(self.directory))
+            stat = path.stat()
+            entry = self.files.get(name)
+            state = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+
+            # Copied, the ranges of the current generation are kept until the next one is published
+            if entry is not None and entry["mtime_ns"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+                files[name] = dict(entry)
+                continue
+
+            digest = hashlib.sha256(path.read_bytes()).hexdigest()
+
+            # Same content (touched, or rewritten as it was), the chunks are kept
+            if entry is not None and entry["sha256"] == digest:
+                files[name] = {**entry, **state}
+                continue
+
+            files[name] = {**state, "sha256": digest}
+
+        return files
+
+    def update(self, rebuild: bool = False) -> Optional[Path]:
+        """
+        Index the changes of the directory and publish a new generation (if anything changed).
+
+        Args:
+            rebuild (bool): Chunk and embed every file again (new generation even without change)
+
+        Returns:
+            Optional[Path]: Directory of the published generation (None without change)
+
+        """
+        if rebuild:
+            self.files = {}
+
+        start = time.perf_counter()
+        files = self.scan()
+
+        added = [name for name in files if name not in self.files]
+        changed = [name for name in files if name in self.files and "start" not in files[name]]
+        deleted = [name for name in self.files if name not in files]
+
+        if not (added or changed or deleted or rebuild):
+            # Only the mtimes of the touched files changed
+            self.files = files
+            return None
+
+        documents = self.get_documents(files)
+        path = self.publish(documents, files)
+
+        logger.info(
+            f"Index generation '{path.name}' published in {time.perf_counter() - start:.2f} seconds "
+            f"({len(added)} added, {len(changed)} changed, {len(deleted)} deleted files, {len(documents)} chunks)"
+        )
+        return path
+
+    def get_documents(self, files: Dict[str, Dict[str, Any]]) -> List[Document]:
+        """Chunk the new files, copy the chunks of the others from the current generation (sets their range)."""
+        names = [name for name, entry in files.items() if "start" not in entry]
+        chunks: Dict[str, List[Document]] = {name: [] for name in names}
+
+        for document in chunk_files(self.directory, [self.directory / name for name in names], self.chunk_size, self.chunk_overlap):
+            chunks[document.meta["file_path"]].append(document)
+
+        previous = BM25Index(get_generation_path(self.index_path)) if len(names) < len(files) else None
+        documents = []
+
+        for name, entry in sorted(files.items()):
+            if name in chunks:
+                file_documents = chunks[name]
+            else:
+                file_documents = list(previous.iter_documents(entry["start"], entry["stop"]))
+
+            entry["start"], entry["stop"] = len(documents), len(documents) + len(file_documents)
+            documents.extend(file_documents)
+
+        return documents
+
+    def publish(self, documents: List[Document], files: Dict[str, Dict[str, Any]]) -> Path:
+        """Write a new generation with the documents and make it the current one."""
+        generations = self.index_path / GENERATIONS_DIR
+        generations.mkdir(parents=True, exist_ok=True)
+
+        numbers = [int(path.name) for path in generations.iterdir() if path.name.isdigit()]
+        path = generations / f"{max(numbers, default=0) + 1:06d}"
+
+        BM25Index.build(documents, path)
+
+        if self.embedder is not None:
+            EmbeddingIndex.build(
+                documents,
+                path,
+                self.embedder,
+                cache=self.cache,
+                batch_size=self.batch_size,
+                dtype=self.dtype,
+                backend=self.backend,
+                ann_index=self.ann_index,
+                ann_lists=self.ann_lists,
+                ann_iterations=self.ann_iterations,
+            )
+
+        (path / "manifest.json").write_text(json.dumps({"options": self.options, "files": files}))
+
+        # The workers read the 'CURRENT' file, replaced at once by the complete generation
+        temporary_path = self.index_path / f"{CURRENT_FILE}.tmp"
+        temporary_path.write_text(path.name)
+        os.replace(temporary_path, self.index_path / CURRENT_FILE)
+
+        self.files = files
+
+        # Keep the previous generations still read by the queries in flight
+        for old in sorted(path_ for path_ in generations.iterdir() if path_.name.isdigit())[: -(self.keep + 1)]:
+            shutil.rmtree(old, ignore_errors=True)
+
+        return path
+
+    def watch(self, interval: float = 2.0):
+        """
+        Index the changes of the directory every `interval` seconds (until interrupted).
+
+        Args:
+            interval (float): Time between two scans of the directory (seconds)
+
+        """
+        logger.info(f"Watching '{self.directory}' for changes (every {interval} seconds)")
+
+        while True:
+            try:
+                self.update()
+            except Exception as exception:
+                # A file written during the scan is indexed by the next one
+                logger.error(f"Index not updated: {exception!r}")
+
+            time.sleep(interval)
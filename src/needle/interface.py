@@ -1,13 +1,27 @@
 import logging
+import time
 from functools import partial
-from typing import List, Optional, TypedDict, Callable
+from typing import Any, AsyncIterator, Dict, List, Optional, TypedDict, Callable, Union
 
 import gradio as gr
 from haystack import Pipeline
 from haystack.components.builders import PromptBuilder
-from haystack.components.generators import OpenAIGenerator
-
-from needle.utils import load_css, load_html, load_template
+from haystack.utils import Secret
+
+from needle.cache import ResponseCache
+from needle.components import AsyncOpenAIGenerator
+from needle.connections import ConnectionPool
+from needle.engine import ChatEngine
+from needle.feedback import FeedbackStore
+from needle.metrics import GRADIO_EVENTS, GRADIO_QUEUE_WAIT
+from needle.prompts import TemplateNotFoundError, TemplateRegistry
+from needle.ratelimit import RateLimiter
+from needle.reranking import CrossEncoderReranker
+from needle.retrieval import BM25Retriever, HybridRetriever, VectorRetriever
+from needle.router import Route, RouterGenerator
+from needle.scheduler import BusyError, Scheduler
+from needle.sessions import SessionStore
+from needle.utils import load_css, load_html
 
 
 class MetaData(TypedDict):
@@ -35,73 +49,207 @@ class Message(TypedDict):
     metadata: MetaData
 
 
-def vote(data: gr.LikeData, list_messages: List[Message]) -> None:
+def get_queue_wait() -> Optional[float]:
+    """
+    Get the time spent in the Gradio queue by the event being handled
+
+    Returns
+    -------
+        Optional[float]: Waiting time (seconds), None outside of a queued Gradio event
+
+    """
+    from gradio.context import LocalContext
+
+    blocks = LocalContext.blocks.get()
+    event_id = LocalContext.event_id.get()
+
+    if blocks is None or event_id is None or blocks._queue is None:
+        return None
+
+    # Time at which the event was pushed in the queue (private analytics of Gradio)
+    analytics = blocks._queue.event_analytics.get(event_id) or {}
+    queued_at = analytics.get("time")
+
+    return None if queued_at is None else max(time.time() - queued_at, 0)
+
+
+def record_event(event: str, model_name: str, outcome: str):
+    """
+    Record a Gradio event in the metrics (same labels for every event)
+
+    Args:
+    ----
+        event (str): Name of the event ('echo', 'retry' or 'vote')
+        model_name (str): Model of the chat engine
+        outcome (str): Result of the event ('success', 'busy', 'error', 'cancelled', 'liked' or 'disliked')
+
+    """
+    GRADIO_EVENTS.labels(event=event, model=model_name, outcome=outcome).inc()
+
+
+def observe_queue_wait(event: str, model_name: str):
+    """
+    Record the time spent in the Gradio queue by the event being handled
+
+    Args:
+    ----
+        event (str): Name of the event ('echo', 'retry' or 'vote')
+        model_name (str): Model of the chat engine
+
+    """
+    wait = get_queue_wait()
+
+    if wait is not None:
+        GRADIO_QUEUE_WAIT.labels(event=event, model=model_name).observe(wait)
+
+
+def get_session_id(request: Optional[gr.Request]) -> Optional[str]:
+    """
+    Get the session of a Gradio event
+
+    Args:
+    ----
+        request (Optional[gr.Request]): User request
+
+    Returns:
+    -------
+        Optional[str]: Session id, None outside of a Gradio session
+
+    """
+    return request.session_hash if request else None
+
+
+def vote(
+    data: gr.LikeData,
+    template: Optional[str],
+    request: gr.Request,
+    engine: ChatEngine,
+    sessions: SessionStore,
+) -> None:
     """
     Get the user vote response
 
     Args:
     ----
-        data (gr.LikeData): User vote data
-        list_messages (List[Message]): Chatbot history
+        data (gr.LikeData): User vote data (index and content of the voted message)
+        template (Optional[str]): Prompt template chosen in the session
+        request (gr.Request): User request (session of the vote)
+        engine (ChatEngine): Chatbot inference engine (model of the metrics labels, feedback store)
+        sessions (SessionStore): Conversations of the sessions (question of the voted response)
 
     Returns:
     -------
-        None: Print the user vote response
+        None: Record the user vote response (feedback store of the engine)
 
     """
-    index = data.index[0]
-    response = list_messages[index]["content"]
-    message = list_messages[index - 1]["content"]
+    session_id = get_session_id(request)
+    list_messages = sessions.get(session_id) if session_id else []
+
+    index = data.index[0] if isinstance(data.index, (list, tuple)) else data.index
+    response = list_messages[index]["content"] if index < len(list_messages) else data.value
+    message = list_messages[index - 1]["content"] if 0 < index <= len(list_messages) else ""
+
+    observe_queue_wait("vote", engine.model_name)
 
     if data.liked:
         vote = "👍"
+        record_event("vote", engine.model_name, "liked")
     else:
         vote = "👎"
+        record_event("vote", engine.model_name, "disliked")
 
     logging.debug(f"User vote: {vote} - Message: '{message}' - Response: '{response}'")
 
+    if engine.feedback is not None:
+        engine.feedback.add_vote(
+            session=session_id,
+            model=engine.model_name,
+            template=template or engine.template_name,
+            question=message,
+            response=response,
+            liked=bool(data.liked),
+        )
+
+
+def get_last_user_index(list_messages: List[Dict[str, Any]]) -> Optional[int]:
+    """
+    Get the position of the last user message of a conversation
+
+    Args:
+    ----
+        list_messages (List[Dict[str, Any]]): Messages of the conversation
+
+    Returns:
+    -------
+        Optional[int]: Position of the last user message, None without user message
+
+    """
+    for index in range(len(list_messages) - 1, -1, -1):
+        if list_messages[index]["role"] == "user":
+            return index
+
+    return None
+
 
-def undo(list_messages: List[Message]) -> gr.update:
+def undo(request: gr.Request, sessions: SessionStore) -> List[Message]:
     """
-    Gradio pipeline to undo the last message
+    Gradio pipeline to undo the last message (user message and its response, if any)
 
     Args:
     ----
-        list_messages (List[Message]): Chatbot history
+        request (gr.Request): User request (session of the conversation)
+        sessions (SessionStore): Conversations of the sessions
 
     Returns:
     -------
-        List[Message]: Chatbot history without the last message
+        List[Message]: Chatbot history of the session store without the last turn
 
     """
-    if len(list_messages) >= 2:
-        return gr.update(value=list_messages[:-2])
+    session_id = get_session_id(request)
+    list_messages = sessions.get(session_id) if session_id else []
+    index = get_last_user_index(list_messages)
 
-    gr.Warning("History haven't enough messages to undo")
-    return gr.update(value=list_messages)
+    if index is None:
+        gr.Warning("History haven't enough messages to undo")
+        return list_messages
 
+    sessions.truncate(session_id, index)
+    return list_messages[:index]
 
-def clear(list_messages: Optional[List[Message]] = None) -> gr.update:
+
+def clear(request: gr.Request, sessions: SessionStore) -> List[Message]:
     """
     Gradio pipeline to clear the chatbot history
 
-    Returns
+    Args:
+    ----
+        request (gr.Request): User request (session of the conversation)
+        sessions (SessionStore): Conversations of the sessions
+
+    Returns:
     -------
         List[Message]: Empty chatbot history
 
     """
-    if not list_messages:
+    session_id = get_session_id(request)
+
+    if not session_id or not sessions.get(session_id):
         gr.Warning("History is already empty")
-        return gr.update(value=[])
+        return []
 
-    return gr.update(value=[])
+    sessions.clear(session_id)
+    return []
 
 
-def echo(
+async def echo(
     message: str,
     history: List[Message],
-    chat_pipeline: Pipeline,
-) -> str:
+    template: Optional[str],
+    request: gr.Request,
+    engine: ChatEngine,
+    sessions: Optional[SessionStore] = None,
+    event: str = "echo",
+) -> AsyncIterator[str]:
     """
     Get the assistant response message
 
@@ -109,52 +257,164 @@ def echo(
     ----
         message (str): User message
         history (List[Message]): Chatbot history
-        chat_pipeline (Pipeline): Chatbot pipeline
+        template (Optional[str]): Prompt template chosen in the session (default template if None)
+        request (gr.Request): User request (its client is used for fair scheduling and charged the tokens)
+        engine (ChatEngine): Chatbot inference engine
+        sessions (Optional[SessionStore]): Conversations of the sessions (history of the turn, the user message is stored before the response)
+        event (str): Name of the Gradio event in the metrics ('echo', or 'retry' when called by `retry`)
 
     Returns:
     -------
-        str: Chatbot response message
+        AsyncIterator[str]: Chatbot response message (partial while streaming, complete at the end)
 
     """
-    # Start inference with the chat pipeline
-    result = chat_pipeline.run({"prompt_builder": {"question": message}})
-    return result["llm"]["replies"][0]
-
-
-def retry(list_messages: List[Message], callback_echo: Callable[[str, List[Message]], str]) -> gr.update:
+    client_id = engine.get_client_id(request.headers, request.client.host if request.client else None) if request else "anonymous"
+    session_id = get_session_id(request)
+    model_name = engine.model_name
+    outcome = "cancelled"
+    response = ""
+
+    # The messages come from the session store, the chatbot only gives the position of the turn
+    # (its own retry and undo buttons remove the last turn in the browser)
+    if sessions is not None and session_id:
+        stored = sessions.get(session_id)
+
+        if len(stored) >= len(history):
+            history = stored[: len(history)]
+        else:
+            # Expired, evicted or stored by another worker (in-process store): the chatbot history is kept
+            logging.warning(f"Session '{session_id}' has {len(stored)}/{len(history)} messages in the store, restored from the chatbot")
+            sessions.replace(session_id, 0, history)
+
+        sessions.replace(session_id, len(history), [{"role": "user", "content": message}])
+
+    observe_queue_wait(event, model_name)
+
+    try:
+        # Start inference with the chat engine (don't block the event loop)
+        async for response in engine.stream(message, history, client_id=client_id, template=template, session_id=session_id):
+            yield response
+
+        outcome = "success"
+    except BusyError:
+        outcome = "busy"
+        raise gr.Error("The chatbot is busy, please retry in a few seconds")
+    except TemplateNotFoundError:
+        outcome = "error"
+        raise gr.Error(f"The prompt template '{template}' doesn't exist anymore, please choose another one")
+    except Exception:
+        outcome = "error"
+        raise
+    finally:
+        record_event(event, model_name, outcome)
+
+    # Only the response is written, the user message and the history are already in the store
+    if sessions is not None and session_id:
+        sessions.replace(session_id, len(history) + 1, [{"role": "assistant", "content": response}])
+
+
+async def retry(
+    template: Optional[str],
+    request: gr.Request,
+    callback_echo: Callable[..., AsyncIterator[str]],
+    sessions: SessionStore,
+) -> AsyncIterator[gr.update]:
     """
-    Gradio pipeline to retry the last user message
+    Gradio pipeline to retry the last user message (history of the session store)
 
     Args:
     ----
-        list_messages (List[Message]): Chatbot history
-        callback_echo (Callable[[str, List[Message]], str]): Chatbot echo function (easily dependency injection)
+        template (Optional[str]): Prompt template chosen in the session (given to the echo function)
+        request (gr.Request): User request (given to the echo function)
+        callback_echo (Callable[..., AsyncIterator[str]]): Chatbot echo function (easily dependency injection, called with event='retry')
+        sessions (SessionStore): Conversations of the sessions
 
     Returns:
     -------
-        List[Message]: Chatbot history with the last user message
+        AsyncIterator[List[Message]]: Chatbot history with the last user message
 
     """
-    if len(list_messages) < 2:
+    session_id = get_session_id(request)
+    list_messages = sessions.get(session_id) if session_id else []
+    index = get_last_user_index(list_messages)
+
+    if index is None:
         gr.Warning("History haven't enough messages to retry")
-        return gr.update(value=list_messages)
+        yield gr.skip()
+        return
+
+    # Get the last user message (its response is replaced, even if the previous attempt failed)
+    message = list_messages[index]["content"]
+    list_messages = list_messages[:index]
+
+    # Stream the new response after the user message (history before the user message)
+    async for response in callback_echo(message, list_messages, template, request, event="retry"):
+        yield gr.update(
+            value=[
+                *list_messages,
+                {"role": "user", "content": message},
+                {"role": "assistant", "content": response, "metadata": {"title": None}},
+            ]
+        )
+
 
-    # Get the last user message
-    message = list_messages[-2]["content"]
+def get_llm_generator(
+    model_name: str,
+    fallback_routes: Optional[List[Dict]] = None,
+    route_timeout: float = 30,
+    hedging: bool = False,
+    http_pool: Optional[ConnectionPool] = None,
+) -> Union[AsyncOpenAIGenerator, RouterGenerator]:
+    """
+    Create the llm component (a router between several models if needed)
+
+    Args:
+        model_name (str): OpenAI model name (default route)
+        fallback_routes (Optional[List[Dict]]): Other routes ('model', 'name', 'api_base_url', 'api_key_env', 'max_prompt_tokens')
+        route_timeout (float): Time to the first token before failing over (seconds)
+        hedging (bool): Send a second call when the first one is slower than usual
+        http_pool (Optional[ConnectionPool]): HTTP connections shared by the routes (own clients if None)
 
-    # Remove user and chatbot messages
-    list_messages = list_messages[:-1]
+    Returns:
+        Union[AsyncOpenAIGenerator, RouterGenerator]: Generator of the model, or router between the routes
 
-    # Add user message to the list
-    response = callback_echo(message, list_messages)
-    list_messages.append({"role": "assistant", "content": response, "metadata": {"title": None}})
+    """
+    if not fallback_routes and not hedging:
+        return AsyncOpenAIGenerator(model=model_name, http_pool=http_pool)
+
+    # The router fails over at once, the OpenAI client doesn't retry by itself
+    routes = [Route(AsyncOpenAIGenerator(model=model_name, max_retries=0, http_pool=http_pool))]
+
+    for options in fallback_routes or []:
+        generator = AsyncOpenAIGenerator(
+            api_key=Secret.from_env_var(options.get("api_key_env", "OPENAI_API_KEY")),
+            model=options["model"],
+            api_base_url=options.get("api_base_url"),
+            max_retries=0,
+            http_pool=http_pool,
+        )
+        routes.append(Route(generator, name=options.get("name"), max_prompt_tokens=options.get("max_prompt_tokens")))
 
-    return gr.update(value=list_messages)
+    return RouterGenerator(routes, timeout=route_timeout, hedging=hedging)
 
 
 def get_llm_pipeline(
     model_name: str,
     prompt_template: str,
+    index_path: Optional[str] = None,
+    top_k: int = 5,
+    retrieval: str = "bm25",
+    ann_probes: int = 8,
+    embedding_url: Optional[str] = None,
+    hybrid_candidates: int = 20,
+    rrf_k: int = 60,
+    rerank_model: Optional[str] = None,
+    rerank_top_n: int = 20,
+    retrieval_budget: Optional[float] = None,
+    fallback_routes: Optional[List[Dict]] = None,
+    route_timeout: float = 30,
+    hedging: bool = False,
+    http_pool: Optional[ConnectionPool] = None,
 ) -> Pipeline:
     """
     Create the chatbot pipeline with the components
@@ -162,6 +422,20 @@ def get_llm_pipeline(
     Args:
         model_name (str): OpenAI model name
         prompt_template (str): Prompt template string
+        index_path (Optional[str]): Directory of the documents index (no retrieval if None)
+        top_k (int): Number of documents given to the prompt
+        retrieval (str): Retrieval of the documents ('bm25' keywords, 'vector' embeddings of the query or 'hybrid' both)
+        ann_probes (int): Number of IVF lists scored per query ('vector' and 'hybrid' retrievals with an IVF index)
+        embedding_url (Optional[str]): URL of the embedding API of the queries ('vector' and 'hybrid' retrievals)
+        hybrid_candidates (int): Number of documents of each search fused by the 'hybrid' retrieval
+        rrf_k (int): Rank smoothing constant of the reciprocal rank fusion ('hybrid' retrieval)
+        rerank_model (Optional[str]): Cross-encoder reranking the fused documents ('hybrid' retrieval, no reranking if None)
+        rerank_top_n (int): Number of fused documents reranked
+        retrieval_budget (Optional[float]): Latency budget of the 'hybrid' retrieval, reranking skipped beyond (seconds, no limit if None)
+        fallback_routes (Optional[List[Dict]]): Other models used on failure or slowness of the default one
+        route_timeout (float): Time to the first token before failing over (seconds)
+        hedging (bool): Send a second call when the first one is slower than usual
+        http_pool (Optional[ConnectionPool]): HTTP connections shared by the generators (own clients if None)
 
     Returns:
         Pipeline: Chatbot pipeline instance
@@ -170,8 +444,8 @@ def get_llm_pipeline(
     # Prepare the prompt_builder component
     prompt_builder = PromptBuilder(template=prompt_template)
 
-    # Prepare the llm component
-    llm = OpenAIGenerator(model=model_name)
+    # Prepare the llm component (also usable without blocking by the chat engine)
+    llm = get_llm_generator(model_name, fallback_routes=fallback_routes, route_timeout=route_timeout, hedging=hedging, http_pool=http_pool)
 
     # Prepare the Pipeline
     chat_pipeline = Pipeline()
@@ -183,39 +457,204 @@ def get_llm_pipeline(
     # Make the connections between components in the pipeline
     chat_pipeline.connect("prompt_builder", "llm")
 
+    # Prepare the optional retriever component (documents given to the prompt)
+    if index_path is not None:
+        http_client = None if http_pool is None else http_pool.client
+
+        if retrieval == "hybrid":
+            retriever = HybridRetriever(
+                index_path=index_path,
+                top_k=top_k,
+                candidates=hybrid_candidates,
+                rrf_k=rrf_k,
+                probes=ann_probes,
+                api_base_url=embedding_url,
+                http_client=http_client,
+                reranker=None if rerank_model is None else CrossEncoderReranker(rerank_model, top_n=rerank_top_n),
+                budget=retrieval_budget,
+            )
+        elif retrieval == "vector":
+            retriever = VectorRetriever(index_path=index_path, top_k=top_k, probes=ann_probes, api_base_url=embedding_url, http_client=http_client)
+        else:
+            retriever = BM25Retriever(index_path=index_path, top_k=top_k)
+
+        retriever.warm_up()
+
+        chat_pipeline.add_component("retriever", retriever)
+        chat_pipeline.connect("retriever.documents", "prompt_builder.documents")
+
     return chat_pipeline
 
 
-def get_gradio_app(
+def get_chat_engine(
     model_name: str = "gpt-4o-mini",
     prompt_template: str = "system",
-) -> gr.Blocks:
+    streaming: bool = True,
+    max_concurrency: int = 64,
+    model_concurrency: Optional[Dict[str, int]] = None,
+    max_queue_size: int = 256,
+    queue_timeout: float = 30,
+    index_path: Optional[str] = None,
+    top_k: int = 5,
+    retrieval: str = "bm25",
+    ann_probes: int = 8,
+    embedding_url: Optional[str] = None,
+    hybrid_candidates: int = 20,
+    rrf_k: int = 60,
+    rerank_model: Optional[str] = None,
+    rerank_top_n: int = 20,
+    retrieval_budget: Optional[float] = None,
+    fallback_routes: Optional[List[Dict]] = None,
+    route_timeout: float = 30,
+    hedging: bool = False,
+    cache: Optional[ResponseCache] = None,
+    feedback: Optional[FeedbackStore] = None,
+    limiter: Optional[RateLimiter] = None,
+    http_pool: Optional[ConnectionPool] = None,
+    api_keys: Optional[List[str]] = None,
+    context_limit: int = 128_000,
+    completion_tokens: int = 1024,
+    history_tokens: int = 4096,
+    template_reload_interval: float = 1.0,
+) -> ChatEngine:
     """
-    Create a Gradio interface with the chatbot components
+    Create the chatbot inference engine (shared by the Gradio interface and the API)
 
     Args:
     ----
         model_name (str): OpenAI model name
-        prompt_template (str): Prompt template filename
-        extra_css (str): Extra CSS filename
-        extra_html (str): Extra HTML filename
+        prompt_template (str): Default prompt template filename (the others are selectable per request)
+        streaming (bool): Stream the response tokens
+        max_concurrency (int): Maximum number of concurrent LLM calls per model
+        model_concurrency (Optional[Dict[str, int]]): Maximum number of concurrent chat turns of specific default models (fallback routes included)
+        max_queue_size (int): Maximum number of chat turns waiting for the LLM (busy beyond)
+        queue_timeout (float): Maximum waiting time of a chat turn (seconds, busy beyond)
+        index_path (Optional[str]): Directory of the documents index (no retrieval if None)
+        top_k (int): Number of documents given to the prompt
+        retrieval (str): Retrieval of the documents ('bm25' keywords, 'vector' embeddings of the query or 'hybrid' both)
+        ann_probes (int): Number of IVF lists scored per query ('vector' and 'hybrid' retrievals with an IVF index)
+        embedding_url (Optional[str]): URL of the embedding API of the queries ('vector' and 'hybrid' retrievals)
+        hybrid_candidates (int): Number of documents of each search fused by the 'hybrid' retrieval
+        rrf_k (int): Rank smoothing constant of the reciprocal rank fusion ('hybrid' retrieval)
+        rerank_model (Optional[str]): Cross-encoder reranking the fused documents ('hybrid' retrieval, no reranking if None)
+        rerank_top_n (int): Number of fused documents reranked
+        retrieval_budget (Optional[float]): Latency budget of the 'hybrid' retrieval, reranking skipped beyond (seconds, no limit if None)
+        fallback_routes (Optional[List[Dict]]): Other models used on failure or slowness of the default one
+        route_timeout (float): Time to the first token before failing over (seconds)
+        hedging (bool): Send a second call when the first one is slower than usual
+        cache (Optional[ResponseCache]): Response cache in front of the LLM
+        feedback (Optional[FeedbackStore]): Store of the chat turns and votes
+        limiter (Optional[RateLimiter]): Daily token quotas of the clients
+        http_pool (Optional[ConnectionPool]): HTTP connections of the worker shared by the generators (own clients if None)
+        api_keys (Optional[List[str]]): Hashes of the accepted API keys identifying the clients (addresses only if None)
+        context_limit (int): Context window of the model (tokens)
+        completion_tokens (int): Tokens of the context window reserved for the response
+        history_tokens (int): Maximum number of tokens of the conversation history
+        template_reload_interval (float): Minimum time between two checks of the template files (seconds, 0 to never reload)
+
+    Returns:
+    -------
+        ChatEngine: Chatbot inference engine
+
+    """
+    # Compile the prompt templates once (the default template must exist)
+    templates = TemplateRegistry(reload_interval=template_reload_interval)
+    template = templates.get(prompt_template)
+
+    # Get the chatbot pipeline
+    chat_pipeline = get_llm_pipeline(
+        model_name,
+        template.text,
+        index_path=index_path,
+        top_k=top_k,
+        retrieval=retrieval,
+        ann_probes=ann_probes,
+        embedding_url=embedding_url,
+        hybrid_candidates=hybrid_candidates,
+        rrf_k=rrf_k,
+        rerank_model=rerank_model,
+        rerank_top_n=rerank_top_n,
+        retrieval_budget=retrieval_budget,
+        fallback_routes=fallback_routes,
+        route_timeout=route_timeout,
+        hedging=hedging,
+        http_pool=http_pool,
+    )
+
+    # Get the scheduler of the LLM calls
+    scheduler = Scheduler(
+        max_concurrency=max_concurrency,
+        model_concurrency=model_concurrency,
+        max_queue_size=max_queue_size,
+        queue_timeout=queue_timeout,
+    )
+
+    return ChatEngine(
+        chat_pipeline,
+        streaming=streaming,
+        scheduler=scheduler,
+        template_name=prompt_template,
+        templates=templates,
+        cache=cache,
+        feedback=feedback,
+        limiter=limiter,
+        http_pool=http_pool,
+        api_keys=api_keys or (),
+        context_limit=context_limit,
+        completion_tokens=completion_tokens,
+        history_tokens=history_tokens,
+    )
+
+
+def get_gradio_app(engine: ChatEngine, sessions: Optional[SessionStore] = None) -> gr.Blocks:
+    """
+    Create a Gradio interface with the chatbot components
+
+    Notes:
+    -----
+        The conversations are kept by the session store: the chat event takes the messages
+        from it and stores the user message first (the chatbot history gives the position of
+        the turn, and restores a conversation missing from the store), undo, retry and clear
+        send its history back to the chatbot. Only the vote, undo and clear events don't upload
+        the chatbot history: the chat event of `gr.ChatInterface` still uploads it, and undo,
+        clear and retry return the whole conversation, their cost grows with its length.
+
+    Args:
+    ----
+        engine (ChatEngine): Chatbot inference engine
+        sessions (Optional[SessionStore]): Conversations of the sessions (in-process store if None)
 
     Returns:
     -------
         gr.Blocks: Gradio blocks instance
 
     """
+    sessions = SessionStore() if sessions is None else sessions
+
     # Load the CSS and HTML files
     css = load_css("extra")
     placeholder = load_html("placeholder")
 
-    # Get the chatbot pipeline
-    prompt_template = load_template(prompt_template)
-    chat_pipeline = get_llm_pipeline(model_name, prompt_template)
+    # Gradio injects the request and the event data from the type hints of the
+    # handlers (not of a functools.partial), the handlers are bound by closures
+    callback_echo = partial(echo, engine=engine, sessions=sessions)
+
+    async def _echo(message: str, history: List[Message], template: Optional[str], request: gr.Request) -> AsyncIterator[str]:
+        async for response in callback_echo(message, history, template, request):
+            yield response
 
-    # Create the chatbot echo function with the chat pipeline
-    _echo = partial(echo, chat_pipeline=chat_pipeline)
-    _retry = partial(retry, callback_echo=_echo)
+    async def _retry(template: Optional[str], request: gr.Request) -> AsyncIterator[gr.update]:
+        async for update in retry(template, request, callback_echo=callback_echo, sessions=sessions):
+            yield update
+
+    def _undo(request: gr.Request) -> List[Message]:
+        return undo(request, sessions)
+
+    def _clear(request: gr.Request) -> List[Message]:
+        return clear(request, sessions)
+
+    def _vote(data: gr.LikeData, template: Optional[str], request: gr.Request) -> None:
+        vote(data, template, request, engine, sessions)
 
     with gr.Blocks(css=css) as blocks:
         chatbot = gr.Chatbot(
@@ -224,22 +663,39 @@ def get_gradio_app(
             height=575,
         )
 
+        # Prompt template of the session (the choices are updated when the page is loaded)
+        dropdown_template = gr.Dropdown(
+            choices=engine.template_names,
+            value=engine.template_name,
+            label="Prompt template",
+            interactive=True,
+        )
+
         with gr.Row():
             with gr.Column(scale=10):
-                gr.ChatInterface(fn=_echo, type="messages", chatbot=chatbot)
+                # The scheduler of the engine limits the concurrency (and rejects when busy)
+                gr.ChatInterface(
+                    fn=_echo,
+                    type="messages",
+                    chatbot=chatbot,
+                    additional_inputs=[dropdown_template],
+                    concurrency_limit=None,
+                )
 
             with gr.Column(min_width=0):
                 button_undo = gr.Button(value="↩️ Undo")
-                button_undo.click(undo, inputs=[chatbot], outputs=[chatbot], show_api=False)
+                button_undo.click(_undo, outputs=[chatbot], show_api=False)
 
             with gr.Column(min_width=0):
                 button_retry = gr.Button(value="🔄 Retry")
-                button_retry.click(_retry, inputs=[chatbot], outputs=[chatbot], show_api=False)
+                button_retry.click(_retry, inputs=[dropdown_template], outputs=[chatbot], show_api=False, concurrency_limit=None)
 
             with gr.Column(min_width=0):
                 button_clear = gr.Button(value="❌ Clear")
-                button_clear.click(clear, inputs=[chatbot], outputs=[chatbot], show_api=False)
+                button_clear.click(_clear, outputs=[chatbot], show_api=False)
+
+        chatbot.like(_vote, inputs=[dropdown_template], show_api=False)
 
-        chatbot.like(vote, inputs=[chatbot], show_api=False)
+        blocks.load(lambda: gr.update(choices=engine.template_names), outputs=[dropdown_template], show_api=False)
 
     return blocks
@@ -0,0 +1,232 @@
+import os
+from pathlib import Path
+from typing import Iterable, Union
+
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, multiprocess, start_http_server
+
+from needle.config import MULTIPROC_ENV
+
+# Metrics are registered in the default Prometheus registry, they are
+# exposed on '/metrics' next to the HTTP metrics of the instrumentator.
+# With several workers, each process writes its values in the multiprocess
+# directory and the registry returned by `get_registry` aggregates them.
+# The directory is read by prometheus_client at import, it is set before
+# the first import of this module (see `needle.cli.setup_multiprocess`).
+
+CACHE_HITS = Counter(
+    "needle_cache_hits_total",
+    "Number of responses served by the response cache.",
+    ["layer"],
+)
+
+CACHE_MISSES = Counter(
+    "needle_cache_misses_total",
+    "Number of responses not found in the response cache.",
+)
+
+CACHE_EVICTIONS = Counter(
+    "needle_cache_evictions_total",
+    "Number of responses removed from the response cache.",
+    ["reason"],
+)
+
+SCHEDULER_QUEUE_DEPTH = Gauge(
+    "needle_scheduler_queue_depth",
+    "Number of chat turns waiting for a free slot of the model.",
+    ["model"],
+    multiprocess_mode="livesum",
+)
+
+SCHEDULER_QUEUE_WAIT = Histogram(
+    "needle_scheduler_queue_wait_seconds",
+    "Time spent by the chat turns waiting for a free slot of the model.",
+    ["model"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+
+SCHEDULER_REJECTED = Counter(
+    "needle_scheduler_rejected_total",
+    "Number of chat turns rejected because the scheduler is busy.",
+    ["model"],
+)
+
+SCHEDULER_COALESCED = Counter(
+    "needle_scheduler_coalesced_total",
+    "Number of chat turns sharing the generation of an identical prompt in flight.",
+    ["model"],
+)
+
+LOG_DROPPED = Counter(
+    "needle_log_dropped_total",
+    "Number of log messages dropped because the log writer queue is full.",
+)
+
+STARTUP_SECONDS = Gauge(
+    "needle_startup_seconds",
+    "Duration of each startup phase of the application process.",
+    ["phase"],
+    multiprocess_mode="liveall",
+)
+
+LLM_ROUTED = Counter(
+    "needle_llm_routed_total",
+    "Number of LLM calls sent to each model (best route, failover or hedged call).",
+    ["model", "reason"],
+)
+
+LLM_LATENCY = Histogram(
+    "needle_llm_latency_seconds",
+    "Time to the first token (streaming) or to the response of the LLM calls.",
+    ["model"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 0.75, 1, 1.5, 2, 3, 5, 10, 30),
+)
+
+LLM_ERRORS = Counter(
+    "needle_llm_errors_total",
+    "Number of failed LLM calls.",
+    ["model", "error"],
+)
+
+PIPELINE_COMPONENT_SECONDS = Histogram(
+    "needle_pipeline_component_seconds",
+    "Duration of each run of the chat pipeline components (retriever, prompt_builder, llm, ...).",
+    ["component"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+
+RETRIEVAL_STAGE_SECONDS = Histogram(
+    "needle_retrieval_stage_seconds",
+    "Duration of each stage of the hybrid retrieval (bm25, vector, fusion, rerank).",
+    ["stage"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+
+RERANK_SKIPPED = Counter(
+    "needle_rerank_skipped_total",
+    "Number of rerankings skipped (budget: not started, deadline: stopped before the last batch).",
+    ["reason"],
+)
+
+CHAT_TTFT = Histogram(
+    "needle_chat_ttft_seconds",
+    "Time from the start of a chat turn to its first token (retrieval, queue and LLM, cache hits excluded).",
+    ["model"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 0.75, 1, 1.5, 2, 3, 5, 10, 30),
+)
+
+LLM_TOKENS = Counter(
+    "needle_llm_tokens_total",
+    "Number of tokens sent to (prompt) and generated by (completion) each model.",
+    ["model", "kind"],
+)
+
+GRADIO_EVENTS = Counter(
+    "needle_gradio_events_total",
+    "Number of Gradio events handled (chat, retry and vote) by outcome.",
+    ["event", "model", "outcome"],
+)
+
+GRADIO_QUEUE_WAIT = Histogram(
+    "needle_gradio_queue_wait_seconds",
+    "Time spent by the Gradio events in the Gradio queue before their handler starts.",
+    ["event", "model"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+
+FEEDBACK_DROPPED = Counter(
+    "needle_feedback_dropped_total",
+    "Number of feedback records (chat turns, votes) dropped because the writer queue is full.",
+    ["table"],
+)
+
+SESSION_EVICTIONS = Counter(
+    "needle_session_evictions_total",
+    "Number of conversations removed from the session store (expired or least recently used).",
+    ["reason"],
+)
+
+RATE_LIMITED = Counter(
+    "needle_rate_limited_total",
+    "Number of requests rejected by the rate limiter (request rate or daily token quota).",
+    ["reason"],
+)
+
+
+HTTP_POOL_IN_FLIGHT = Gauge(
+    "needle_http_pool_in_flight",
+    "Number of HTTP requests to the LLM APIs in flight (connections of the pool in use).",
+    multiprocess_mode="livesum",
+)
+
+HTTP_POOL_LIMIT = Gauge(
+    "needle_http_pool_limit",
+    "Maximum number of connections of the HTTP pools (saturation is in flight / limit).",
+    multiprocess_mode="livesum",
+)
+
+HTTP_CONNECT_SECONDS = Histogram(
+    "needle_http_connect_seconds",
+    "Time to open a connection to an LLM API (TCP and TLS), keep-alive connections excluded.",
+    ["host"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+
+
+def remove_dead_processes(path: Union[str, os.PathLike]):
+    """
+    Remove the live gauges of the dead workers (their counters and histograms are kept in the totals).
+
+    Args:
+        path (Union[str, os.PathLike]): Directory of the metrics files
+
+    """
+    pids = {int(file.stem.rsplit("_", 1)[1]) for file in Path(path).glob("*.db")}
+
+    for pid in pids:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            multiprocess.mark_process_dead(pid, path)
+        except PermissionError:
+            continue
+
+
+class LiveMultiProcessCollector(multiprocess.MultiProcessCollector):
+    """Collector aggregating the metrics files of the workers (dead workers cleaned up first)."""
+
+    def __init__(self, registry: CollectorRegistry, path: Union[str, os.PathLike]):
+        self.path = path
+        super().__init__(registry, path=path)
+
+    def collect(self) -> Iterable:
+        """Collect the metrics of every worker."""
+        remove_dead_processes(self.path)
+        return super().collect()
+
+
+def get_registry() -> CollectorRegistry:
+    """Registry of the metrics of every worker (multiprocess mode), of this process else."""
+    path = os.environ.get(MULTIPROC_ENV)
+
+    if path is None:
+        return REGISTRY
+
+    registry = CollectorRegistry()
+    LiveMultiProcessCollector(registry, path=path)
+    return registry
+
+
+def serve_metrics(port: int, host: str = "localhost"):
+    """
+    Serve the metrics on their own port (background thread of this process).
+
+    Notes:
+        Started by the parent process of the workers, the scrapes don't compete with
+        the chat requests and always see the metrics of every worker.
+
+    Args:
+        port (int): Port of the metrics server
+        host (str): Address of the metrics server
+
+    """
+    start_http_server(port, addr=host, registry=get_registry())
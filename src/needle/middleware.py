@@ -1,32 +1,139 @@
-from typing import Callable
+import asyncio
+import math
+import random
+import time
+from typing import Collection, Dict, Iterable, Optional
 
-from fastapi import Request
+from fastapi import HTTPException
 from loguru import logger
-from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.datastructures import Headers
+from starlette.requests import Request
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
+from needle.exception import http_exception_handler
+from needle.metrics import RATE_LIMITED
+from needle.ratelimit import RateLimiter, TooManyRequestsError, get_client_id
 
-class LoggingMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next: Callable):
-        """
-        Middleware to automatically log all requests and responses.
 
-        Args:
-            request (Request): The request object.
-            call_next (Callable): The next middleware in the chain.
+class LoggingMiddleware:
+    """
+    Pure ASGI middleware logging the HTTP requests with their status and duration.
 
-        Returns:
-            Response: The response object.
+    Notes:
+        Unlike `BaseHTTPMiddleware`, the request and response aren't wrapped: the messages
+        go through untouched (streaming responses included). Websockets and lifespan events
+        are never logged, excluded or unsampled requests are passed through without any cost.
 
-        """
-        address_ip = request.client.host
-        port = request.client.port
+    Args:
+        app (ASGIApp): Application to wrap
+        exclude_paths (Iterable[str]): Path prefixes never logged
+        sample_rates (Optional[Dict[str, float]]): Fraction of the requests logged per path prefix
+            (the longest matching prefix wins, 1.0 for the other paths)
 
-        # if ping to metrics, ignore logging
-        if request.url.path == "/metrics":
-            return await call_next(request)
+    """
 
-        # Log the request
-        logger.info(f"{address_ip}:{port} - {request.method} - {request.url}")
+    def __init__(
+        self,
+        app: ASGIApp,
+        exclude_paths: Iterable[str] = ("/metrics",),
+        sample_rates: Optional[Dict[str, float]] = None,
+    ):
+        self.app = app
+        self.exclude_paths = tuple(exclude_paths)
 
-        # Call the next middleware
-        return await call_next(request)
+        # Longest prefixes first, the first match is the most specific
+        self.sample_rates = sorted((sample_rates or {}).items(), key=lambda item: len(item[0]), reverse=True)
+
+    def is_logged(self, path: str) -> bool:
+        """Check if the request on this path should be logged (filters and sampling)."""
+        if path.startswith(self.exclude_paths):
+            return False
+
+        for prefix, rate in self.sample_rates:
+            if path.startswith(prefix):
+                return rate >= 1 or random.random() < rate  # noqa: S311
+
+        return True
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        """Log the request once its response is sent (status code and duration)."""
+        if scope["type"] != "http" or not self.is_logged(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message: Message):
+            nonlocal status_code
+
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            client = scope.get("client") or ("-", 0)
+            query = scope.get("query_string", b"")
+            path = f"{scope['path']}?{query.decode('latin-1')}" if query else scope["path"]
+            duration = (time.perf_counter() - start) * 1000
+
+            # Arguments are only formatted if the message is emitted
+            logger.info("{}:{} - {} - {} - {} - {:.1f} ms", client[0], client[1], scope["method"], path, status_code, duration)
+
+
+class RateLimitMiddleware:
+    """
+    Pure ASGI middleware rejecting the clients over their request rate or daily token quota.
+
+    Notes:
+        Only the POST requests on the limited paths take a token (chat turns of the API,
+        events pushed to the Gradio queue), the assets, heartbeats and event streams go through.
+        A rejected request gets a 429 response (with 'Retry-After') from `http_exception_handler`
+        before reaching the route, the Gradio queue never sees it. The tokens taken are set in
+        the request state ('rate_limit_tokens'), a batch route takes the tokens of its other turns.
+
+    Args:
+        app (ASGIApp): Application to wrap
+        limiter (RateLimiter): Buckets and quotas of the clients (shared by the workers)
+        paths (Iterable[str]): Path prefixes of the limited requests
+        api_keys (Collection[str]): Hashes of the accepted API keys (clients identified by their address else)
+
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        limiter: RateLimiter,
+        paths: Iterable[str] = ("/v1/chat", "/app/gradio_api/queue/join", "/app/gradio_api/call", "/app/gradio_api/run"),
+        api_keys: Collection[str] = (),
+    ):
+        self.app = app
+        self.limiter = limiter
+        self.paths = tuple(paths)
+        self.api_keys = frozenset(api_keys)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        """Take a token of the client before passing the request (429 response if none is left)."""
+        if scope["type"] != "http" or scope["method"] != "POST" or not scope["path"].startswith(self.paths):
+            await self.app(scope, receive, send)
+            return
+
+        client = scope.get("client") or (None, 0)
+        client_id = get_client_id(Headers(scope=scope), client[0], api_keys=self.api_keys)
+
+        try:
+            # SQLite transaction, keep it out of the event loop
+            await asyncio.to_thread(self.limiter.acquire, client_id)
+        except TooManyRequestsError as exception:
+            RATE_LIMITED.labels(reason=exception.reason).inc()
+
+            headers = {"Retry-After": str(math.ceil(exception.retry_after))}
+            response = await http_exception_handler(Request(scope), HTTPException(status_code=429, detail=str(exception), headers=headers))
+            await response(scope, receive, send)
+            return
+
+        scope.setdefault("state", {})["rate_limit_tokens"] = 1
+        await self.app(scope, receive, send)
@@ -0,0 +1,206 @@
+import hashlib
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, FrozenSet, List, Optional, Union
+
+from haystack.components.builders import PromptBuilder
+from jinja2 import meta
+from loguru import logger
+
+from needle import TEMPLATE_PATH
+
+# Variables given by the chat engine to the templates
+TEMPLATE_VARIABLES = frozenset({"question", "documents", "history"})
+
+# Variables a template must use (the question of the user)
+REQUIRED_VARIABLES = frozenset({"question"})
+
+TEMPLATE_SUFFIX = ".jinja2"
+
+
+class TemplateNotFoundError(KeyError):
+    """Raised when a prompt template isn't in the registry."""
+
+
+@dataclass(frozen=True)
+class PromptTemplate:
+    """
+    Prompt template compiled once (a new instance is created when its file changes).
+
+    Args:
+        name (str): Name of the template (filename without extension)
+        text (str): Source of the template
+        builder (PromptBuilder): Component rendering the compiled template
+        variables (FrozenSet[str]): Variables used by the template
+        mtime (float): Modification time of the file when it was compiled
+        key (str): Name and content hash of the template (part of the cache keys)
+
+    """
+
+    name: str
+    text: str
+    builder: PromptBuilder
+    variables: FrozenSet[str]
+    mtime: float
+    key: str
+
+    @classmethod
+    def compile(cls, path: Path) -> "PromptTemplate":
+        """
+        Compile and validate a template file.
+
+        Args:
+            path (Path): Path to the template file
+
+        Raises:
+            ValueError: If the template can't be compiled or uses unknown variables.
+
+        Returns:
+            PromptTemplate: Compiled template
+
+        """
+        mtime = path.stat().st_mtime
+        text = path.read_text()
+
+        try:
+            builder = PromptBuilder(template=text)
+        except Exception as exception:
+            raise ValueError(f"Template '{path.name}' can't be compiled: {exception}") from exception
+
+        # Variables of the template, parsed by the environment of the builder (same extensions)
+        variables = frozenset(meta.find_undeclared_variables(builder.template.environment.parse(text)))
+
+        if unknown := variables - TEMPLATE_VARIABLES:
+            raise ValueError(f"Template '{path.name}' uses unknown variables {sorted(unknown)} (available: {sorted(TEMPLATE_VARIABLES)})")
+
+        if missing := REQUIRED_VARIABLES - variables:
+            raise ValueError(f"Template '{path.name}' doesn't use the variables {sorted(missing)}")
+
+        name = path.name.removesuffix(TEMPLATE_SUFFIX)
+        digest = hashlib.sha256(text.encode()).hexdigest()[:16]
+
+        return cls(name=name, text=text, builder=builder, variables=variables, mtime=mtime, key=f"{name}:{digest}")
+
+
+class TemplateRegistry:
+    """
+    Prompt templates of a folder, compiled once and reloaded when their file changes.
+
+    Notes:
+        - Every template of the folder is compiled and validated when the registry is created,
+          an invalid template fails the startup.
+        - The folder is scanned again at most once per `reload_interval` (when a template is
+          requested): changed files are compiled again, new files are added and removed files
+          are dropped. A changed template that is invalid is logged and its previous version kept.
+        - Between two scans, getting a template is a dictionary lookup.
+
+    Args:
+        path (Union[str, Path]): Folder of the templates ('*.jinja2' files)
+        reload_interval (float): Minimum time between two scans of the folder (seconds, 0 to never reload)
+
+    """
+
+    def __init__(self, path: Union[str, Path] = TEMPLATE_PATH, reload_interval: float = 1.0):
+        self.path = Path(path)
+        self.reload_interval = reload_interval
+
+        self.templates: Dict[str, PromptTemplate] = {}
+        self.invalid: Dict[str, float] = {}
+        self.lock = threading.Lock()
+        self.checked_at = time.monotonic()
+
+        if not self.path.is_dir():
+            raise FileNotFoundError(f"Templates folder not found at: '{self.path}'")
+
+        for file in sorted(self.path.glob(f"*{TEMPLATE_SUFFIX}")):
+            template = PromptTemplate.compile(file)
+            self.templates[template.name] = template
+
+        logger.info(f"Prompt templates loaded: {self.names}")
+
+    @property
+    def names(self) -> List[str]:
+        """Names of the available templates."""
+        return sorted(self.templates)
+
+    def __contains__(self, name: str) -> bool:
+        """Check if a template exists (reloaded first if the folder changed)."""
+        self.refresh()
+        return name in self.templates
+
+    def get(self, name: str) -> PromptTemplate:
+        """
+        Get a compiled template (reloaded first if its file changed).
+
+        Args:
+            name (str): Name of the template (filename without extension)
+
+        Raises:
+            TemplateNotFoundError: If the template doesn't exist.
+
+        Returns:
+            PromptTemplate: Compiled template
+
+        """
+        self.refresh()
+
+        try:
+            return self.templates[name]
+        except KeyError:
+            raise TemplateNotFoundError(f"Prompt template '{name}' not found (available: {self.names})") from None
+
+    def refresh(self, force: bool = False):
+        """
+        Scan the folder for changed, new and removed templates.
+
+        Args:
+            force (bool): Scan even if the last scan is recent
+
+        """
+        if not force and (self.reload_interval <= 0 or time.monotonic() - self.checked_at < self.reload_interval):
+            return
+
+        # A single thread scans, the others keep the current templates
+        if not self.lock.acquire(blocking=force):
+            return
+
+        try:
+            self.checked_at = time.monotonic()
+            self.scan()
+        finally:
+            self.lock.release()
+
+    def scan(self):
+        """Compile the changed and new template files, drop the removed ones."""
+        templates = dict(self.templates)
+        files = {file.name.removesuffix(TEMPLATE_SUFFIX): file for file in self.path.glob(f"*{TEMPLATE_SUFFIX}")}
+
+        for name in templates.keys() - files.keys():
+            logger.warning(f"Prompt template '{name}' removed")
+            del templates[name]
+
+        for name, file in files.items():
+            current: Optional[PromptTemplate] = templates.get(name)
+            mtime = None
+
+            try:
+                mtime = file.stat().st_mtime
+
+                # Unchanged file, or invalid file already reported
+                if (current is not None and mtime == current.mtime) or self.invalid.get(name) == mtime:
+                    continue
+
+                templates[name] = PromptTemplate.compile(file)
+            except (OSError, ValueError) as exception:
+                kept = ", the previous version is kept" if current is not None else ""
+                logger.error(f"Prompt template '{name}' is invalid{kept}: {exception}")
+                self.invalid[name] = mtime
+                continue
+
+            self.invalid.pop(name, None)
+            logger.info(f"Prompt template '{name}' {'reloaded' if current else 'added'}")
+
+        # Swapped at once, the readers never see a partial update
+        self.templates = templates
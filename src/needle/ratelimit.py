@@ -0,0 +1,207 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Collection, Mapping, Optional, Union
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    client TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS buckets_updated ON buckets (updated);
+
+CREATE TABLE IF NOT EXISTS quotas (
+    client TEXT NOT NULL,
+    day TEXT NOT NULL,
+    used INTEGER NOT NULL,
+    PRIMARY KEY (client, day)
+);
+CREATE INDEX IF NOT EXISTS quotas_day ON quotas (day);
+"""
+
+
+class TooManyRequestsError(Exception):
+    """
+    The client sent too many requests, or used its daily token quota.
+
+    Args:
+        reason (str): Exceeded limit ('rate' or 'quota')
+        retry_after (float): Time before the client can send a request again (seconds)
+
+    """
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"Too many requests ({reason} limit), retry in {retry_after:.0f} seconds")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def hash_api_key(api_key: str) -> str:
+    """SHA-256 hash of an API key (hex), the form of the keys in the settings ('api_keys')."""
+    return hashlib.sha256(api_key.encode()).hexdigest()
+
+
+def get_client_id(headers: Mapping[str, str], host: Optional[str] = None, api_keys: Collection[str] = ()) -> str:
+    """
+    Identify the client of a request: its API key if it's an accepted one, its address else.
+
+    Notes:
+        The API key ('Authorization: Bearer' or 'X-API-Key' header) is only trusted if its hash
+        is one of the accepted keys: a client sending a new random key on each request would get
+        a new bucket and quota each time. The keys are never written in the limiter database,
+        the logs or the metrics (hashes only).
+
+    Args:
+        headers (Mapping[str, str]): Headers of the request (lowercase names)
+        host (Optional[str]): Address of the client
+        api_keys (Collection[str]): Hashes of the accepted API keys (see `hash_api_key`)
+
+    Returns:
+        str: Identifier of the client (rate limit, quota and fair scheduling)
+
+    """
+    authorization = headers.get("authorization", "")
+    api_key = authorization[7:].strip() if authorization[:7].lower() == "bearer " else headers.get("x-api-key", "").strip()
+
+    if api_key and api_keys:
+        digest = hash_api_key(api_key)
+
+        if digest in api_keys:
+            return f"key:{digest[:16]}"
+
+    return host or "anonymous"
+
+
+def get_day(now: float) -> str:
+    """Day of a timestamp (UTC), the quotas are reset at midnight."""
+    return time.strftime("%Y-%m-%d", time.gmtime(now))
+
+
+def get_day_end(now: float) -> float:
+    """Timestamp of the next midnight (UTC)."""
+    return (now // 86_400 + 1) * 86_400
+
+
+class RateLimiter:
+    """
+    Token bucket and daily token quota of each client, stored in SQLite (shared between the uvicorn workers).
+
+    Notes:
+        - Each request takes a token from the bucket of its client (a batch one per chat turn),
+          the bucket is refilled at `rate` tokens per second up to `burst` tokens. A bucket with
+          less tokens left rejects the request.
+        - The LLM tokens of each chat turn (prompt and completion) are added to the daily usage
+          of the client, a client over its quota is rejected until midnight (UTC).
+        - The bucket is checked and updated in a single write transaction, the workers never
+          grant the same token twice.
+
+    Args:
+        path (Union[str, os.PathLike]): Path of the SQLite database
+        rate (Optional[float]): Requests per second of a client (no rate limit if None)
+        burst (int): Requests a client can send at once (size of the bucket)
+        daily_quota (Optional[int]): LLM tokens a client can use per day (no quota if None)
+
+    """
+
+    def __init__(
+        self,
+        path: Union[str, os.PathLike],
+        rate: Optional[float] = 1.0,
+        burst: int = 10,
+        daily_quota: Optional[int] = None,
+    ):
+        self.path = Path(path)
+        self.rate = rate
+        self.burst = burst
+        self.daily_quota = daily_quota
+
+        self._local = threading.local()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection.executescript(SCHEMA)
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """SQLite connection of the current thread (a forked worker opens its own)."""
+        connection = getattr(self._local, "connection", None)
+
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+
+        return connection
+
+    def acquire(self, client: str, tokens: int = 1):
+        """
+        Take tokens from the bucket of a client (checks its daily quota first).
+
+        Args:
+            client (str): Identifier of the client (see `get_client_id`)
+            tokens (int): Number of tokens taken (one per chat turn of the request)
+
+        Raises:
+            TooManyRequestsError: If the bucket has less tokens left or the quota is used.
+
+        """
+        now = time.time()
+
+        with self.connection as connection:
+            connection.execute("BEGIN IMMEDIATE")
+
+            if self.daily_quota is not None:
+                row = connection.execute("SELECT used FROM quotas WHERE client = ? AND day = ?", (client, get_day(now))).fetchone()
+
+                if row is not None and row[0] >= self.daily_quota:
+                    raise TooManyRequestsError("quota", get_day_end(now) - now)
+
+            if self.rate is None:
+                return
+
+            row = connection.execute("SELECT tokens, updated FROM buckets WHERE client = ?", (client,)).fetchone()
+            available = self.burst if row is None else min(self.burst, row[0] + (now - row[1]) * self.rate)
+
+            if available < tokens:
+                raise TooManyRequestsError("rate", (tokens - available) / self.rate)
+
+            connection.execute(
+                "INSERT INTO buckets (client, tokens, updated) VALUES (?, ?, ?) "
+                "ON CONFLICT (client) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated",
+                (client, available - tokens, now),
+            )
+
+            # A bucket refilled since is the same as no bucket
+            connection.execute("DELETE FROM buckets WHERE updated < ?", (now - self.burst / self.rate,))
+
+    def charge(self, client: str, tokens: int):
+        """
+        Add the LLM tokens of a chat turn to the daily usage of a client.
+
+        Args:
+            client (str): Identifier of the client (see `get_client_id`)
+            tokens (int): Prompt and completion tokens of the turn
+
+        """
+        if self.daily_quota is None or tokens <= 0:
+            return
+
+        day = get_day(time.time())
+
+        with self.connection as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute(
+                "INSERT INTO quotas (client, day, used) VALUES (?, ?, ?) ON CONFLICT (client, day) DO UPDATE SET used = used + excluded.used",
+                (client, day, tokens),
+            )
+            connection.execute("DELETE FROM quotas WHERE day < ?", (day,))
+
+    def get_usage(self, client: str) -> int:
+        """Tokens used today by a client."""
+        row = self.connection.execute("SELECT used FROM quotas WHERE client = ? AND day = ?", (client, get_day(time.time()))).fetchone()
+        return 0 if row is None else row[0]
@@ -0,0 +1,121 @@
+import math
+import threading
+import time
+from collections import deque
+from typing import Deque, List, Optional
+
+from haystack import Document
+from loguru import logger
+
+from needle.metrics import RERANK_SKIPPED, RETRIEVAL_STAGE_SECONDS
+
+
+class CrossEncoderReranker:
+    """
+    Rerank the retrieved documents with a local cross-encoder model (optional dependency).
+
+    Notes:
+        A cross-encoder scores each (query, document) pair, it's much slower than the retrieval:
+        only the `top_n` first documents are reranked. With a latency budget, the reranking is
+        skipped when its expected duration (recent time per document, 90th percentile) doesn't
+        fit in the time left, and stops between two batches once the budget is spent (the scored
+        documents are reranked, the others keep their order after them).
+
+    Args:
+        model (str): Name or path of the sentence-transformers cross-encoder
+        top_n (int): Number of documents reranked (the first ones of the retrieval)
+        batch_size (int): Number of pairs scored at once
+        window (int): Number of durations kept for the estimate
+
+    """
+
+    def __init__(
+        self,
+        model: str = "cross-encoder/ms-marco-MiniLM-L-6-v2",
+        top_n: int = 20,
+        batch_size: int = 8,
+        window: int = 100,
+    ):
+        try:
+            from sentence_transformers import CrossEncoder
+        except ImportError:
+            raise ImportError("The reranker needs sentence-transformers: `pip install sentence-transformers`") from None
+
+        self.model = model
+        self.top_n = top_n
+        self.batch_size = batch_size
+
+        self.encoder = CrossEncoder(model)
+        self.durations: Deque[float] = deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def warm_up(self):
+        """Score a first batch (lazy initialisations of the model), then measure a second one for the estimate."""
+        documents = [Document(content="warm up")] * self.batch_size
+
+        self.encoder.predict([("warm up", document.content) for document in documents], batch_size=len(documents))
+        self.score("warm up", documents)
+
+    def estimate(self, count: int) -> float:
+        """Expected duration of the reranking of `count` documents (0 without measure)."""
+        with self.lock:
+            if not self.durations:
+                return 0.0
+
+            durations = sorted(self.durations)
+
+        return count * durations[min(len(durations) - 1, math.ceil(0.9 * len(durations)) - 1)]
+
+    def score(self, query: str, documents: List[Document]) -> List[float]:
+        """Score the pairs of a batch (its duration per document is recorded)."""
+        start = time.perf_counter()
+        scores = self.encoder.predict([(query, document.content or "") for document in documents], batch_size=len(documents))
+
+        with self.lock:
+            self.durations.append((time.perf_counter() - start) / max(len(documents), 1))
+
+        return [float(score) for score in scores]
+
+    def rerank(self, query: str, documents: List[Document], budget: Optional[float] = None) -> List[Document]:
+        """
+        Rerank the first documents by their cross-encoder score.
+
+        Args:
+            query (str): Text of the query
+            documents (List[Document]): Retrieved documents (best first)
+            budget (Optional[float]): Time left for the reranking (seconds, no limit if None)
+
+        Returns:
+            List[Document]: Documents by decreasing cross-encoder score, then the documents not reranked
+
+        """
+        candidates = documents[: self.top_n]
+
+        if not candidates:
+            return documents
+
+        if budget is not None and self.estimate(len(candidates)) > budget:
+            RERANK_SKIPPED.labels(reason="budget").inc()
+            logger.debug(f"Reranking skipped, {budget * 1000:.1f} ms left for {len(candidates)} documents")
+            return documents
+
+        started = time.perf_counter()
+        deadline = None if budget is None else started + budget
+        scored = []
+
+        for start in range(0, len(candidates), self.batch_size):
+            if deadline is not None and start and time.perf_counter() > deadline:
+                RERANK_SKIPPED.labels(reason="deadline").inc()
+                break
+
+            batch = candidates[start : start + self.batch_size]
+            scored.extend(zip(self.score(query, batch), batch))
+
+        RETRIEVAL_STAGE_SECONDS.labels(stage="rerank").observe(time.perf_counter() - started)
+
+        scored.sort(key=lambda item: item[0], reverse=True)
+
+        for score, document in scored:
+            document.score = score
+
+        return [document for _, document in scored] + documents[len(scored) :]
@@ -0,0 +1,617 @@
+import json
+import os
+import shutil
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property, lru_cache
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+import httpx
+import numpy as np
+from haystack import Document, component
+from haystack.components.preprocessors import DocumentSplitter
+from loguru import logger
+
+from needle.embeddings import EmbeddingIndex, LocalEmbedder, OpenAIEmbedder, get_embedder
+from needle.metrics import RETRIEVAL_STAGE_SECONDS
+from needle.reranking import CrossEncoderReranker
+from needle.utils import tokenize
+
+# File of an index directory naming its current generation (replaced atomically by the indexer)
+CURRENT_FILE = "CURRENT"
+
+# Directory of the generations of an index
+GENERATIONS_DIR = "generations"
+
+
+def list_files(directory: Union[str, os.PathLike], extensions: Iterable[str] = (".txt", ".md")) -> List[Path]:
+    """
+    List the files to index in a directory (recursive, sorted).
+
+    Args:
+        directory (Union[str, os.PathLike]): Directory containing the documents
+        extensions (Iterable[str]): File extensions to index
+
+    Returns:
+        List[Path]: Paths of the files
+
+    """
+    directory = Path(directory)
+
+    if not directory.is_dir():
+        raise NotADirectoryError(f"Documents directory not found: '{directory}'")
+
+    extensions = {extension.lower() for extension in extensions}
+    return sorted(path for path in directory.rglob("*") if path.is_file() and path.suffix.lower() in extensions)
+
+
+def chunk_files(directory: Union[str, os.PathLike], paths: Iterable[Path], chunk_size: int = 200, chunk_overlap: int = 20) -> List[Document]:
+    """
+    Load and chunk text files.
+
+    Args:
+        directory (Union[str, os.PathLike]): Directory containing the documents ('file_path' relative to it)
+        paths (Iterable[Path]): Paths of the files
+        chunk_size (int): Number of words per chunk
+        chunk_overlap (int): Number of words shared by two consecutive chunks
+
+    Returns:
+        List[Document]: Chunks of the files (in the order of the files)
+
+    """
+    directory = Path(directory)
+
+    documents = [Document(content=path.read_text(errors="ignore"), meta={"file_path": str(path.relative_to(directory))}) for path in paths]
+    splitter = DocumentSplitter(split_by="word", split_length=chunk_size, split_overlap=chunk_overlap)
+
+    return splitter.run(documents=documents)["documents"]
+
+
+def load_documents(
+    directory: Union[str, os.PathLike],
+    extensions: Iterable[str] = (".txt", ".md"),
+    chunk_size: int = 200,
+    chunk_overlap: int = 20,
+) -> List[Document]:
+    """
+    Load and chunk the text files of a directory.
+
+    Args:
+        directory (Union[str, os.PathLike]): Directory containing the documents
+        extensions (Iterable[str]): File extensions to index
+        chunk_size (int): Number of words per chunk
+        chunk_overlap (int): Number of words shared by two consecutive chunks
+
+    Returns:
+        List[Document]: Chunks of the documents
+
+    """
+    return chunk_files(directory, list_files(directory, extensions), chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+
+
+def get_generation_path(path: Union[str, os.PathLike]) -> Path:
+    """
+    Get the directory of the current generation of an index.
+
+    Args:
+        path (Union[str, os.PathLike]): Directory of the index
+
+    Returns:
+        Path: Directory of the generation named by the 'CURRENT' file (the index directory itself without generations)
+
+    """
+    path = Path(path)
+
+    try:
+        generation = (path / CURRENT_FILE).read_text().strip()
+    except FileNotFoundError:
+        return path
+
+    return path / GENERATIONS_DIR / generation
+
+
+class BM25Index:
+    """
+    BM25 index persisted on disk as NumPy arrays.
+
+    Notes:
+        The BM25 weight of each (term, document) pair is computed at indexing time, a query
+        is only a sum of the postings weights of its terms. Arrays are memory-mapped and the
+        vocabulary / documents are loaded on the first query, so loading an index is instant
+        and the pages are shared between the workers by the OS page cache.
+
+    Layout:
+        vocabulary.json: Mapping between the terms and their index
+        offsets.npy: Start of the postings of each term (int64, size V + 1)
+        postings.npy: Document index of each posting (int32)
+        weights.npy: BM25 weight of each posting (float32)
+        documents.jsonl: Content and metadata of the documents (one per line)
+        documents.npy: Byte offset of each document in 'documents.jsonl' (int64, size N + 1)
+
+    Args:
+        path (Union[str, os.PathLike]): Directory of the index
+
+    """
+
+    def __init__(self, path: Union[str, os.PathLike]):
+        self.path = Path(path)
+
+        if not (self.path / "vocabulary.json").exists():
+            raise FileNotFoundError(f"Index not found at: '{self.path}'")
+
+    @cached_property
+    def vocabulary(self) -> dict:
+        """Mapping between the terms and their index."""
+        return json.loads((self.path / "vocabulary.json").read_text())
+
+    @cached_property
+    def offsets(self) -> np.ndarray:
+        """Start of the postings of each term."""
+        return np.load(self.path / "offsets.npy", mmap_mode="r")
+
+    @cached_property
+    def postings(self) -> np.ndarray:
+        """Document index of each posting."""
+        return np.load(self.path / "postings.npy", mmap_mode="r")
+
+    @cached_property
+    def weights(self) -> np.ndarray:
+        """BM25 weight of each posting."""
+        return np.load(self.path / "weights.npy", mmap_mode="r")
+
+    @cached_property
+    def documents_offsets(self) -> np.ndarray:
+        """Byte offset of each document in the documents file."""
+        return np.load(self.path / "documents.npy", mmap_mode="r")
+
+    @cached_property
+    def embeddings(self) -> EmbeddingIndex:
+        """Embeddings of the documents (same generation, ingested with an embedding model)."""
+        return EmbeddingIndex(self.path)
+
+    def __len__(self) -> int:
+        """Number of indexed documents."""
+        return len(self.documents_offsets) - 1
+
+    @classmethod
+    def build(
+        cls,
+        documents: List[Document],
+        path: Union[str, os.PathLike],
+        k1: float = 1.5,
+        b: float = 0.75,
+    ) -> "BM25Index":
+        """
+        Index the documents and save the index on disk (replace the existing index).
+
+        Args:
+            documents (List[Document]): Documents to index
+            path (Union[str, os.PathLike]): Directory of the index
+            k1 (float): BM25 term frequency saturation
+            b (float): BM25 document length normalization
+
+        Returns:
+            BM25Index: The saved index
+
+        """
+        path = Path(path)
+        temporary_path = path.with_name(f"{path.name}.tmp")
+        shutil.rmtree(temporary_path, ignore_errors=True)
+        temporary_path.mkdir(parents=True)
+
+        vocabulary = {}
+        terms, indexes, frequencies = [], [], []
+        lengths = np.zeros(len(documents), dtype=np.float32)
+        documents_offsets = np.zeros(len(documents) + 1, dtype=np.int64)
+
+        with open(temporary_path / "documents.jsonl", "wb") as file:
+            for index, document in enumerate(documents):
+                counter = Counter(tokenize(document.content or ""))
+                lengths[index] = sum(counter.values())
+
+                for term, frequency in counter.items():
+                    terms.append(vocabulary.setdefault(term, len(vocabulary)))
+                    indexes.append(index)
+                    frequencies.append(frequency)
+
+                line = json.dumps({"id": document.id, "content": document.content, "meta": document.meta}) + "\n"
+                documents_offsets[index + 1] = documents_offsets[index] + file.write(line.encode())
+
+        terms = np.asarray(terms, dtype=np.int64)
+        indexes = np.asarray(indexes, dtype=np.int32)
+        frequencies = np.asarray(frequencies, dtype=np.float32)
+
+        # Group the postings by term (stable sort keep the documents order)
+        order = np.argsort(terms, kind="stable")
+        terms, indexes, frequencies = terms[order], indexes[order], frequencies[order]
+
+        document_frequencies = np.bincount(terms, minlength=len(vocabulary))
+        offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(document_frequencies)
+
+        # Precompute the BM25 weight of each posting
+        number_documents = max(len(documents), 1)
+        average_length = max(float(lengths.mean()) if len(documents) else 0.0, 1.0)
+        idf = np.log1p((number_documents - document_frequencies + 0.5) / (document_frequencies + 0.5))
+        normalization = k1 * (1 - b + b * lengths[indexes] / average_length)
+        weights = idf[terms] * frequencies * (k1 + 1) / (frequencies + normalization)
+
+        np.save(temporary_path / "offsets.npy", offsets)
+        np.save(temporary_path / "postings.npy", indexes)
+        np.save(temporary_path / "weights.npy", weights.astype(np.float32))
+        np.save(temporary_path / "documents.npy", documents_offsets)
+        (temporary_path / "vocabulary.json").write_text(json.dumps(vocabulary))
+
+        # Replace the previous index once the new one is complete
+        shutil.rmtree(path, ignore_errors=True)
+        temporary_path.rename(path)
+
+        logger.info(f"Indexed {len(documents)} chunks ({len(vocabulary)} terms) at: '{path}'")
+        return cls(path)
+
+    def iter_documents(self, start: int = 0, stop: Optional[int] = None) -> Iterable[Document]:
+        """Read the documents from `start` to `stop` (sequential read of the documents file)."""
+        stop = len(self) if stop is None else stop
+
+        with open(self.path / "documents.jsonl", "rb") as file:
+            file.seek(int(self.documents_offsets[start]))
+
+            for _ in range(start, stop):
+                data = json.loads(file.readline())
+                yield Document(id=data["id"], content=data["content"], meta=data["meta"])
+
+    def get_documents(self, indexes: Iterable[int]) -> List[Document]:
+        """Read the documents at the given indexes from the documents file."""
+        documents = []
+
+        with open(self.path / "documents.jsonl", "rb") as file:
+            for index in indexes:
+                file.seek(int(self.documents_offsets[index]))
+                data = json.loads(file.readline())
+                documents.append(Document(id=data["id"], content=data["content"], meta=data["meta"]))
+
+        return documents
+
+    def query(self, query: str, top_k: int = 5) -> List[Document]:
+        """
+        Get the most relevant documents for the query.
+
+        Args:
+            query (str): Text of the query
+            top_k (int): Maximum number of documents to return
+
+        Returns:
+            List[Document]: Documents sorted by decreasing BM25 score
+
+        """
+        terms = [self.vocabulary[term] for term in set(tokenize(query)) if term in self.vocabulary]
+
+        if not terms:
+            return []
+
+        indexes = np.concatenate([self.postings[self.offsets[term] : self.offsets[term + 1]] for term in terms])
+        weights = np.concatenate([self.weights[self.offsets[term] : self.offsets[term + 1]] for term in terms])
+
+        if len(indexes) * 8 > len(self):
+            # Frequent terms, a dense accumulation is cheaper than sorting the candidates
+            scores = np.bincount(indexes, weights=weights, minlength=len(self))
+            candidates = np.arange(len(self))
+        else:
+            # Sum the weights only over the candidate documents (not the whole corpus)
+            candidates, inverse = np.unique(indexes, return_inverse=True)
+            scores = np.bincount(inverse, weights=weights)
+
+        top_k = min(top_k, len(candidates))
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        best = best[np.argsort(-scores[best])]
+        best = best[scores[best] > 0]
+
+        documents = self.get_documents(candidates[best])
+
+        for document, score in zip(documents, scores[best]):
+            document.score = float(score)
+
+        return documents
+
+
+# Loaded generation of each index: ('CURRENT' file version, index)
+_indexes: Dict[str, Tuple[Optional[Tuple[int, int]], BM25Index]] = {}
+_indexes_lock = threading.Lock()
+
+
+def load_index(path: Union[str, os.PathLike]) -> BM25Index:
+    """
+    Load the current generation of an index (once per generation and worker process).
+
+    Notes:
+        The 'CURRENT' file is checked on each call (a `stat`), a worker switches to a generation
+        published by the indexer on its next query. The previous generation is released when its
+        queries in flight are done, its pages are memory-mapped (never two copies in memory).
+
+    Args:
+        path (Union[str, os.PathLike]): Directory of the index
+
+    Returns:
+        BM25Index: Index of the current generation
+
+    """
+    key = str(path)
+
+    try:
+        stat = os.stat(Path(path) / CURRENT_FILE)
+        version = (stat.st_ino, stat.st_mtime_ns)
+    except FileNotFoundError:
+        version = None
+
+    loaded = _indexes.get(key)
+
+    if loaded is not None and loaded[0] == version:
+        return loaded[1]
+
+    with _indexes_lock:
+        loaded = _indexes.get(key)
+
+        if loaded is None or loaded[0] != version:
+            index = BM25Index(get_generation_path(path))
+            _indexes[key] = (version, index)
+
+            if loaded is not None:
+                logger.info(f"Index generation '{index.path.name}' loaded ({len(index)} chunks)")
+
+            loaded = _indexes[key]
+
+    return loaded[1]
+
+
+@component
+class BM25Retriever:
+    """
+    Retrieve the documents of a local `BM25Index`.
+
+    Args:
+        index_path (str): Directory of the index
+        top_k (int): Maximum number of documents to return
+
+    """
+
+    def __init__(self, index_path: str, top_k: int = 5):
+        self.index_path = index_path
+        self.top_k = top_k
+
+    def warm_up(self):
+        """Load the current generation of the index (memory-mapped) before the first query."""
+        load_index(self.index_path)
+
+    @component.output_types(documents=List[Document])
+    def run(self, query: str, top_k: Optional[int] = None):
+        """
+        Retrieve the documents relevant to the query.
+
+        Args:
+            query (str): Text of the query
+            top_k (Optional[int]): Maximum number of documents, override the one given at initialisation
+
+        Returns:
+            dict: Documents sorted by decreasing score ('documents')
+
+        """
+        index = load_index(self.index_path)
+        return {"documents": index.query(query, top_k=top_k or self.top_k)}
+
+
+@component
+class VectorRetriever:
+    """
+    Retrieve the documents of a local index closest to the embedding of the query.
+
+    Notes:
+        The query is embedded by the model of the index embeddings (see `needle ingest --embedding-model`),
+        the documents are scored by the IVF index of the embeddings if it was built (exact search else).
+
+    Args:
+        index_path (str): Directory of the index
+        top_k (int): Maximum number of documents to return
+        probes (int): Number of IVF lists scored per query (recall and latency knob)
+        api_base_url (Optional[str]): URL of the embedding API ('OPENAI_BASE_URL' or OpenAI if None)
+        http_client (Optional[httpx.Client]): HTTP client of the embedding requests
+
+    """
+
+    def __init__(
+        self,
+        index_path: str,
+        top_k: int = 5,
+        probes: int = 8,
+        api_base_url: Optional[str] = None,
+        http_client: Optional[httpx.Client] = None,
+    ):
+        self.index_path = index_path
+        self.top_k = top_k
+        self.probes = probes
+        self.api_base_url = api_base_url
+        self.http_client = http_client
+
+        self.embedders: Dict[Tuple[str, str], Union[OpenAIEmbedder, LocalEmbedder]] = {}
+
+    def warm_up(self):
+        """Load the current generation of the index and its embeddings before the first query."""
+        load_index(self.index_path).embeddings.matrix
+
+    def get_embedder(self, embeddings: EmbeddingIndex) -> Union[OpenAIEmbedder, LocalEmbedder]:
+        """Embedder of the model of the index (created once per model)."""
+        key = (embeddings.info["model"], embeddings.info["backend"])
+
+        if key not in self.embedders:
+            self.embedders[key] = get_embedder(*key, api_base_url=self.api_base_url, http_client=self.http_client)
+
+        return self.embedders[key]
+
+    @component.output_types(documents=List[Document])
+    def run(self, query: str, top_k: Optional[int] = None):
+        """
+        Retrieve the documents relevant to the query.
+
+        Args:
+            query (str): Text of the query
+            top_k (Optional[int]): Maximum number of documents, override the one given at initialisation
+
+        Returns:
+            dict: Documents sorted by decreasing cosine similarity ('documents')
+
+        """
+        return {"documents": self.search(load_index(self.index_path), query, top_k=top_k or self.top_k)}
+
+    def search(self, index: BM25Index, query: str, top_k: int = 5) -> List[Document]:
+        """Get the documents of an index generation closest to the query (embeddings of the same generation)."""
+        embeddings = index.embeddings
+
+        vector = self.get_embedder(embeddings).embed([query])[0]
+        rows, scores = embeddings.search(vector, top_k=top_k, probes=self.probes)
+        documents = index.get_documents(rows)
+
+        for document, score in zip(documents, scores):
+            document.score = float(score)
+
+        return documents
+
+
+def reciprocal_rank_fusion(rankings: Iterable[List[Document]], k: int = 60) -> List[Document]:
+    """
+    Fuse rankings of documents with the reciprocal rank fusion (RRF).
+
+    Notes:
+        The score of a document is the sum of 1 / (k + rank) over the rankings returning it, only the
+        ranks are used (the BM25 scores and cosine similarities aren't on the same scale). A larger `k`
+        gives more weight to the documents found by several rankings than to the first ones of each.
+
+    Args:
+        rankings (Iterable[List[Document]]): Documents of each retrieval (best first)
+        k (int): Rank smoothing constant (60 in the original paper)
+
+    Returns:
+        List[Document]: Documents sorted by decreasing fused score (first ranking first on ties)
+
+    """
+    scores: Dict[str, float] = {}
+    documents: Dict[str, Document] = {}
+
+    for ranking in rankings:
+        for rank, document in enumerate(ranking, start=1):
+            scores[document.id] = scores.get(document.id, 0.0) + 1 / (k + rank)
+            documents.setdefault(document.id, document)
+
+    # Stable sort, equal scores keep the order of the first ranking
+    ids = sorted(scores, key=scores.__getitem__, reverse=True)
+
+    for id_ in ids:
+        documents[id_].score = scores[id_]
+
+    return [documents[id_] for id_ in ids]
+
+
+@lru_cache(maxsize=1)
+def get_executor() -> ThreadPoolExecutor:
+    """Threads of the vector searches of the hybrid retrieval (created by each worker on its first query)."""
+    return ThreadPoolExecutor(thread_name_prefix="needle-retrieval")
+
+
+@component
+class HybridRetriever:
+    """
+    Retrieve the documents of a local index by keywords (BM25) and embeddings, then rerank them.
+
+    Notes:
+        - The query is embedded and searched in a thread while the BM25 index is queried, the
+          retrieval takes the time of the slowest search instead of their sum. Both search the
+          same index generation, if the vector search fails only the BM25 documents are used.
+        - Each search returns `candidates` documents, fused by their ranks (see `reciprocal_rank_fusion`).
+        - The optional reranker reorders the first fused documents within the time left by the
+          searches in the latency budget (see `CrossEncoderReranker`).
+        - The duration of each stage is measured ('needle_retrieval_stage_seconds').
+
+    Args:
+        index_path (str): Directory of the index
+        top_k (int): Maximum number of documents to return
+        candidates (int): Number of documents returned by each search before the fusion
+        rrf_k (int): Rank smoothing constant of the fusion
+        probes (int): Number of IVF lists scored per query (recall and latency knob)
+        api_base_url (Optional[str]): URL of the embedding API ('OPENAI_BASE_URL' or OpenAI if None)
+        http_client (Optional[httpx.Client]): HTTP client of the embedding requests
+        reranker (Optional[CrossEncoderReranker]): Reranker of the fused documents (fusion order if None)
+        budget (Optional[float]): Latency budget of the retrieval, the reranking uses what's left (seconds, no limit if None)
+
+    """
+
+    def __init__(
+        self,
+        index_path: str,
+        top_k: int = 5,
+        candidates: int = 20,
+        rrf_k: int = 60,
+        probes: int = 8,
+        api_base_url: Optional[str] = None,
+        http_client: Optional[httpx.Client] = None,
+        reranker: Optional[CrossEncoderReranker] = None,
+        budget: Optional[float] = None,
+    ):
+        self.index_path = index_path
+        self.top_k = top_k
+        self.candidates = candidates
+        self.rrf_k = rrf_k
+        self.reranker = reranker
+        self.budget = budget
+
+        self.vector_retriever = VectorRetriever(index_path=index_path, probes=probes, api_base_url=api_base_url, http_client=http_client)
+
+    def warm_up(self):
+        """Load the current generation of the index, its embeddings and the reranker before the first query."""
+        self.vector_retriever.warm_up()
+
+        if self.reranker is not None:
+            self.reranker.warm_up()
+
+    def search_vectors(self, index: BM25Index, query: str, top_k: int) -> List[Document]:
+        """Vector search of the query (run in a thread, its duration is measured)."""
+        with RETRIEVAL_STAGE_SECONDS.labels(stage="vector").time():
+            return self.vector_retriever.search(index, query, top_k=top_k)
+
+    @component.output_types(documents=List[Document])
+    def run(self, query: str, top_k: Optional[int] = None):
+        """
+        Retrieve the documents relevant to the query.
+
+        Args:
+            query (str): Text of the query
+            top_k (Optional[int]): Maximum number of documents, override the one given at initialisation
+
+        Returns:
+            dict: Documents sorted by decreasing reranking score, or fused score without reranking ('documents')
+
+        """
+        start = time.perf_counter()
+        top_k = top_k or self.top_k
+        candidates = max(self.candidates, top_k)
+        index = load_index(self.index_path)
+
+        future = get_executor().submit(self.search_vectors, index, query, candidates)
+
+        with RETRIEVAL_STAGE_SECONDS.labels(stage="bm25").time():
+            keywords = index.query(query, top_k=candidates)
+
+        try:
+            vectors = future.result()
+        except Exception as exception:
+            logger.warning(f"Vector search failed, only the BM25 documents are used: {exception!r}")
+            vectors = []
+
+        with RETRIEVAL_STAGE_SECONDS.labels(stage="fusion").time():
+            documents = reciprocal_rank_fusion([keywords, vectors], k=self.rrf_k)
+
+        if self.reranker is not None:
+            budget = None if self.budget is None else self.budget - (time.perf_counter() - start)
+            documents = self.reranker.rerank(query, documents, budget=budget)
+
+        return {"documents": documents[:top_k]}
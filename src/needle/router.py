@@ -0,0 +1,378 @@
+import asyncio
+import math
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+from haystack import component
+from haystack.dataclasses import StreamingChunk
+from loguru import logger
+from openai import APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+
+from needle.components import AsyncOpenAIGenerator
+from needle.history import TokenCounter
+from needle.metrics import LLM_ERRORS, LLM_LATENCY, LLM_ROUTED
+
+# Failures of a route worth retrying on another route (the request itself is valid)
+RETRYABLE_ERRORS = (TimeoutError, APITimeoutError, APIConnectionError, RateLimitError, InternalServerError)
+
+
+class Route:
+    """
+    Generator of a model (or endpoint) with its rolling latency and error rate.
+
+    Args:
+        generator (AsyncOpenAIGenerator): Generator of the model
+        name (Optional[str]): Name of the route in the logs and metrics (model name if not set)
+        max_prompt_tokens (Optional[int]): Largest prompt accepted by the model (no limit if None)
+        window (int): Number of latencies kept for the quantiles
+        cooldown (float): Time without calls after a rate limit without 'Retry-After' (seconds)
+
+    """
+
+    def __init__(
+        self,
+        generator: AsyncOpenAIGenerator,
+        name: Optional[str] = None,
+        max_prompt_tokens: Optional[int] = None,
+        window: int = 100,
+        cooldown: float = 10,
+    ):
+        self.generator = generator
+        self.name = name or generator.model
+        self.max_prompt_tokens = max_prompt_tokens
+        self.cooldown = cooldown
+
+        self.latencies: Deque[float] = deque(maxlen=window)
+        self.error_rate = 0.0
+        self.unavailable_until = 0.0
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Quantile of the recent latencies (None without latency)."""
+        if not self.latencies:
+            return None
+
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, math.ceil(q * len(latencies)) - 1)]
+
+    def record_latency(self, latency: float):
+        """Record the latency of a successful call."""
+        self.latencies.append(latency)
+        self.error_rate *= 0.9
+        LLM_LATENCY.labels(model=self.name).observe(latency)
+
+    def record_error(self, exception: BaseException):
+        """Record a failed call (a rate limited route isn't used until its cooldown ends)."""
+        self.error_rate = self.error_rate * 0.9 + 0.1
+        LLM_ERRORS.labels(model=self.name, error=type(exception).__name__).inc()
+
+        if isinstance(exception, RateLimitError):
+            retry_after = exception.response.headers.get("retry-after")
+            cooldown = float(retry_after) if retry_after and retry_after.isdigit() else self.cooldown
+            self.unavailable_until = time.monotonic() + cooldown
+
+    def score(self, default_latency: float) -> float:
+        """Expected cost of a call (median latency, penalized by the error rate)."""
+        latency = self.quantile(0.5)
+        latency = default_latency if latency is None else latency
+        return latency * (1 + 4 * self.error_rate)
+
+
+@component
+class RouterGenerator:
+    """
+    Generator sending each prompt to the best of several routes (models or endpoints).
+
+    Notes:
+        - The routes are ranked by median latency and error rate, the routes too small for the
+          prompt or rate limited are skipped. Routes without latency yet keep their order.
+        - A call failing with a timeout, a rate limit, a connection or a server error is sent
+          to the next route (unless its first tokens were already streamed).
+        - With hedging, a second call is sent when the first one takes longer than the p95
+          latency of its route, the first to answer (first token when streaming) wins.
+
+    Args:
+        routes (List[Route]): Routes of the router, the first is the default one
+        timeout (float): Time to the first token (streaming) or to the response before failing over (seconds)
+        hedging (bool): Send a second call when the first one is slower than usual
+        hedge_quantile (float): Latency quantile of the route after which the second call is sent
+        min_samples (int): Number of latencies of the route needed before hedging
+
+    """
+
+    def __init__(
+        self,
+        routes: List[Route],
+        timeout: float = 30,
+        hedging: bool = False,
+        hedge_quantile: float = 0.95,
+        min_samples: int = 20,
+    ):
+        if not routes:
+            raise ValueError("The router needs at least one route")
+
+        self.routes = routes
+        self.timeout = timeout
+        self.hedging = hedging
+        self.hedge_quantile = hedge_quantile
+        self.min_samples = min_samples
+
+        # Name of the default model (token counter, cache keys and scheduler of the engine)
+        self.model = routes[0].generator.model
+        self.counter = TokenCounter(self.model)
+
+    def rank(self, prompt: str) -> List[Route]:
+        """Get the routes able to answer the prompt, the best first."""
+        tokens = self.counter.count(prompt)
+        now = time.monotonic()
+
+        # Without a better choice, every route is tried anyway
+        routes = [route for route in self.routes if route.max_prompt_tokens is None or tokens <= route.max_prompt_tokens] or self.routes
+        routes = [route for route in routes if route.unavailable_until <= now] or routes
+
+        latencies = [latency for route in routes if (latency := route.quantile(0.5)) is not None]
+        default_latency = max(latencies, default=0)
+
+        # Stable sort, the configuration order is kept between equivalent routes
+        return sorted(routes, key=lambda route: route.score(default_latency))
+
+    def get_hedge_delay(self, route: Route) -> Optional[float]:
+        """Time after which a second call is sent (None to never send it)."""
+        if not self.hedging or len(route.latencies) < self.min_samples:
+            return None
+
+        delay = route.quantile(self.hedge_quantile)
+        return delay if delay < self.timeout else None
+
+    async def connect(self, connections: int = 1):
+        """Open connections to the API of each route before the first call."""
+        await asyncio.gather(*(route.generator.connect(connections) for route in self.routes))
+
+    async def call(
+        self,
+        route: Route,
+        prompt: str,
+        system_prompt: Optional[str],
+        streaming_callback: Optional[Callable[[StreamingChunk], None]],
+        generation_kwargs: Optional[Dict[str, Any]],
+    ) -> Dict[str, Any]:
+        """Call a route (timeout on the first token when streaming, on the response else)."""
+        start = time.perf_counter()
+        first = True
+
+        async with asyncio.timeout(self.timeout) as timeout:
+
+            def callback(chunk: StreamingChunk):
+                nonlocal first
+
+                if first:
+                    first = False
+                    route.record_latency(time.perf_counter() - start)
+
+                    # The length of the response doesn't count in the timeout
+                    timeout.reschedule(None)
+
+                streaming_callback(chunk)
+
+            result = await route.generator.run_async(
+                prompt=prompt,
+                system_prompt=system_prompt,
+                streaming_callback=None if streaming_callback is None else callback,
+                generation_kwargs=generation_kwargs,
+            )
+
+        if first:
+            route.record_latency(time.perf_counter() - start)
+
+        return result
+
+    @component.output_types(replies=List[str], meta=List[Dict[str, Any]])
+    def run(
+        self,
+        prompt: str,
+        system_prompt: Optional[str] = None,
+        streaming_callback: Optional[Callable[[StreamingChunk], None]] = None,
+        generation_kwargs: Optional[Dict[str, Any]] = None,
+    ):
+        """
+        Invoke the text generation inference (blocking, failover without hedging).
+
+        Args:
+            prompt (str): The string prompt to use for text generation.
+            system_prompt (Optional[str]): The system prompt, override the one given at initialisation.
+            streaming_callback (Optional[Callable[[StreamingChunk], None]]): Callback called for each received token.
+            generation_kwargs (Optional[Dict[str, Any]]): Additional keyword arguments for text generation.
+
+        Returns:
+            dict: Generated responses ('replies') and their metadata ('meta').
+
+        """
+        routes = self.rank(prompt)
+
+        for index, route in enumerate(routes):
+            LLM_ROUTED.labels(model=route.name, reason="failover" if index else "best").inc()
+            start = time.perf_counter()
+
+            try:
+                result = route.generator.run(
+                    prompt=prompt,
+                    system_prompt=system_prompt,
+                    streaming_callback=streaming_callback,
+                    generation_kwargs=generation_kwargs,
+                )
+            except RETRYABLE_ERRORS as exception:
+                route.record_error(exception)
+
+                if index == len(routes) - 1:
+                    raise
+
+                logger.warning(f"LLM call on '{route.name}' failed ({type(exception).__name__}), failover on the next route")
+                continue
+
+            route.record_latency(time.perf_counter() - start)
+            return result
+
+    @component.output_types(replies=List[str], meta=List[Dict[str, Any]])
+    async def run_async(
+        self,
+        prompt: str,
+        system_prompt: Optional[str] = None,
+        streaming_callback: Optional[Callable[[StreamingChunk], None]] = None,
+        generation_kwargs: Optional[Dict[str, Any]] = None,
+    ):
+        """
+        Invoke the text generation inference on the best route (failover and hedging).
+
+        Args:
+            prompt (str): The string prompt to use for text generation.
+            system_prompt (Optional[str]): The system prompt, override the one given at initialisation.
+            streaming_callback (Optional[Callable[[StreamingChunk], None]]): Callback called for each received token.
+            generation_kwargs (Optional[Dict[str, Any]]): Additional keyword arguments for text generation.
+
+        Returns:
+            dict: Generated responses ('replies') and their metadata ('meta').
+
+        """
+        routes = deque(self.rank(prompt))
+        race = Race(self, prompt, system_prompt, streaming_callback, generation_kwargs)
+        hedged = False
+        reason = "best"
+
+        try:
+            while True:
+                if not race.pending:
+                    race.start(routes.popleft(), reason)
+
+                # Only the first call is hedged, on the next route (or the same if it's the only one)
+                delay = None if hedged or race.winner is not None else self.get_hedge_delay(race.first_route)
+                done, _ = await asyncio.wait(race.pending, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    hedged = True
+                    race.start(routes.popleft() if routes else race.first_route, "hedge")
+                    continue
+
+                for task in done:
+                    result = race.pop(task, failover=bool(routes))
+
+                    if result is not None:
+                        return result
+
+                reason = "failover"
+        finally:
+            race.cancel()
+
+
+class Race:
+    """
+    Calls of the same prompt in flight on several routes (failover and hedging).
+
+    Notes:
+        When streaming, the first call sending a token wins: its tokens are forwarded
+        and the other calls are cancelled.
+
+    """
+
+    def __init__(
+        self,
+        router: RouterGenerator,
+        prompt: str,
+        system_prompt: Optional[str],
+        streaming_callback: Optional[Callable[[StreamingChunk], None]],
+        generation_kwargs: Optional[Dict[str, Any]],
+    ):
+        self.router = router
+        self.prompt = prompt
+        self.system_prompt = system_prompt
+        self.streaming_callback = streaming_callback
+        self.generation_kwargs = generation_kwargs
+
+        self.pending: Dict[asyncio.Task, Route] = {}
+        self.winner: Optional[asyncio.Task] = None
+
+    @property
+    def first_route(self) -> Route:
+        """Route of the oldest call in flight."""
+        return next(iter(self.pending.values()))
+
+    def start(self, route: Route, reason: str):
+        """Send the prompt to a route."""
+        LLM_ROUTED.labels(model=route.name, reason=reason).inc()
+        task: Optional[asyncio.Task] = None
+
+        def callback(chunk: StreamingChunk):
+            if self.winner is None:
+                self.winner = task
+
+                for other in self.pending:
+                    if other is not task:
+                        other.cancel()
+
+            if self.winner is task:
+                self.streaming_callback(chunk)
+
+        callback = None if self.streaming_callback is None else callback
+        task = asyncio.create_task(self.router.call(route, self.prompt, self.system_prompt, callback, self.generation_kwargs))
+        self.pending[task] = route
+
+    def pop(self, task: asyncio.Task, failover: bool) -> Optional[Dict[str, Any]]:
+        """
+        Get the result of a finished call.
+
+        Args:
+            task (asyncio.Task): Finished call
+            failover (bool): Other routes can still be tried
+
+        Raises:
+            Exception: Error of the call if no other call can answer
+
+        Returns:
+            Optional[Dict[str, Any]]: Result of the call, None if another call must answer
+
+        """
+        route = self.pending.pop(task)
+
+        if task.cancelled():
+            return None
+
+        exception = task.exception()
+
+        if exception is None:
+            return task.result()
+
+        if not isinstance(exception, RETRYABLE_ERRORS):
+            raise exception
+
+        route.record_error(exception)
+
+        # Tokens already sent can't be taken back
+        if task is self.winner or not (failover or self.pending):
+            raise exception
+
+        logger.warning(f"LLM call on '{route.name}' failed ({type(exception).__name__}), failover on the next route")
+        return None
+
+    def cancel(self):
+        """Cancel the calls still in flight."""
+        for task in self.pending:
+            task.cancel()
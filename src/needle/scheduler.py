@@ -0,0 +1,277 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from typing import AsyncIterator, Callable, Deque, Dict, Optional
+
+from needle.metrics import SCHEDULER_COALESCED, SCHEDULER_QUEUE_DEPTH, SCHEDULER_QUEUE_WAIT, SCHEDULER_REJECTED
+
+
+class BusyError(Exception):
+    """The scheduler can't accept more chat turns (queue full or wait too long)."""
+
+
+class FairLimiter:
+    """
+    Concurrency limit handing the free slots to the waiting clients in round robin.
+
+    Notes:
+        A client sending many chat turns at once only queues behind its own turns,
+        the other clients keep getting a slot at each release.
+
+    Args:
+        limit (int): Maximum number of concurrent slots
+        max_waiting (int): Maximum number of waiting turns (BusyError beyond)
+        timeout (float): Maximum waiting time of a turn (seconds, BusyError beyond)
+
+    """
+
+    def __init__(self, limit: int, max_waiting: int = 256, timeout: float = 30):
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.timeout = timeout
+
+        self.active = 0
+        self.waiting = 0
+        self.queues: Dict[str, Deque[asyncio.Future]] = OrderedDict()
+
+    async def acquire(self, client_id: str):
+        """Wait for a free slot (raise BusyError if the queue is full or the wait too long)."""
+        if self.active < self.limit and not self.waiting:
+            self.active += 1
+            return
+
+        if self.waiting >= self.max_waiting:
+            raise BusyError(f"Too many waiting chat turns ({self.waiting})")
+
+        future = asyncio.get_running_loop().create_future()
+        queue = self.queues.setdefault(client_id, deque())
+        queue.append(future)
+        self.waiting += 1
+
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=self.timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as exception:
+            if future.done():
+                # The slot was given while leaving, hand it to the next turn
+                self.release()
+            else:
+                future.cancel()
+                queue.remove(future)
+                self.waiting -= 1
+
+                if not queue and self.queues.get(client_id) is queue:
+                    del self.queues[client_id]
+
+            if isinstance(exception, asyncio.TimeoutError):
+                raise BusyError(f"No free slot after {self.timeout} seconds") from exception
+
+            raise
+
+    def resize(self, limit: int, max_waiting: int, timeout: float):
+        """Change the limits (new free slots are handed to the waiting turns)."""
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.timeout = timeout
+
+        while self.active < self.limit and self.waiting:
+            self.active += 1
+            self.release()
+
+    def release(self):
+        """Free a slot, given to the first turn of the next client (round robin)."""
+        while self.queues:
+            client_id, queue = self.queues.popitem(last=False)
+            future = queue.popleft()
+            self.waiting -= 1
+
+            # The client goes to the end of the round
+            if queue:
+                self.queues[client_id] = queue
+
+            if not future.done():
+                future.set_result(None)
+                return
+
+        self.active -= 1
+
+
+class Flight:
+    """Generation shared by every identical in-flight chat turn (single-flight)."""
+
+    def __init__(self):
+        self.response = ""
+        self.version = 0
+        self.finished = False
+        self.exception: Optional[BaseException] = None
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+
+        self.changed = asyncio.Event()
+
+    def update(self, response: Optional[str] = None, exception: Optional[BaseException] = None, finished: bool = False):
+        """Publish a new state of the generation to the subscribers."""
+        if response is not None and response != self.response:
+            self.response = response
+            self.version += 1
+
+        self.exception = exception
+        self.finished = finished
+
+        # Wake the subscribers up, the next wait uses a new event
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    async def subscribe(self) -> AsyncIterator[str]:
+        """Yield the response each time it changes."""
+        self.subscribers += 1
+        version = 0
+
+        try:
+            while True:
+                changed = self.changed
+
+                if version != self.version:
+                    version = self.version
+                    yield self.response
+                    continue
+
+                if self.finished:
+                    if self.exception is not None:
+                        raise self.exception
+                    return
+
+                await changed.wait()
+        finally:
+            self.subscribers -= 1
+
+            # Nobody waits for this response anymore
+            if not self.subscribers and not self.finished and self.task is not None:
+                self.task.cancel()
+
+
+class Scheduler:
+    """
+    Scheduler between the chat interfaces and the LLM calls.
+
+    Notes:
+        - Identical prompts in flight are coalesced in a single LLM call (single-flight).
+        - Each model has its own concurrency limit, the slots are shared fairly between the clients.
+          A chat turn is scheduled on the default model of the router: its calls failed over or
+          hedged to the fallback routes count against the limit and single-flight key of that model.
+        - Beyond the waiting queue size (or waiting time) a BusyError is raised instead of queuing.
+
+    Args:
+        max_concurrency (int): Default concurrency limit of a model
+        model_concurrency (Optional[Dict[str, int]]): Concurrency limit per model name
+        max_queue_size (int): Maximum number of waiting chat turns per model
+        queue_timeout (float): Maximum waiting time of a chat turn (seconds)
+
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 64,
+        model_concurrency: Optional[Dict[str, int]] = None,
+        max_queue_size: int = 256,
+        queue_timeout: float = 30,
+    ):
+        self.max_concurrency = max_concurrency
+        self.model_concurrency = model_concurrency or {}
+        self.max_queue_size = max_queue_size
+        self.queue_timeout = queue_timeout
+
+        self.limiters: Dict[str, FairLimiter] = {}
+        self.flights: Dict[str, Flight] = {}
+
+    def get_limiter(self, model_name: str) -> FairLimiter:
+        """Get the concurrency limiter of a model."""
+        limiter = self.limiters.get(model_name)
+
+        if limiter is None:
+            limit = self.model_concurrency.get(model_name, self.max_concurrency)
+            limiter = self.limiters[model_name] = FairLimiter(limit, max_waiting=self.max_queue_size, timeout=self.queue_timeout)
+
+        return limiter
+
+    def update(self, scheduler: "Scheduler"):
+        """Take the limits of another scheduler (hot reload, the waiting turns are kept)."""
+        self.max_concurrency = scheduler.max_concurrency
+        self.model_concurrency = scheduler.model_concurrency
+        self.max_queue_size = scheduler.max_queue_size
+        self.queue_timeout = scheduler.queue_timeout
+
+        for model_name, limiter in self.limiters.items():
+            limit = self.model_concurrency.get(model_name, self.max_concurrency)
+            limiter.resize(limit, max_waiting=self.max_queue_size, timeout=self.queue_timeout)
+
+    async def run(
+        self,
+        key: str,
+        model_name: str,
+        client_id: str,
+        generate: Callable[[], AsyncIterator[str]],
+    ) -> AsyncIterator[str]:
+        """
+        Run a generation (or join the identical generation in flight).
+
+        Args:
+            key (str): Key of the generation (identical generations have the same key)
+            model_name (str): Name of the model used by the generation
+            client_id (str): Client asking for the generation (fair queuing)
+            generate (Callable[[], AsyncIterator[str]]): Start the generation
+
+        Returns:
+            AsyncIterator[str]: Response (partial while streaming, complete at the end)
+
+        """
+        flight = self.flights.get(key)
+
+        if flight is None:
+            flight = self.flights[key] = Flight()
+            flight.task = asyncio.create_task(self._produce(flight, key, model_name, client_id, generate))
+        else:
+            SCHEDULER_COALESCED.labels(model=model_name).inc()
+
+        async for response in flight.subscribe():
+            yield response
+
+    async def _produce(
+        self,
+        flight: Flight,
+        key: str,
+        model_name: str,
+        client_id: str,
+        generate: Callable[[], AsyncIterator[str]],
+    ):
+        """Wait for a slot of the model and publish the generation to the flight subscribers."""
+        limiter = self.get_limiter(model_name)
+        start = time.perf_counter()
+
+        try:
+            SCHEDULER_QUEUE_DEPTH.labels(model=model_name).inc()
+
+            try:
+                await limiter.acquire(client_id)
+            except BusyError:
+                SCHEDULER_REJECTED.labels(model=model_name).inc()
+                raise
+            finally:
+                SCHEDULER_QUEUE_DEPTH.labels(model=model_name).dec()
+                SCHEDULER_QUEUE_WAIT.labels(model=model_name).observe(time.perf_counter() - start)
+
+            try:
+                async for response in generate():
+                    flight.update(response)
+            finally:
+                limiter.release()
+
+            flight.update(finished=True)
+        except BaseException as exception:
+            flight.update(exception=exception, finished=True)
+
+            if isinstance(exception, asyncio.CancelledError):
+                raise
+        finally:
+            # New identical prompts start a new generation
+            if self.flights.get(key) is flight:
+                del self.flights[key]
@@ -0,0 +1,256 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Tuple, Union
+
+from needle.config import SESSION_BACKENDS
+from needle.metrics import SESSION_EVICTIONS
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session TEXT PRIMARY KEY,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_accessed ON sessions (accessed);
+
+CREATE TABLE IF NOT EXISTS messages (
+    session TEXT NOT NULL REFERENCES sessions (session) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    message TEXT NOT NULL,
+    PRIMARY KEY (session, position)
+);
+"""
+
+
+def to_message(message: Dict[str, Any]) -> Dict[str, Any]:
+    """Keep the role and content of a Gradio message (the metadata isn't stored)."""
+    return {"role": message["role"], "content": message["content"]}
+
+
+class SessionStore:
+    """
+    In-process store of the conversations, keyed by session id (least recently used and TTL eviction).
+
+    Notes:
+        The handlers write the changes of a conversation (messages replaced from a position)
+        instead of the whole conversation, the Gradio events still carry the chatbot history
+        (see `get_gradio_app`).
+        A session is only served by the worker process that stores it, use `SQLiteSessionStore`
+        when the workers don't share the sessions (no sticky sessions).
+
+    Args:
+        ttl (float): Time to live of an inactive session (seconds)
+        max_sessions (int): Maximum number of sessions kept
+
+    """
+
+    def __init__(self, ttl: float = 3600, max_sessions: int = 10_000):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+
+        self.sessions: OrderedDict[str, Tuple[float, List[Dict[str, Any]]]] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, session: str) -> List[Dict[str, Any]]:
+        """
+        Get the messages of a conversation.
+
+        Args:
+            session (str): Session id
+
+        Returns:
+            List[Dict[str, Any]]: Messages of the conversation (empty if unknown or expired)
+
+        """
+        with self.lock:
+            entry = self.sessions.get(session)
+
+            if entry is None:
+                return []
+
+            accessed, messages = entry
+
+            if accessed < time.monotonic() - self.ttl:
+                del self.sessions[session]
+                SESSION_EVICTIONS.labels(reason="ttl").inc()
+                return []
+
+            self.sessions[session] = (time.monotonic(), messages)
+            self.sessions.move_to_end(session)
+            return list(messages)
+
+    def replace(self, session: str, start: int, messages: List[Dict[str, Any]]):
+        """
+        Replace the messages of a conversation from a position (delta of the conversation).
+
+        Args:
+            session (str): Session id
+            start (int): Position of the first replaced message (messages after it are removed)
+            messages (List[Dict[str, Any]]): New messages from this position
+
+        """
+        with self.lock:
+            _, current = self.sessions.pop(session, (0, []))
+            self.sessions[session] = (time.monotonic(), current[:start] + [to_message(message) for message in messages])
+            self.evict()
+
+    def truncate(self, session: str, length: int):
+        """Keep the first messages of a conversation."""
+        self.replace(session, length, [])
+
+    def clear(self, session: str):
+        """Remove a conversation."""
+        with self.lock:
+            self.sessions.pop(session, None)
+
+    def evict(self):
+        """Remove the expired and least recently used sessions (lock held)."""
+        deadline = time.monotonic() - self.ttl
+
+        while self.sessions:
+            session, (accessed, _) = next(iter(self.sessions.items()))
+
+            if accessed >= deadline and len(self.sessions) <= self.max_sessions:
+                break
+
+            del self.sessions[session]
+            SESSION_EVICTIONS.labels(reason="ttl" if accessed < deadline else "lru").inc()
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Store of the conversations in SQLite, shared by the worker processes.
+
+    Notes:
+        One row per message: a delta only writes the replaced messages, never the whole conversation.
+
+    Args:
+        path (Union[str, os.PathLike]): Path of the SQLite database
+        ttl (float): Time to live of an inactive session (seconds)
+        max_sessions (int): Maximum number of sessions kept
+
+    """
+
+    def __init__(self, path: Union[str, os.PathLike], ttl: float = 3600, max_sessions: int = 10_000):
+        super().__init__(ttl=ttl, max_sessions=max_sessions)
+        self.path = Path(path)
+
+        self._local = threading.local()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection.executescript(SCHEMA)
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """SQLite connection of the current thread (a forked worker opens its own)."""
+        connection = getattr(self._local, "connection", None)
+
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("PRAGMA foreign_keys=ON")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+
+        return connection
+
+    def get(self, session: str) -> List[Dict[str, Any]]:
+        """
+        Get the messages of a conversation.
+
+        Args:
+            session (str): Session id
+
+        Returns:
+            List[Dict[str, Any]]: Messages of the conversation (empty if unknown or expired)
+
+        """
+        now = time.time()
+
+        with self.connection as connection:
+            connection.execute("BEGIN")
+            updated = connection.execute(
+                "UPDATE sessions SET accessed = ? WHERE session = ? AND accessed >= ?",
+                (now, session, now - self.ttl),
+            ).rowcount
+
+            if not updated:
+                return []
+
+            rows = connection.execute("SELECT message FROM messages WHERE session = ? ORDER BY position", (session,)).fetchall()
+
+        return [json.loads(message) for (message,) in rows]
+
+    def replace(self, session: str, start: int, messages: List[Dict[str, Any]]):
+        """
+        Replace the messages of a conversation from a position (delta of the conversation).
+
+        Args:
+            session (str): Session id
+            start (int): Position of the first replaced message (messages after it are removed)
+            messages (List[Dict[str, Any]]): New messages from this position
+
+        """
+        now = time.time()
+
+        with self.connection as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute(
+                "INSERT INTO sessions (session, accessed) VALUES (?, ?) ON CONFLICT (session) DO UPDATE SET accessed = excluded.accessed",
+                (session, now),
+            )
+            connection.execute("DELETE FROM messages WHERE session = ? AND position >= ?", (session, start))
+
+            # Positions are contiguous, a start after the end appends
+            (length,) = connection.execute("SELECT COUNT(*) FROM messages WHERE session = ?", (session,)).fetchone()
+            connection.executemany(
+                "INSERT INTO messages (session, position, message) VALUES (?, ?, ?)",
+                [(session, length + index, json.dumps(to_message(message))) for index, message in enumerate(messages)],
+            )
+
+            expired = connection.execute("DELETE FROM sessions WHERE accessed < ?", (now - self.ttl,)).rowcount
+            (count,) = connection.execute("SELECT COUNT(*) FROM sessions").fetchone()
+
+            evicted = 0
+            if count > self.max_sessions:
+                evicted = connection.execute(
+                    "DELETE FROM sessions WHERE session IN (SELECT session FROM sessions ORDER BY accessed LIMIT ?)",
+                    (count - self.max_sessions,),
+                ).rowcount
+
+        SESSION_EVICTIONS.labels(reason="ttl").inc(expired)
+        SESSION_EVICTIONS.labels(reason="lru").inc(evicted)
+
+    def clear(self, session: str):
+        """Remove a conversation."""
+        self.connection.execute("DELETE FROM sessions WHERE session = ?", (session,))
+
+
+def get_session_store(
+    backend: str = "memory", path: Union[str, os.PathLike, None] = None, ttl: float = 3600, max_sessions: int = 10_000
+) -> SessionStore:
+    """
+    Create the session store of a backend.
+
+    Args:
+        backend (str): 'memory' (in-process) or 'sqlite' (shared by the workers)
+        path (Union[str, os.PathLike, None]): Path of the SQLite database ('sqlite' backend)
+        ttl (float): Time to live of an inactive session (seconds)
+        max_sessions (int): Maximum number of sessions kept
+
+    Returns:
+        SessionStore: Session store
+
+    """
+    if backend == "memory":
+        return SessionStore(ttl=ttl, max_sessions=max_sessions)
+
+    if backend == "sqlite":
+        return SQLiteSessionStore(path, ttl=ttl, max_sessions=max_sessions)
+
+    raise ValueError(f"Session backend must be one of {SESSION_BACKENDS}: '{backend}'")
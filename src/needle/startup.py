@@ -0,0 +1,167 @@
+import gc
+import os
+import signal
+import socket
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+from loguru import logger
+from prometheus_client import multiprocess
+
+from needle.config import MULTIPROC_ENV
+from needle.metrics import STARTUP_SECONDS
+
+# Duration of each startup phase of the current process (seconds)
+STARTUP_TIMES: Dict[str, float] = {}
+
+
+@contextmanager
+def timed(phase: str) -> Iterator[None]:
+    """
+    Measure the duration of a startup phase.
+
+    Args:
+        phase (str): Name of the phase (import, settings, engine, ...)
+
+    """
+    start = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        STARTUP_TIMES[phase] = STARTUP_TIMES.get(phase, 0) + duration
+        STARTUP_SECONDS.labels(phase=phase).set(STARTUP_TIMES[phase])
+        logger.debug(f"Startup phase '{phase}' took {duration:.3f} seconds")
+
+
+def log_startup_times():
+    """Log the duration of the startup phases (to spot a slower dependency)."""
+    phases = ", ".join(f"{phase}: {duration:.3f}s" for phase, duration in STARTUP_TIMES.items())
+    logger.info(f"Application built in {sum(STARTUP_TIMES.values()):.3f} seconds ({phases})")
+
+
+class Supervisor:
+    """
+    Parent process of the forked workers (replace the dead workers, forward the signals).
+
+    Args:
+        config (uvicorn.Config): Configuration of the uvicorn servers (built application)
+        sock (socket.socket): Listening socket shared by the workers
+
+    """
+
+    def __init__(self, config, sock: socket.socket):
+        self.config = config
+        self.sock = sock
+        self.children: Dict[int, int] = {}
+        self.stopping = False
+
+    def spawn(self, index: int):
+        """Fork a worker serving the shared socket."""
+        import uvicorn
+
+        pid = os.fork()
+
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+            # Ignored until the application handles it (settings reload)
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+            try:
+                uvicorn.Server(self.config).run(sockets=[self.sock])
+            finally:
+                os._exit(0)
+
+        self.children[pid] = index
+        logger.info(f"Worker {index} started (pid: {pid})")
+
+    def forward(self, signum: int, frame=None):
+        """Send a signal to every worker."""
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def stop(self, signum: int, frame=None):
+        """Stop the workers (and don't replace them)."""
+        self.stopping = True
+        self.forward(signal.SIGTERM)
+
+    def run(self, workers: int):
+        """Start the workers and wait for them, the dead workers are replaced until stopped."""
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+
+        # The workers reload their settings
+        signal.signal(signal.SIGHUP, self.forward)
+
+        for index in range(workers):
+            self.spawn(index)
+
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+
+            index = self.children.pop(pid, None)
+
+            # Live gauges of the dead worker (queue depth, ...) leave the aggregated metrics
+            if MULTIPROC_ENV in os.environ:
+                multiprocess.mark_process_dead(pid)
+
+            if index is not None and not self.stopping:
+                logger.warning(f"Worker {index} (pid: {pid}) exited with status {os.waitstatus_to_exitcode(status)}, restarting it")
+                time.sleep(1)
+                self.spawn(index)
+
+        logger.info("All the workers are stopped")
+
+
+def serve_prefork(
+    app: str,
+    host: str = "localhost",
+    port: int = 8000,
+    workers: int = 2,
+    log_level: str = "critical",
+):
+    """
+    Build the application once, then fork the workers sharing it (copy-on-write).
+
+    Notes:
+        Uvicorn workers import and build the application in each process, the imports
+        (gradio, haystack) and the indexes are paid and kept in memory once per worker.
+        Here the parent process builds the application and binds the socket, the forked
+        workers serve the same socket. A worker that dies is replaced, SIGHUP is
+        forwarded to the workers (settings reload).
+
+    Args:
+        app (str): Application to serve ('module:attribute')
+        host (str): Host IP address of the server
+        port (int): Port number of host server
+        workers (int): Number of worker processes
+        log_level (str): Logging level of uvicorn
+
+    """
+    import uvicorn
+    from uvicorn.importer import import_from_string
+
+    with timed("build"):
+        application = import_from_string(app)
+
+    config = uvicorn.Config(application, host=host, port=port, log_level=log_level)
+    sock = config.bind_socket()
+
+    # Objects of the parent are never collected, the collector won't touch (copy) their pages
+    gc.collect()
+    gc.freeze()
+
+    try:
+        Supervisor(config, sock).run(workers)
+    finally:
+        sock.close()
@@ -1,6 +1,26 @@
+import re
 from functools import lru_cache
+from typing import List
 
-from needle import STATIC_PATH, TEMPLATE_PATH
+from needle import STATIC_PATH
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split a text into lowercase word tokens
+
+    Args:
+    ----
+        text (str): Text to split
+
+    Returns:
+    -------
+        List[str]: Lowercase word tokens
+
+    """
+    return TOKEN_PATTERN.findall(text.lower())
 
 
 @lru_cache(maxsize=128)
@@ -45,24 +65,3 @@ def load_html(filename: str) -> str:
         raise FileNotFoundError(f"HTML file not found: '{path}'")
 
     return path.read_text()
-
-
-def load_template(filename: str) -> str:
-    """
-    Load the template file from the static folder
-
-    Args:
-    ----
-        filename (str): Template filename
-
-    Returns:
-    -------
-        str: Template content
-
-    """
-    path = TEMPLATE_PATH / f"{filename}.jinja2"
-
-    if not path.exists():
-        raise FileNotFoundError(f"Template file not found: '{path}'")
-
-    return path.read_text()
@@ -0,0 +1,197 @@
+import os
+from functools import cached_property
+from pathlib import Path
+from typing import Optional, Tuple, Union
+
+import numpy as np
+from loguru import logger
+
+# Rows scored at once (bounds the memory of the scores of a block: rows x lists)
+BLOCK_SIZE = 8192
+
+
+def get_top_k(scores: np.ndarray, top_k: int) -> np.ndarray:
+    """Positions of the `top_k` best scores, sorted by decreasing score."""
+    top_k = min(top_k, len(scores))
+
+    if top_k <= 0:
+        return np.zeros(0, dtype=np.int64)
+
+    best = np.argpartition(-scores, top_k - 1)[:top_k]
+    return best[np.argsort(-scores[best], kind="stable")]
+
+
+def exact_search(matrix: np.ndarray, query: np.ndarray, top_k: int = 5) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Score every vector of the matrix against the query (brute-force, by blocks of rows).
+
+    Args:
+        matrix (np.ndarray): Normalized vectors (N x D, memory-mapped or not)
+        query (np.ndarray): Normalized query vector (D)
+        top_k (int): Maximum number of vectors to return
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Rows and cosine similarities of the best vectors (decreasing)
+
+    """
+    query = np.asarray(query, dtype=np.float32)
+    scores = np.empty(len(matrix), dtype=np.float32)
+
+    for start in range(0, len(matrix), BLOCK_SIZE):
+        scores[start : start + BLOCK_SIZE] = matrix[start : start + BLOCK_SIZE] @ query
+
+    best = get_top_k(scores, top_k)
+    return best, scores[best]
+
+
+def assign(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Closest centroid (cosine) of each vector, computed by blocks of rows."""
+    assignments = np.empty(len(vectors), dtype=np.int32)
+
+    for start in range(0, len(vectors), BLOCK_SIZE):
+        block = np.asarray(vectors[start : start + BLOCK_SIZE], dtype=np.float32)
+        assignments[start : start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+
+    return assignments
+
+
+def train_centroids(vectors: np.ndarray, lists: int, iterations: int = 10, sample_size: int = 256, seed: int = 0) -> np.ndarray:
+    """
+    Cluster the vectors with the spherical k-means (trained on a sample).
+
+    Args:
+        vectors (np.ndarray): Normalized vectors (N x D)
+        lists (int): Number of clusters
+        iterations (int): Number of k-means iterations
+        sample_size (int): Vectors sampled per cluster for the training
+        seed (int): Seed of the sampling (same clusters for the same vectors)
+
+    Returns:
+        np.ndarray: Normalized centroids (lists x D, float32)
+
+    """
+    rng = np.random.default_rng(seed)
+    size = min(len(vectors), lists * sample_size)
+    sample = np.asarray(vectors[np.sort(rng.choice(len(vectors), size, replace=False))], dtype=np.float32)
+    centroids = sample[rng.choice(len(sample), lists, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignments = assign(sample, centroids)
+        counts = np.bincount(assignments, minlength=lists)
+
+        # Sum of the vectors of each cluster (grouped by cluster)
+        order = np.argsort(assignments, kind="stable")
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        filled = counts > 0
+        centroids[filled] = np.add.reduceat(sample[order], starts[filled], axis=0)
+
+        # Empty clusters restart from random vectors
+        centroids[~filled] = sample[rng.choice(len(sample), int((~filled).sum()), replace=False)]
+        centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+
+    return centroids
+
+
+class IVFIndex:
+    """
+    Inverted file index of normalized vectors (approximate nearest neighbours search).
+
+    Notes:
+        The vectors are clustered by k-means, a query only scores the vectors of the `probes`
+        clusters closest to it instead of every vector: the latency and the recall grow with
+        the number of probes (all the lists is an exact search). The index only stores the rows
+        of each list, the vectors are read from the embedding matrix (no second copy).
+
+    Layout:
+        ivf_centroids.npy: Centroid of each list (float32, size L x D)
+        ivf_offsets.npy: Start of the rows of each list (int64, size L + 1)
+        ivf_rows.npy: Rows of the matrix grouped by list (int32, size N)
+
+    Args:
+        path (Union[str, os.PathLike]): Directory of the index
+
+    """
+
+    def __init__(self, path: Union[str, os.PathLike]):
+        self.path = Path(path)
+
+        if not (self.path / "ivf_centroids.npy").exists():
+            raise FileNotFoundError(f"IVF index not found at: '{self.path}'")
+
+    @cached_property
+    def centroids(self) -> np.ndarray:
+        """Centroid of each list (loaded in memory, scored by every query)."""
+        return np.load(self.path / "ivf_centroids.npy")
+
+    @cached_property
+    def offsets(self) -> np.ndarray:
+        """Start of the rows of each list."""
+        return np.load(self.path / "ivf_offsets.npy", mmap_mode="r")
+
+    @cached_property
+    def rows(self) -> np.ndarray:
+        """Rows of the matrix grouped by list."""
+        return np.load(self.path / "ivf_rows.npy", mmap_mode="r")
+
+    @classmethod
+    def build(
+        cls,
+        matrix: np.ndarray,
+        path: Union[str, os.PathLike],
+        lists: Optional[int] = None,
+        iterations: int = 10,
+    ) -> "IVFIndex":
+        """
+        Cluster the vectors of a matrix and save the lists.
+
+        Args:
+            matrix (np.ndarray): Normalized vectors (N x D)
+            path (Union[str, os.PathLike]): Directory of the index
+            lists (Optional[int]): Number of lists (about 4 x sqrt(N) if None)
+            iterations (int): Number of k-means iterations
+
+        Returns:
+            IVFIndex: The saved index
+
+        """
+        path = Path(path)
+        lists = lists or int(4 * np.sqrt(len(matrix)))
+        lists = max(1, min(lists, len(matrix)))
+
+        centroids = train_centroids(matrix, lists, iterations=iterations) if len(matrix) else np.zeros((1, matrix.shape[1]), np.float32)
+        assignments = assign(matrix, centroids)
+
+        rows = np.argsort(assignments, kind="stable").astype(np.int32)
+        offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(assignments, minlength=len(centroids)))
+
+        np.save(path / "ivf_centroids.npy", centroids)
+        np.save(path / "ivf_offsets.npy", offsets)
+        np.save(path / "ivf_rows.npy", rows)
+
+        logger.info(f"IVF index of {len(matrix)} vectors ({len(centroids)} lists) at: '{path}'")
+        return cls(path)
+
+    def search(self, matrix: np.ndarray, query: np.ndarray, top_k: int = 5, probes: int = 8) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Score the vectors of the lists closest to the query.
+
+        Args:
+            matrix (np.ndarray): Normalized vectors indexed (N x D)
+            query (np.ndarray): Normalized query vector (D)
+            top_k (int): Maximum number of vectors to return
+            probes (int): Number of lists scored (recall and latency knob)
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Rows and cosine similarities of the best vectors (decreasing)
+
+        """
+        query = np.asarray(query, dtype=np.float32)
+        probed = get_top_k(self.centroids @ query, probes)
+
+        # Rows read in order from the memory-mapped matrix
+        rows = np.sort(np.concatenate([self.rows[self.offsets[list_] : self.offsets[list_ + 1]] for list_ in probed]))
+        scores = (matrix[rows] @ query).astype(np.float32)
+
+        best = get_top_k(scores, top_k)
+        return rows[best], scores[best]
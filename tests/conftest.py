@@ -0,0 +1,20 @@
+import pytest
+
+
+class Clock:
+    """Wall clock of the tested module, moved forward by the tests."""
+
+    def __init__(self, now: float = 1_000_000):
+        self.now = now
+
+    def __call__(self) -> float:
+        """Current time (seconds)."""
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    """Replace `time.time` by a clock moved forward by the test."""
+    clock = Clock()
+    monkeypatch.setattr("time.time", clock)
+    return clock
@@ -0,0 +1,61 @@
+from needle.cache import ResponseCache, make_key
+
+
+def test_exact_hit(tmp_path, clock):
+    """A prompt gets its cached response, another prompt misses."""
+    cache = ResponseCache(tmp_path / "cache.sqlite3")
+    cache.set(make_key("system", "model", "prompt"), "namespace", "question", "response")
+
+    assert cache.get(make_key("system", "model", "prompt"), "namespace", "question") == "response"
+    assert cache.get(make_key("system", "model", "other"), "namespace", "other question") is None
+
+
+def test_ttl(tmp_path, clock):
+    """A response older than the TTL is expired."""
+    cache = ResponseCache(tmp_path / "cache.sqlite3", ttl=60)
+    cache.set("key", "namespace", "question", "response")
+
+    clock.now += 59
+    assert cache.get("key", "namespace", "question") == "response"
+
+    clock.now += 2
+    assert cache.get("key", "namespace", "question") is None
+    assert cache.connection.execute("SELECT COUNT(*) FROM responses").fetchone() == (0,)
+
+
+def test_lru_eviction(tmp_path, clock):
+    """The least recently used response is evicted beyond the maximum size."""
+    cache = ResponseCache(tmp_path / "cache.sqlite3", max_entries=2)
+
+    cache.set("first", "namespace", "first question", "first response")
+    clock.now += 1
+    cache.set("second", "namespace", "second question", "second response")
+
+    # The first response is used again, the second one becomes the least recently used
+    clock.now += 1
+    assert cache.get("first", "namespace", "first question") == "first response"
+
+    clock.now += 1
+    cache.set("third", "namespace", "third question", "third response")
+
+    assert cache.get("first", "namespace", "first question") == "first response"
+    assert cache.get("second", "namespace", "second question") is None
+    assert cache.get("third", "namespace", "third question") == "third response"
+
+
+def test_similarity_hit(tmp_path, clock):
+    """A question close to a cached question gets its response (same namespace only)."""
+    cache = ResponseCache(tmp_path / "cache.sqlite3", similarity_threshold=0.6)
+    cache.set("key", "namespace", "how do I reset my account password", "response")
+
+    assert cache.get("other", "namespace", "how do I reset my account password please") == "response"
+    assert cache.get("other", "other namespace", "how do I reset my account password please") is None
+    assert cache.get("other", "namespace", "what is the weather today") is None
+
+
+def test_similarity_disabled(tmp_path, clock):
+    """Without threshold, only the exact key is a hit."""
+    cache = ResponseCache(tmp_path / "cache.sqlite3")
+    cache.set("key", "namespace", "how do I reset my account password", "response")
+
+    assert cache.get("other", "namespace", "how do I reset my account password") is None
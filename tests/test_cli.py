@@ -0,0 +1,29 @@
+import json
+import os
+
+from typer.testing import CliRunner
+
+import needle
+from needle.cli import cli
+from needle.config import CONFIG_ENV, CONFIG_FILE_ENV
+
+
+def test_start_forwards_options(monkeypatch):
+    """The options of 'start' given by environment variables reach the settings of the workers."""
+    launches = []
+
+    monkeypatch.setattr("needle.cli.launch_app", lambda **kwargs: launches.append(kwargs))
+    monkeypatch.setattr(needle, "settings", needle.settings)
+    monkeypatch.delenv(CONFIG_ENV, raising=False)
+    monkeypatch.delenv(CONFIG_FILE_ENV, raising=False)
+
+    env = {"ENVIRONMENT": "development", "INDEX_PATH": "/srv/index", "CACHE": "1", "METRICS_PORT": "9100"}
+    result = CliRunner().invoke(cli, ["start", "--top-k", "3"], env=env)
+
+    assert result.exit_code == 0, result.output
+
+    settings = json.loads(os.environ[CONFIG_ENV])
+    assert settings["index_path"] == "/srv/index"
+    assert settings["cache"] is True
+    assert settings["top_k"] == 3
+    assert launches[0]["metrics_port"] == 9100
@@ -0,0 +1,88 @@
+import pytest
+
+from needle.config import CONFIG_ENV, CONFIG_FILE_ENV, Config
+from needle.ratelimit import hash_api_key
+
+
+def test_default_settings_valid():
+    """The default settings are valid."""
+    Config().validate()
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        {"max_concurrency": 0},
+        {"max_queue_size": -1},
+        {"retrieval": "keywords"},
+        {"log_level": "VERBOSE"},
+        {"cache_similarity": 1.5},
+        {"api_keys": ["secret"]},
+        {"log_sample_rates": {"/app/assets": 2}},
+        {"fallback_routes": [{"name": "no model"}]},
+        {"fallback_routes": [{"model": "gpt-4o", "api_key": "secret"}]},
+        {"model_concurrency": {"gpt-4o-mini": 0}},
+        {"fallback_routes": [{"model": "gpt-4o"}], "model_concurrency": {"gpt-4o": 8}},
+    ],
+)
+def test_invalid_settings(data):
+    """An invalid value is rejected."""
+    with pytest.raises(ValueError):
+        Config.from_dict(data)
+
+
+def test_valid_settings():
+    """Optional settings are disabled by None, zero is accepted by the non-negative settings."""
+    settings = Config.from_dict(
+        {
+            "max_queue_size": 0,
+            "rate_limit": None,
+            "api_keys": [hash_api_key("secret")],
+            "fallback_routes": [{"model": "gpt-4o", "name": "backup"}],
+            "model_concurrency": {"gpt-4o-mini": 8},
+        }
+    )
+
+    assert settings.max_queue_size == 0
+    assert settings.model_concurrency == {"gpt-4o-mini": 8}
+
+
+def test_unknown_setting():
+    """An unknown setting is rejected."""
+    with pytest.raises(ValueError, match="Unknown settings"):
+        Config.from_dict({"max_concurency": 8})
+
+
+def test_from_env_default(monkeypatch):
+    """Without environment variables, the default settings are used."""
+    monkeypatch.delenv(CONFIG_ENV, raising=False)
+    monkeypatch.delenv(CONFIG_FILE_ENV, raising=False)
+
+    assert Config.from_env() == Config()
+
+
+def test_from_env_file_precedence(monkeypatch, tmp_path):
+    """The values of the settings file take precedence over the settings of the CLI."""
+    path = tmp_path / "config.toml"
+    path.write_text('model_name = "gpt-4o"\nmax_concurrency = 4\n')
+
+    monkeypatch.setenv(CONFIG_ENV, Config(model_name="gpt-4o-mini", top_k=3).to_json())
+    monkeypatch.setenv(CONFIG_FILE_ENV, str(path))
+
+    settings = Config.from_env()
+
+    assert settings.model_name == "gpt-4o"
+    assert settings.max_concurrency == 4
+    assert settings.top_k == 3
+
+
+def test_from_env_invalid_file(monkeypatch, tmp_path):
+    """An invalid value of the settings file is rejected."""
+    path = tmp_path / "config.toml"
+    path.write_text("top_k = 0\n")
+
+    monkeypatch.delenv(CONFIG_ENV, raising=False)
+    monkeypatch.setenv(CONFIG_FILE_ENV, str(path))
+
+    with pytest.raises(ValueError):
+        Config.from_env()
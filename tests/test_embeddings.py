@@ -0,0 +1,101 @@
+import numpy as np
+import pytest
+from haystack import Document
+
+from needle.embeddings import EmbeddingCache, EmbeddingIndex
+
+
+class Embedder:
+    """Embedding model giving a vector of the characters of each text, recording its batches."""
+
+    model = "embedder"
+
+    def __init__(self, dimension: int = 8):
+        self.dimension = dimension
+        self.batches = []
+
+    def embed(self, texts):
+        """Embed a batch of texts."""
+        self.batches.append(list(texts))
+        vectors = np.zeros((len(texts), self.dimension), dtype=np.float32)
+
+        for row, text in enumerate(texts):
+            for character in text:
+                vectors[row, ord(character) % self.dimension] += 1
+
+        return vectors + 0.5
+
+
+def make_documents(*texts: str):
+    """Documents of the texts."""
+    return [Document(content=text) for text in texts]
+
+
+def test_batches(tmp_path):
+    """The texts are embedded by batches of `batch_size`."""
+    embedder = Embedder()
+    EmbeddingIndex.build(make_documents(*"abcdefg"), tmp_path, embedder, batch_size=3)
+
+    assert [len(batch) for batch in embedder.batches] == [3, 3, 1]
+
+
+def test_duplicates_embedded_once(tmp_path):
+    """The chunks with the same text are embedded once, and have the same row."""
+    embedder = Embedder()
+    index = EmbeddingIndex.build(make_documents("a", "b", "a", "a"), tmp_path, embedder)
+
+    assert embedder.batches == [["a", "b"]]
+    assert np.array_equal(index.matrix[0], index.matrix[2])
+    assert np.array_equal(index.matrix[0], index.matrix[3])
+
+
+def test_cache_hits_on_rebuild(tmp_path):
+    """A corpus ingested again only embeds the chunks missing from the cache."""
+    cache = EmbeddingCache(tmp_path / "cache.sqlite3")
+    first = EmbeddingIndex.build(make_documents("a", "b"), tmp_path, Embedder(), cache=cache)
+    expected = np.array(first.matrix[0])
+
+    embedder = Embedder()
+    second = EmbeddingIndex.build(make_documents("a", "b", "c"), tmp_path, embedder, cache=cache)
+
+    assert embedder.batches == [["c"]]
+    assert np.array_equal(second.matrix[0], expected)
+
+
+@pytest.mark.parametrize("dtype", ["float32", "float16"])
+def test_memmap_matrix(tmp_path, dtype):
+    """The matrix is memory-mapped, one normalized row of the given type per document."""
+    EmbeddingIndex.build(make_documents("abc", "de", "f"), tmp_path, Embedder(dimension=8), dtype=dtype)
+    index = EmbeddingIndex(tmp_path)
+
+    assert isinstance(index.matrix, np.memmap)
+    assert index.matrix.shape == (3, 8)
+    assert index.matrix.dtype == np.dtype(dtype)
+    assert np.allclose(np.linalg.norm(index.matrix.astype(np.float32), axis=1), 1, atol=1e-3)
+    assert index.info == {"model": "embedder", "backend": "openai", "dimension": 8, "dtype": dtype, "count": 3}
+    assert not (tmp_path / "embeddings.tmp.npy").exists()
+
+
+def test_search(tmp_path):
+    """A query finds the document of its text, with and without the IVF index."""
+    documents = make_documents(*(chr(ord("a") + index) * (index + 1) for index in range(20)))
+    embedder = Embedder(dimension=32)
+    query = embedder.embed(["ccc"])[0]
+    (tmp_path / "exact").mkdir()
+    (tmp_path / "ivf").mkdir()
+
+    exact = EmbeddingIndex.build(documents, tmp_path / "exact", embedder)
+    approximate = EmbeddingIndex.build(documents, tmp_path / "ivf", embedder, ann_index=True, ann_lists=4)
+
+    assert exact.ivf is None and approximate.ivf is not None
+    assert exact.search(query, top_k=1)[0].tolist() == [2]
+    assert approximate.search(query, top_k=1, probes=4)[0].tolist() == [2]
+
+
+def test_invalid_options(tmp_path):
+    """The type and batch size of the embeddings are checked."""
+    with pytest.raises(ValueError):
+        EmbeddingIndex.build(make_documents("a"), tmp_path, Embedder(), dtype="int8")
+
+    with pytest.raises(ValueError):
+        EmbeddingIndex.build(make_documents("a"), tmp_path, Embedder(), batch_size=0)
@@ -0,0 +1,126 @@
+import asyncio
+import json
+from dataclasses import asdict
+from types import SimpleNamespace
+
+import pytest
+
+from needle.evaluation import EvalItem, EvalResult, Evaluator, get_scores, load_checkpoint
+
+
+class LLM:
+    """Component of the LLM answering with the prompt, failing on the questions given."""
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.prompts = []
+
+    async def run_async(self, prompt):
+        """Answer the prompt."""
+        return self.run(prompt)
+
+    def run(self, prompt):
+        """Answer the prompt (blocking)."""
+        self.prompts.append(prompt)
+
+        if prompt in self.failing:
+            raise TimeoutError(prompt)
+
+        return {"replies": [f"answer {prompt}"], "meta": [{"usage": {"prompt_tokens": 3, "completion_tokens": 2}}]}
+
+
+def make_engine(model_name: str, llm: LLM):
+    """Chat engine of a model (the prompt is the question)."""
+    pipeline = SimpleNamespace(get_component=lambda name: llm)
+    return SimpleNamespace(model_name=model_name, chat_pipeline=pipeline, render=lambda question, history: (question, []))
+
+
+def make_evaluator(path, llm: LLM, mode: str = "async") -> Evaluator:
+    """Evaluator of the fake engines."""
+    evaluator = Evaluator(settings=None, output=path, concurrency=2, mode=mode)
+    evaluator.get_engine = lambda model_name, template: make_engine(model_name, llm)
+    return evaluator
+
+
+ITEMS = [EvalItem(id=str(index), question=f"q{index}", expected=[f"answer q{index}"]) for index in range(4)]
+
+
+@pytest.mark.parametrize(
+    ("response", "expected", "scores"),
+    [
+        ("Paris.", ["paris"], {"exact_match": 1.0, "contains": 1.0, "f1": 1.0}),
+        ("It is Paris, France", ["Paris"], {"exact_match": 0.0, "contains": 1.0, "f1": 0.4}),
+        ("France Paris", ["Paris France"], {"exact_match": 0.0, "contains": 0.0, "f1": 1.0}),
+        ("London", ["Paris"], {"exact_match": 0.0, "contains": 0.0, "f1": 0.0}),
+        ("", ["Paris"], {"exact_match": 0.0, "contains": 0.0, "f1": 0.0}),
+        ("the city of Paris", ["Lyon", "Paris"], {"exact_match": 0.0, "contains": 1.0, "f1": 0.4}),
+    ],
+)
+def test_get_scores(response, expected, scores):
+    """The words are compared without case and punctuation, the best accepted answer wins."""
+    assert get_scores(response, expected) == pytest.approx(scores)
+
+
+def test_get_scores_no_answer():
+    """A question without accepted answer isn't scored."""
+    assert get_scores("Paris", []) == {}
+
+
+def test_load_checkpoint_truncated(tmp_path):
+    """The line truncated by an interruption is ignored, the last result of a question wins."""
+    path = tmp_path / "results.jsonl"
+    failed = EvalResult("model", "template", "0", ok=False, latency=0, error="TimeoutError()")
+    answered = EvalResult("model", "template", "0", ok=True, latency=1, response="answer")
+    lines = [json.dumps(asdict(failed)), json.dumps(asdict(answered)), json.dumps(asdict(answered))[:20]]
+    path.write_text("\n".join(lines))
+
+    assert load_checkpoint(path) == {("model", "template", "0"): answered}
+
+
+@pytest.mark.parametrize("mode", ["async", "thread"])
+def test_run(tmp_path, mode):
+    """Each question is answered and scored for each model and template."""
+    llm = LLM()
+    evaluator = make_evaluator(tmp_path / "results.jsonl", llm, mode=mode)
+
+    summary = asyncio.run(evaluator.run(ITEMS, ["a", "b"], ["template"]))
+
+    assert sorted(summary) == ["a/template", "b/template"]
+    assert summary["a/template"]["questions"] == 4
+    assert summary["a/template"]["exact_match"] == 1.0
+    assert summary["a/template"]["prompt_tokens"] == 12
+    assert len(llm.prompts) == 8
+
+
+def test_resume_partial_checkpoint(tmp_path):
+    """A run started again replays the missing and failed questions only, after the truncated line."""
+    path = tmp_path / "results.jsonl"
+
+    # Interrupted run: 'q1' failed, 'q3' never answered, the last line truncated
+    asyncio.run(make_evaluator(path, LLM(failing={"q1"})).run(ITEMS[:3], ["model"], ["template"]))
+    path.write_text(path.read_text() + '{"model": "model", "templ')
+
+    llm = LLM()
+    evaluator = make_evaluator(path, llm)
+    summary = asyncio.run(evaluator.run(ITEMS, ["model"], ["template"]))
+
+    assert sorted(llm.prompts) == ["q1", "q3"]
+    assert summary["model/template"]["questions"] == 4
+    assert summary["model/template"]["errors"] == 0
+
+    results = load_checkpoint(path)
+    assert all(results[("model", "template", item.id)].ok for item in ITEMS)
+
+    # The truncated line is terminated, the new results are on their own lines
+    lines = path.read_text().splitlines()
+    assert lines[3] == '{"model": "model", "templ'
+    assert [json.loads(line)["id"] for line in lines[4:]] in (["1", "3"], ["3", "1"])
+
+
+def test_invalid_options(tmp_path):
+    """The mode and concurrency of the evaluation are checked."""
+    with pytest.raises(ValueError):
+        Evaluator(settings=None, output=tmp_path / "results.jsonl", mode="process")
+
+    with pytest.raises(ValueError):
+        Evaluator(settings=None, output=tmp_path / "results.jsonl", concurrency=0)
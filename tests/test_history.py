@@ -0,0 +1,56 @@
+import pytest
+
+from needle.history import MESSAGE_OVERHEAD, TokenCounter, trim_history
+
+
+@pytest.fixture
+def counter() -> TokenCounter:
+    """Token counter counting the words of the texts."""
+    counter = TokenCounter("gpt-4o-mini")
+    counter.encode = str.split
+    return counter
+
+
+def make_turn(question: str, response: str):
+    """Messages of a conversation turn."""
+    return [{"role": "user", "content": question}, {"role": "assistant", "content": response}]
+
+
+def test_history_fits(counter):
+    """A history within the budget is kept whole."""
+    history = make_turn("one two", "three") + make_turn("four", "five six")
+
+    assert trim_history(history, budget=100, counter=counter) == history
+
+
+def test_oldest_turns_dropped(counter):
+    """The oldest turns are dropped first."""
+    history = make_turn("one two three", "four five six") + make_turn("seven", "eight")
+    budget = 2 * (1 + MESSAGE_OVERHEAD)
+
+    assert trim_history(history, budget=budget, counter=counter) == history[2:]
+
+
+def test_turn_never_split(counter):
+    """A turn whose user message doesn't fit is dropped with its response."""
+    history = make_turn("one two three", "four") + make_turn("five", "six")
+
+    # The response of the first turn fits but not its question
+    budget = 3 * (1 + MESSAGE_OVERHEAD)
+
+    trimmed = trim_history(history, budget=budget, counter=counter)
+
+    assert trimmed == history[2:]
+    assert trimmed[0]["role"] == "user"
+
+
+def test_last_turn_too_long(counter):
+    """The history is empty when even the last turn doesn't fit."""
+    history = make_turn("one two three four five", "six")
+
+    assert trim_history(history, budget=5, counter=counter) == []
+
+
+def test_empty_history(counter):
+    """An empty history stays empty."""
+    assert trim_history([], budget=100, counter=counter) == []
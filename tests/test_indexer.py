@@ -0,0 +1,97 @@
+import os
+
+import pytest
+
+from needle.indexer import Indexer
+from needle.retrieval import GENERATIONS_DIR, BM25Index, get_generation_path
+
+
+@pytest.fixture
+def directory(tmp_path):
+    """Documents directory with two files."""
+    directory = tmp_path / "documents"
+    directory.mkdir()
+
+    (directory / "apples.txt").write_text("apples are red and sweet fruits")
+    (directory / "rivers.md").write_text("rivers flow from the mountains to the sea")
+
+    return directory
+
+
+def get_contents(index_path) -> dict:
+    """Contents of the chunks of the current generation, by file."""
+    contents = {}
+
+    for document in BM25Index(get_generation_path(index_path)).iter_documents():
+        contents.setdefault(document.meta["file_path"], []).append(document.content)
+
+    return contents
+
+
+def test_add_change_delete(directory, tmp_path):
+    """Each change of the directory publishes a new generation with the chunks of the files."""
+    index_path = tmp_path / "index"
+    indexer = Indexer(directory, index_path, chunk_size=50, chunk_overlap=0)
+
+    first = indexer.update()
+    assert first is not None
+    assert get_contents(index_path) == {
+        "apples.txt": ["apples are red and sweet fruits"],
+        "rivers.md": ["rivers flow from the mountains to the sea"],
+    }
+
+    # Added file
+    (directory / "stars.txt").write_text("stars shine in the night sky")
+    second = indexer.update()
+    assert second is not None and second != first
+    assert set(get_contents(index_path)) == {"apples.txt", "rivers.md", "stars.txt"}
+
+    # Changed file
+    (directory / "apples.txt").write_text("apples are green and sour fruits")
+    indexer.update()
+    assert get_contents(index_path)["apples.txt"] == ["apples are green and sour fruits"]
+
+    # Deleted file
+    (directory / "rivers.md").unlink()
+    indexer.update()
+    assert get_contents(index_path) == {
+        "apples.txt": ["apples are green and sour fruits"],
+        "stars.txt": ["stars shine in the night sky"],
+    }
+
+    # The new chunks are searchable
+    documents = BM25Index(get_generation_path(index_path)).query("green apples", top_k=1)
+    assert documents[0].meta["file_path"] == "apples.txt"
+
+
+def test_touched_file(directory, tmp_path):
+    """A file touched without change doesn't publish a new generation."""
+    indexer = Indexer(directory, tmp_path / "index")
+    indexer.update()
+
+    path = directory / "apples.txt"
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+    assert indexer.update() is None
+    assert indexer.update() is None
+
+
+def test_continue_from_current_generation(directory, tmp_path):
+    """A new indexer continues from the current generation, other options rebuild the index."""
+    index_path = tmp_path / "index"
+    Indexer(directory, index_path).update()
+
+    assert Indexer(directory, index_path).update() is None
+    assert Indexer(directory, index_path, chunk_size=100).update() is not None
+
+
+def test_previous_generations_removed(directory, tmp_path):
+    """Only the `keep` previous generations are kept."""
+    index_path = tmp_path / "index"
+    indexer = Indexer(directory, index_path, keep=1)
+
+    for _ in range(4):
+        indexer.update(rebuild=True)
+
+    assert len(list((index_path / GENERATIONS_DIR).iterdir())) == 2
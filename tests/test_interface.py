@@ -0,0 +1,92 @@
+import asyncio
+from types import SimpleNamespace
+
+from needle.interface import clear, echo, retry, undo
+from needle.sessions import SessionStore
+
+
+# Request of a Gradio event (session of the conversation)
+REQUEST = SimpleNamespace(session_hash="session", headers={}, client=None)
+
+
+class Engine:
+    """Chat engine answering with the question, recording the history it was given."""
+
+    model_name = "model"
+    template_name = "system"
+
+    def __init__(self):
+        self.histories = []
+
+    def get_client_id(self, headers, host):
+        """Identifier of the client."""
+        return "client"
+
+    async def stream(self, message, history, **kwargs):
+        """Stream the response."""
+        self.histories.append(list(history))
+        yield f"answer {message}"
+
+
+def make_turn(question: str, response: str):
+    """Messages of a conversation turn."""
+    return [{"role": "user", "content": question}, {"role": "assistant", "content": response}]
+
+
+def send(engine: Engine, sessions: SessionStore, message: str, history: list) -> str:
+    """Send a chat event, return the last response."""
+
+    async def main():
+        return [response async for response in echo(message, history, None, REQUEST, engine, sessions)][-1]
+
+    return asyncio.run(main())
+
+
+def test_echo_history_from_store():
+    """The chat event takes the messages from the store, the chatbot only gives the position."""
+    engine, sessions = Engine(), SessionStore()
+
+    send(engine, sessions, "one", [])
+    send(engine, sessions, "two", make_turn("forged", "forged"))
+
+    assert engine.histories[-1] == make_turn("one", "answer one")
+    assert sessions.get("session") == make_turn("one", "answer one") + make_turn("two", "answer two")
+
+
+def test_echo_session_lost():
+    """A conversation missing from the store (expired, evicted, other worker) is restored from the chatbot."""
+    engine, sessions = Engine(), SessionStore()
+    history = make_turn("one", "answer one")
+
+    send(engine, sessions, "two", history)
+
+    assert engine.histories[-1] == history
+    assert sessions.get("session") == history + make_turn("two", "answer two")
+
+
+def test_undo_retry_clear():
+    """Undo, retry and clear send the history of the store back to the chatbot."""
+    engine, sessions = Engine(), SessionStore()
+
+    send(engine, sessions, "one", [])
+    send(engine, sessions, "two", make_turn("one", "answer one"))
+
+    async def callback_echo(*args, **kwargs):
+        async for response in echo(*args, engine=engine, sessions=sessions, **kwargs):
+            yield response
+
+    async def main():
+        return [update async for update in retry(None, REQUEST, callback_echo=callback_echo, sessions=sessions)]
+
+    updates = asyncio.run(main())
+    assert updates[-1]["value"][-2:] == [
+        {"role": "user", "content": "two"},
+        {"role": "assistant", "content": "answer two", "metadata": {"title": None}},
+    ]
+    assert engine.histories[-1] == make_turn("one", "answer one")
+
+    assert undo(REQUEST, sessions) == make_turn("one", "answer one")
+    assert sessions.get("session") == make_turn("one", "answer one")
+
+    assert clear(REQUEST, sessions) == []
+    assert sessions.get("session") == []
@@ -0,0 +1,39 @@
+import os
+import subprocess
+import sys
+
+from needle.config import MULTIPROC_ENV
+
+# Metrics page of the workers (same registry as '/metrics')
+SCRAPE = "from prometheus_client import generate_latest; from needle.metrics import get_registry; print(generate_latest(get_registry()).decode())"
+
+
+def run_python(code: str, env: dict) -> str:
+    """Run Python code in a new process (prometheus_client reads the metrics directory at import)."""
+    return subprocess.run([sys.executable, "-c", code], env=env, check=True, capture_output=True, text=True).stdout  # noqa: S603
+
+
+def test_counter_aggregated_across_processes(tmp_path):
+    """A counter incremented by two worker processes is summed on the metrics page."""
+    env = {**os.environ, MULTIPROC_ENV: str(tmp_path)}
+
+    for _ in range(2):
+        run_python("from needle.metrics import CACHE_HITS; CACHE_HITS.labels(layer='exact').inc()", env)
+
+    assert 'needle_cache_hits_total{layer="exact"} 2.0' in run_python(SCRAPE, env)
+
+
+def test_setup_multiprocess(tmp_path):
+    """The metrics directory is set before the first import of the metrics, the previous files are removed."""
+    path = tmp_path / "metrics"
+    path.mkdir()
+    (path / "counter_1.db").write_bytes(b"previous launch")
+
+    env = {key: value for key, value in os.environ.items() if key != MULTIPROC_ENV}
+    code = (
+        f"from needle.cli import setup_multiprocess; setup_multiprocess({str(path)!r}); from needle.metrics import CACHE_MISSES; CACHE_MISSES.inc()"
+    )
+    run_python(f"{code}; {SCRAPE}", env)
+
+    assert not (path / "counter_1.db").exists()
+    assert "needle_cache_misses_total 1.0" in run_python(SCRAPE, {**env, MULTIPROC_ENV: str(path)})
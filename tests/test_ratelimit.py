@@ -0,0 +1,88 @@
+import pytest
+
+from needle.ratelimit import RateLimiter, TooManyRequestsError, get_client_id, get_day_end, hash_api_key
+
+
+def test_client_id_accepted_key():
+    """An accepted API key identifies the client, whatever its address."""
+    api_keys = {hash_api_key("secret")}
+
+    first = get_client_id({"authorization": "Bearer secret"}, host="10.0.0.1", api_keys=api_keys)
+    second = get_client_id({"x-api-key": "secret"}, host="10.0.0.2", api_keys=api_keys)
+
+    assert first == second
+    assert "secret" not in first
+
+
+def test_client_id_unknown_key():
+    """An unknown API key isn't trusted, the client is identified by its address."""
+    api_keys = {hash_api_key("secret")}
+
+    assert get_client_id({"authorization": "Bearer random"}, host="10.0.0.1", api_keys=api_keys) == "10.0.0.1"
+    assert get_client_id({"authorization": "Bearer secret"}, host="10.0.0.1") == "10.0.0.1"
+    assert get_client_id({}) == "anonymous"
+
+
+def test_burst_then_refill(tmp_path, clock):
+    """A client can send `burst` requests at once, then `rate` requests per second."""
+    limiter = RateLimiter(tmp_path / "ratelimit.sqlite3", rate=1, burst=3)
+
+    for _ in range(3):
+        limiter.acquire("client")
+
+    with pytest.raises(TooManyRequestsError) as error:
+        limiter.acquire("client")
+
+    assert error.value.reason == "rate"
+    assert error.value.retry_after == pytest.approx(1)
+
+    # The buckets of the clients are independent
+    limiter.acquire("other")
+
+    clock.now += 1
+    limiter.acquire("client")
+
+
+def test_acquire_several_tokens(tmp_path, clock):
+    """A batch takes a token per chat turn, all or nothing."""
+    limiter = RateLimiter(tmp_path / "ratelimit.sqlite3", rate=1, burst=5)
+
+    limiter.acquire("client", 3)
+
+    with pytest.raises(TooManyRequestsError) as error:
+        limiter.acquire("client", 3)
+
+    assert error.value.retry_after == pytest.approx(1)
+
+    # The rejected batch didn't take any token
+    limiter.acquire("client", 2)
+
+
+def test_no_rate_limit(tmp_path, clock):
+    """Without rate, the requests are never rejected."""
+    limiter = RateLimiter(tmp_path / "ratelimit.sqlite3", rate=None)
+
+    for _ in range(100):
+        limiter.acquire("client")
+
+
+def test_daily_quota(tmp_path, clock):
+    """A client over its daily token quota is rejected until midnight (UTC)."""
+    limiter = RateLimiter(tmp_path / "ratelimit.sqlite3", rate=None, daily_quota=100)
+
+    limiter.charge("client", 60)
+    limiter.acquire("client")
+    limiter.charge("client", 60)
+
+    assert limiter.get_usage("client") == 120
+
+    with pytest.raises(TooManyRequestsError) as error:
+        limiter.acquire("client")
+
+    assert error.value.reason == "quota"
+    assert error.value.retry_after == pytest.approx(get_day_end(clock.now) - clock.now)
+
+    # The quota is reset the next day
+    clock.now = get_day_end(clock.now)
+    limiter.acquire("client")
+    assert limiter.get_usage("client") == 0
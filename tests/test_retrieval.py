@@ -0,0 +1,96 @@
+import threading
+import time
+from collections import deque
+
+from haystack import Document
+
+from needle.reranking import CrossEncoderReranker
+from needle.retrieval import reciprocal_rank_fusion
+
+
+class Encoder:
+    """Cross-encoder scoring a pair by the length of the document, taking `delay` seconds per pair."""
+
+    def __init__(self, delay: float = 0):
+        self.delay = delay
+        self.calls = 0
+
+    def predict(self, pairs, batch_size: int):
+        """Score the (query, document) pairs."""
+        self.calls += 1
+        time.sleep(self.delay * len(pairs))
+        return [len(document) for _, document in pairs]
+
+
+def get_reranker(encoder: Encoder, top_n: int = 20, batch_size: int = 2) -> CrossEncoderReranker:
+    """Reranker with a fake cross-encoder (sentence-transformers is an optional dependency)."""
+    reranker = object.__new__(CrossEncoderReranker)
+    reranker.model = "fake"
+    reranker.top_n = top_n
+    reranker.batch_size = batch_size
+    reranker.encoder = encoder
+    reranker.durations = deque(maxlen=100)
+    reranker.lock = threading.Lock()
+    return reranker
+
+
+def make_documents(*contents: str):
+    """Documents identified by their content."""
+    return [Document(id=content, content=content) for content in contents]
+
+
+def test_rrf_documents_of_several_rankings_first():
+    """A document found by both rankings comes before the first document of a single ranking."""
+    bm25 = make_documents("a", "b", "c")
+    vector = make_documents("d", "b", "e")
+
+    fused = reciprocal_rank_fusion([bm25, vector], k=60)
+
+    assert [document.id for document in fused] == ["b", "a", "d", "c", "e"]
+    assert fused[0].score == 2 / 62
+
+
+def test_rrf_ties_keep_first_ranking_order():
+    """Equal scores keep the order of the first ranking."""
+    fused = reciprocal_rank_fusion([make_documents("a", "b"), make_documents("c", "d")], k=60)
+
+    assert [document.id for document in fused] == ["a", "c", "b", "d"]
+
+
+def test_rrf_empty():
+    """No ranking, no document."""
+    assert reciprocal_rank_fusion([[], []]) == []
+
+
+def test_rerank_without_budget():
+    """The first `top_n` documents are reranked, the others keep their order after them."""
+    reranker = get_reranker(Encoder(), top_n=3)
+    documents = make_documents("aa", "a", "aaaa", "aaa", "aaaaa")
+
+    reranked = reranker.rerank("query", documents)
+
+    assert [document.id for document in reranked] == ["aaaa", "aa", "a", "aaa", "aaaaa"]
+
+
+def test_rerank_skipped_over_budget():
+    """The reranking is skipped when its expected duration doesn't fit in the budget."""
+    encoder = Encoder()
+    reranker = get_reranker(encoder)
+    reranker.durations.extend([0.01] * 10)
+    documents = make_documents("a", "aa", "aaa")
+
+    assert reranker.rerank("query", documents, budget=0.001) == documents
+    assert encoder.calls == 0
+
+
+def test_rerank_stopped_at_deadline():
+    """The reranking stops between two batches once the budget is spent."""
+    encoder = Encoder(delay=0.02)
+    reranker = get_reranker(encoder, batch_size=2)
+    documents = make_documents("a", "aa", "aaa", "aaaa", "aaaaa", "aaaaaa")
+
+    # No measure yet, the reranking starts and the first batch is over the budget
+    reranked = reranker.rerank("query", documents, budget=0.01)
+
+    assert encoder.calls == 1
+    assert [document.id for document in reranked] == ["aa", "a", "aaa", "aaaa", "aaaaa", "aaaaaa"]
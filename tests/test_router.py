@@ -0,0 +1,162 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+from haystack.dataclasses import StreamingChunk
+from openai import RateLimitError
+
+from needle.router import Route, RouterGenerator
+
+
+class Generator:
+    """Generator of a fake model (waits `delay` seconds, then fails or streams the tokens of its reply)."""
+
+    def __init__(self, model: str, delay: float = 0, error: BaseException = None, token_delay: float = 0):
+        self.model = model
+        self.delay = delay
+        self.error = error
+        self.token_delay = token_delay
+
+        self.calls = 0
+        self.cancelled = 0
+
+    async def run_async(self, prompt, system_prompt=None, streaming_callback=None, generation_kwargs=None):
+        """Answer the prompt with the name of the model."""
+        self.calls += 1
+
+        try:
+            await asyncio.sleep(self.delay)
+
+            if self.error is not None:
+                raise self.error
+
+            if streaming_callback is not None:
+                for token in ("answer", "of", self.model):
+                    streaming_callback(StreamingChunk(content=token))
+                    await asyncio.sleep(self.token_delay)
+
+            return {"replies": [f"answer of {self.model}"], "meta": [{"model": self.model}]}
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+
+    def run(self, prompt, system_prompt=None, streaming_callback=None, generation_kwargs=None):
+        """Answer the prompt (blocking)."""
+        return asyncio.run(self.run_async(prompt, system_prompt, streaming_callback, generation_kwargs))
+
+
+def make_rate_limit_error(retry_after: str = None) -> RateLimitError:
+    """Rate limit error of the OpenAI client (HTTP 429)."""
+    headers = {} if retry_after is None else {"retry-after": retry_after}
+    response = httpx.Response(429, headers=headers, request=httpx.Request("POST", "http://llm/v1/chat/completions"))
+    return RateLimitError("Rate limit reached", response=response, body=None)
+
+
+def test_failover_on_error():
+    """A retryable failure of the best route is sent to the next route."""
+    failing, backup = Generator("failing", error=TimeoutError()), Generator("backup")
+    router = RouterGenerator([Route(failing), Route(backup)])
+
+    result = asyncio.run(router.run_async("prompt"))
+
+    assert result["replies"] == ["answer of backup"]
+    assert failing.calls == 1
+    assert router.routes[0].error_rate > 0
+
+
+def test_failover_blocking():
+    """The blocking call fails over too."""
+    router = RouterGenerator([Route(Generator("failing", error=TimeoutError())), Route(Generator("backup"))])
+
+    assert router.run("prompt")["replies"] == ["answer of backup"]
+
+
+def test_no_failover_on_invalid_request():
+    """A failure that another route would repeat (invalid request) is raised at once."""
+    backup = Generator("backup")
+    router = RouterGenerator([Route(Generator("failing", error=ValueError("invalid prompt"))), Route(backup)])
+
+    with pytest.raises(ValueError):
+        asyncio.run(router.run_async("prompt"))
+
+    assert backup.calls == 0
+
+
+def test_last_route_error_raised():
+    """The failure of the last route is raised."""
+    router = RouterGenerator([Route(Generator("first", error=TimeoutError())), Route(Generator("second", error=TimeoutError()))])
+
+    with pytest.raises(TimeoutError):
+        asyncio.run(router.run_async("prompt"))
+
+
+@pytest.mark.parametrize(("retry_after", "cooldown"), [("30", 30), (None, 10)])
+def test_cooldown_after_rate_limit(retry_after, cooldown):
+    """A rate limited route isn't used until its cooldown ends ('Retry-After', or the default cooldown)."""
+    limited, backup = Generator("limited", error=make_rate_limit_error(retry_after)), Generator("backup")
+    router = RouterGenerator([Route(limited, cooldown=10), Route(backup)])
+
+    assert asyncio.run(router.run_async("prompt"))["replies"] == ["answer of backup"]
+    assert router.routes[0].unavailable_until == pytest.approx(time.monotonic() + cooldown, abs=1)
+
+    # The next prompts skip the rate limited route
+    asyncio.run(router.run_async("prompt"))
+    assert limited.calls == 1
+    assert router.rank("prompt") == [router.routes[1]]
+
+    # Back once the cooldown ends (after the backup, its error rate is higher)
+    router.routes[0].unavailable_until = 0
+    assert router.rank("prompt") == [router.routes[1], router.routes[0]]
+
+
+def test_hedged_call_cancels_slow_call():
+    """A slow call is hedged on the next route, the first to stream a token wins and the other is cancelled."""
+    slow, fast = Generator("slow", delay=1), Generator("fast")
+    router = RouterGenerator([Route(slow), Route(fast)], hedging=True, min_samples=1)
+    router.routes[0].latencies.append(0.01)
+    tokens = []
+
+    async def main():
+        result = await router.run_async("prompt", streaming_callback=lambda chunk: tokens.append(chunk.content))
+        await asyncio.sleep(0)
+        return result
+
+    result = asyncio.run(main())
+
+    assert result["replies"] == ["answer of fast"]
+    assert tokens == ["answer", "of", "fast"]
+    assert slow.calls == 1 and slow.cancelled == 1
+
+
+def test_no_hedging_without_samples():
+    """A route without enough latencies isn't hedged."""
+    slow, fast = Generator("slow", delay=0.05), Generator("fast")
+    router = RouterGenerator([Route(slow), Route(fast)], hedging=True, min_samples=20)
+
+    assert asyncio.run(router.run_async("prompt"))["replies"] == ["answer of slow"]
+    assert fast.calls == 0
+
+
+def test_timeout_rescheduled_after_first_token():
+    """The timeout only covers the first token, a long streamed response isn't cut."""
+    router = RouterGenerator([Route(Generator("long", token_delay=0.05))], timeout=0.02)
+    tokens = []
+
+    result = asyncio.run(router.run_async("prompt", streaming_callback=lambda chunk: tokens.append(chunk.content)))
+
+    assert result["replies"] == ["answer of long"]
+    assert tokens == ["answer", "of", "long"]
+
+
+def test_timeout_before_first_token():
+    """A route without first token before the timeout fails over."""
+    slow, backup = Generator("slow", delay=1), Generator("backup")
+    router = RouterGenerator([Route(slow), Route(backup)], timeout=0.02)
+    tokens = []
+
+    result = asyncio.run(router.run_async("prompt", streaming_callback=lambda chunk: tokens.append(chunk.content)))
+
+    assert result["replies"] == ["answer of backup"]
+    assert tokens == ["answer", "of", "backup"]
+    assert slow.cancelled == 1
@@ -0,0 +1,138 @@
+import asyncio
+
+import pytest
+
+from needle.scheduler import BusyError, FairLimiter, Scheduler
+
+
+async def wait_turn(limiter: FairLimiter, client_id: str, served: list):
+    """Acquire a slot and record the client served."""
+    await limiter.acquire(client_id)
+    served.append(client_id)
+
+
+def test_fair_limiter_round_robin():
+    """The free slots are handed to the waiting clients in turn, not in arrival order."""
+
+    async def main():
+        limiter = FairLimiter(limit=1)
+        served = []
+
+        await limiter.acquire("holder")
+
+        # Client 'a' queues three turns before client 'b' queues one
+        tasks = [asyncio.create_task(wait_turn(limiter, client_id, served)) for client_id in ("a", "a", "a", "b")]
+        await asyncio.sleep(0)
+
+        for _ in tasks:
+            limiter.release()
+            await asyncio.sleep(0)
+
+        await asyncio.gather(*tasks)
+        return served
+
+    assert asyncio.run(main()) == ["a", "b", "a", "a"]
+
+
+def test_fair_limiter_queue_full():
+    """A turn is rejected when the waiting queue is full."""
+
+    async def main():
+        limiter = FairLimiter(limit=1, max_waiting=1)
+
+        await limiter.acquire("a")
+        waiting = asyncio.create_task(limiter.acquire("b"))
+        await asyncio.sleep(0)
+
+        with pytest.raises(BusyError):
+            await limiter.acquire("c")
+
+        limiter.release()
+        await waiting
+        assert limiter.active == 1 and limiter.waiting == 0
+
+    asyncio.run(main())
+
+
+def test_fair_limiter_timeout():
+    """A turn waiting longer than the timeout is rejected and leaves the queue."""
+
+    async def main():
+        limiter = FairLimiter(limit=1, timeout=0.01)
+
+        await limiter.acquire("a")
+
+        with pytest.raises(BusyError):
+            await limiter.acquire("b")
+
+        assert limiter.waiting == 0 and not limiter.queues
+
+    asyncio.run(main())
+
+
+def test_fair_limiter_cancellation():
+    """A cancelled turn leaves the queue, the slot goes to the next turn."""
+
+    async def main():
+        limiter = FairLimiter(limit=1)
+        served = []
+
+        await limiter.acquire("a")
+        cancelled = asyncio.create_task(wait_turn(limiter, "b", served))
+        waiting = asyncio.create_task(wait_turn(limiter, "c", served))
+        await asyncio.sleep(0)
+
+        cancelled.cancel()
+        await asyncio.sleep(0)
+
+        limiter.release()
+        await waiting
+
+        assert served == ["c"]
+        assert limiter.active == 1 and limiter.waiting == 0
+
+    asyncio.run(main())
+
+
+def test_scheduler_single_flight():
+    """Identical chat turns in flight share a single generation (the subscribers see its latest response)."""
+    calls = []
+
+    async def generate():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        yield "partial"
+        yield "response"
+
+    async def consume(scheduler: Scheduler, client_id: str):
+        return [response async for response in scheduler.run("key", "model", client_id, generate)]
+
+    async def main():
+        scheduler = Scheduler(max_concurrency=1)
+        return await asyncio.gather(consume(scheduler, "a"), consume(scheduler, "b"))
+
+    assert [responses[-1] for responses in asyncio.run(main())] == ["response", "response"]
+    assert len(calls) == 1
+
+
+def test_scheduler_single_flight_error():
+    """The error of a shared generation is raised to every subscriber, the slot is released."""
+
+    async def generate():
+        await asyncio.sleep(0.01)
+        raise ValueError("generation failed")
+        yield ""
+
+    async def consume(scheduler: Scheduler, client_id: str):
+        return [response async for response in scheduler.run("key", "model", client_id, generate)]
+
+    async def main():
+        scheduler = Scheduler(max_concurrency=1)
+        results = await asyncio.gather(consume(scheduler, "a"), consume(scheduler, "b"), return_exceptions=True)
+
+        assert scheduler.get_limiter("model").active == 0
+        assert not scheduler.flights
+        return results
+
+    results = asyncio.run(main())
+    assert all(isinstance(result, ValueError) for result in results)
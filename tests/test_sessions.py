@@ -0,0 +1,137 @@
+import subprocess
+import sys
+
+import pytest
+
+from needle.sessions import SessionStore, SQLiteSessionStore, get_session_store
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_store(request, tmp_path, clock, monkeypatch):
+    """Factory of the session stores of each backend (the in-process store uses the monotonic clock)."""
+    monkeypatch.setattr("time.monotonic", clock)
+
+    def make_store(ttl: float = 3600, max_sessions: int = 10_000) -> SessionStore:
+        return get_session_store(request.param, path=tmp_path / "sessions.sqlite3", ttl=ttl, max_sessions=max_sessions)
+
+    return make_store
+
+
+def make_turn(question: str, response: str):
+    """Messages of a conversation turn."""
+    return [{"role": "user", "content": question}, {"role": "assistant", "content": response}]
+
+
+def test_replace_delta(make_store):
+    """The messages are replaced from a position, the metadata of the chatbot isn't stored."""
+    store = make_store()
+
+    store.replace("session", 0, [{"role": "user", "content": "one", "metadata": {"title": None}}])
+    store.replace("session", 1, [{"role": "assistant", "content": "two"}])
+    store.replace("session", 2, make_turn("three", "four"))
+    assert store.get("session") == make_turn("one", "two") + make_turn("three", "four")
+
+    store.replace("session", 3, [{"role": "assistant", "content": "other"}])
+    assert store.get("session") == make_turn("one", "two") + make_turn("three", "other")
+
+    store.truncate("session", 2)
+    assert store.get("session") == make_turn("one", "two")
+
+
+def test_replace_after_end(make_store):
+    """A start after the end of the conversation appends the messages."""
+    store = make_store()
+
+    store.replace("session", 0, make_turn("one", "two"))
+    store.replace("session", 10, make_turn("three", "four"))
+
+    assert store.get("session") == make_turn("one", "two") + make_turn("three", "four")
+
+
+def test_unknown_session(make_store):
+    """An unknown session has no message."""
+    assert make_store().get("unknown") == []
+
+
+def test_clear(make_store):
+    """A cleared conversation is empty, the other sessions are kept."""
+    store = make_store()
+
+    store.replace("session", 0, make_turn("one", "two"))
+    store.replace("other", 0, make_turn("three", "four"))
+    store.clear("session")
+
+    assert store.get("session") == []
+    assert store.get("other") == make_turn("three", "four")
+
+
+def test_ttl(make_store, clock):
+    """An inactive session is expired after the TTL, reading a session keeps it alive."""
+    store = make_store(ttl=60)
+
+    store.replace("active", 0, make_turn("one", "two"))
+    store.replace("inactive", 0, make_turn("three", "four"))
+
+    clock.now += 50
+    assert store.get("active") == make_turn("one", "two")
+
+    clock.now += 20
+    assert store.get("active") == make_turn("one", "two")
+    assert store.get("inactive") == []
+
+
+def test_lru_eviction(make_store, clock):
+    """The least recently used session is evicted beyond the maximum number of sessions."""
+    store = make_store(max_sessions=2)
+
+    store.replace("first", 0, make_turn("one", "two"))
+    clock.now += 1
+    store.replace("second", 0, make_turn("three", "four"))
+
+    # The first session is used again, the second one becomes the least recently used
+    clock.now += 1
+    store.get("first")
+
+    clock.now += 1
+    store.replace("third", 0, make_turn("five", "six"))
+
+    assert store.get("first") == make_turn("one", "two")
+    assert store.get("second") == []
+    assert store.get("third") == make_turn("five", "six")
+
+
+def test_sqlite_clear_cascade(tmp_path):
+    """The messages of a cleared session are removed with it."""
+    store = SQLiteSessionStore(tmp_path / "sessions.sqlite3")
+
+    store.replace("session", 0, make_turn("one", "two"))
+    store.clear("session")
+
+    assert store.connection.execute("SELECT COUNT(*) FROM messages").fetchone() == (0,)
+
+
+def test_sqlite_reconnect_after_fork(tmp_path, monkeypatch):
+    """A forked worker opens its own connection, the sessions are shared."""
+    store = SQLiteSessionStore(tmp_path / "sessions.sqlite3")
+    store.replace("session", 0, make_turn("one", "two"))
+    connection = store.connection
+
+    monkeypatch.setattr("os.getpid", lambda: -1)
+
+    assert store.connection is not connection
+    assert store.get("session") == make_turn("one", "two")
+
+
+def test_sqlite_shared_by_processes(tmp_path):
+    """A session written by another process is read by this one."""
+    path = tmp_path / "sessions.sqlite3"
+    store = SQLiteSessionStore(path)
+    store.replace("session", 0, [{"role": "user", "content": "one"}])
+
+    code = (
+        "from needle.sessions import SQLiteSessionStore; "
+        f"SQLiteSessionStore({str(path)!r}).replace('session', 1, [{{'role': 'assistant', 'content': 'two'}}])"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)  # noqa: S603
+
+    assert store.get("session") == make_turn("one", "two")
@@ -0,0 +1,109 @@
+import numpy as np
+import pytest
+
+from needle.vectors import IVFIndex, exact_search, get_top_k
+
+
+def make_vectors(count: int, dimension: int = 16, seed: int = 0) -> np.ndarray:
+    """Random normalized vectors."""
+    vectors = np.random.default_rng(seed).standard_normal((count, dimension), dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def test_get_top_k():
+    """The best positions are sorted by decreasing score, `top_k` is clamped to the number of scores."""
+    scores = np.array([0.1, 0.9, 0.5, 0.7], dtype=np.float32)
+
+    assert get_top_k(scores, 2).tolist() == [1, 3]
+    assert get_top_k(scores, 10).tolist() == [1, 3, 2, 0]
+    assert get_top_k(scores, 0).tolist() == []
+
+
+def test_exact_search():
+    """The exact search returns the most similar vectors."""
+    matrix = make_vectors(100)
+    rows, scores = exact_search(matrix, matrix[42], top_k=3)
+
+    assert rows[0] == 42
+    assert scores[0] == pytest.approx(1, abs=1e-5)
+    assert np.all(np.diff(scores) <= 0)
+
+
+def test_ivf_all_probes_exact(tmp_path):
+    """Probing every list gives the result of the exact search."""
+    matrix = make_vectors(500)
+    index = IVFIndex.build(matrix, tmp_path, lists=10)
+
+    for query in make_vectors(20, seed=1):
+        rows, scores = index.search(matrix, query, top_k=5, probes=10)
+        expected_rows, expected_scores = exact_search(matrix, query, top_k=5)
+
+        assert rows.tolist() == expected_rows.tolist()
+        assert np.allclose(scores, expected_scores)
+
+
+def test_ivf_recall(tmp_path):
+    """With a few probes, most of the exact neighbours are found (clustered vectors)."""
+    rng = np.random.default_rng(0)
+    centers = make_vectors(20, seed=2)
+    matrix = centers[rng.integers(20, size=2000)] + 0.1 * rng.standard_normal((2000, 16), dtype=np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+
+    index = IVFIndex.build(matrix, tmp_path, lists=20)
+    recalls = []
+
+    for query in matrix[rng.integers(2000, size=50)]:
+        rows, _ = index.search(matrix, query, top_k=10, probes=4)
+        expected, _ = exact_search(matrix, query, top_k=10)
+        recalls.append(len(set(rows.tolist()) & set(expected.tolist())) / 10)
+
+    assert np.mean(recalls) >= 0.9
+
+
+def test_ivf_every_row_indexed(tmp_path):
+    """Each row of the matrix is in exactly one list."""
+    index = IVFIndex.build(make_vectors(300), tmp_path, lists=7)
+
+    assert len(index.centroids) == 7
+    assert sorted(index.rows.tolist()) == list(range(300))
+    assert index.offsets[0] == 0 and index.offsets[-1] == 300
+
+
+def test_ivf_more_lists_than_vectors(tmp_path):
+    """The number of lists is clamped to the number of vectors."""
+    matrix = make_vectors(5)
+    index = IVFIndex.build(matrix, tmp_path, lists=50)
+
+    assert len(index.centroids) == 5
+
+    rows, _ = index.search(matrix, matrix[3], top_k=2, probes=50)
+    assert rows.tolist() == exact_search(matrix, matrix[3], top_k=2)[0].tolist()
+
+
+def test_ivf_empty_matrix(tmp_path):
+    """An empty matrix gives an empty index, its searches return nothing."""
+    matrix = np.zeros((0, 16), dtype=np.float32)
+    index = IVFIndex.build(matrix, tmp_path)
+
+    rows, scores = index.search(matrix, make_vectors(1)[0], top_k=5)
+
+    assert len(rows) == 0 and len(scores) == 0
+
+
+def test_ivf_float16_memmap(tmp_path):
+    """The index is built on the memory-mapped float16 matrix of the ingestion."""
+    vectors = make_vectors(200)
+    matrix = np.lib.format.open_memmap(tmp_path / "embeddings.npy", mode="w+", dtype=np.float16, shape=vectors.shape)
+    matrix[:] = vectors
+    matrix.flush()
+
+    index = IVFIndex.build(matrix, tmp_path, lists=4)
+    rows, _ = index.search(matrix, vectors[7], top_k=1, probes=4)
+
+    assert rows.tolist() == [7]
+
+
+def test_ivf_not_found(tmp_path):
+    """Loading a missing index fails."""
+    with pytest.raises(FileNotFoundError):
+        IVFIndex(tmp_path)